@@ -1,5 +1,6 @@
 import type { GraphMakerState } from '@milaboratories/graph-maker';
 import type {
+  ImportFileHandle,
   PColumnIdAndSpec,
   PColumnSpec,
   PFrameHandle,
@@ -24,6 +25,13 @@ export type BlockArgs = {
   similarityType: 'sequence-identity' | 'blosum40' | 'blosum50' | 'blosum62' | 'blosum80' | 'blosum90';
   coverageThreshold: number;
   coverageMode: 0 | 1 | 2 | 3 | 4 | 5;
+  // Coarser identities, finest first, clustered hierarchically after `identity`
+  cascadeIdentities?: number[];
+  // Run MMseqs2 as cacheable single-step stages instead of cascaded easy-cluster
+  singleStepClustering?: boolean;
+  // Paratope FASTA and cluster TSV of a previous run; with both, only new or changed paratopes are clustered
+  previousFasta?: ImportFileHandle;
+  previousClusters?: ImportFileHandle;
   mem?: number;
   cpu?: number;
 };
@@ -34,6 +42,7 @@ export type UiState = {
   alignmentModel: PlMultiSequenceAlignmentModel;
   graphStateHistogram: GraphMakerState;
   graphStateProbDist: GraphMakerState;
+  graphStateProbProfile: GraphMakerState;
 };
 
 export const model = BlockModel.create()
@@ -82,6 +91,12 @@ export const model = BlockModel.create()
       currentTab: null,
       layersSettings: {},
     },
+    graphStateProbProfile: {
+      title: 'Parapred score by CDR position',
+      template: 'line',
+      currentTab: null,
+      layersSettings: {},
+    },
   })
 
   .argsValid((ctx) => ctx.args.datasetRef !== undefined)
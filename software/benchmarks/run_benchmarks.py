@@ -0,0 +1,296 @@
+"""
+Benchmarks of the paratope clustering software on synthetic repertoires.
+
+Every stage runs in its own process so peak RSS is measured per stage:
+
+  build_flanked_cdrs   run_parapred_pipeline.build_flanked_cdrs on the input table
+  predict_batch        Parapred inference on unique flanked CDRs (up to --predict-limit;
+                       skipped when torch / parapred-pytorch are not installed)
+  extract_paratopes    gather_cdr_probabilities + extract_paratopes on stand-in probabilities
+  histogram            probability histogram and per-region profile of the CDR residues
+  process_results      process_results.py end to end, and each of its [TIMING] stages
+
+Results (seconds, items per second, peak RSS) are printed and can be saved as a
+JSON baseline; --compare fails when a stage got slower or larger than the
+baseline by more than the allowed ratio and by more than an absolute minimum
+(--min-delta, --min-rss-delta), so timer and allocator noise on fast, small
+stages is not reported. Baselines are machine specific: record them on the
+machine that runs the comparison.
+
+    python run_benchmarks.py --scales 10000 100000 --save-baseline baseline.json
+    python run_benchmarks.py --scales 10000 100000 --compare baseline.json
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import re
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+import polars as pl
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(os.path.dirname(BENCHMARKS_DIR), "src")
+sys.path.insert(0, SRC_DIR)
+
+import parapred_engine as engine  # noqa: E402
+import synthetic_repertoire  # noqa: E402
+from run_parapred_pipeline import (  # noqa: E402
+    _NA_VALUES,
+    build_flanked_cdrs,
+    cdr_residue_matrix,
+    detect_chain_sets,
+    extract_paratopes,
+    gather_cdr_probabilities,
+    plan_batches,
+)
+from probability_profile import ProbabilityProfile  # noqa: E402
+
+STAGES = ["build_flanked_cdrs", "predict_batch", "extract_paratopes", "histogram", "process_results"]
+
+_TIMING_LINE = re.compile(r"^\[TIMING\] (.+): ([0-9.]+)s$")
+
+
+def peak_rss_mb():
+    """Peak RSS of this process in MiB."""
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2**20
+
+
+def children_peak_rss_mb():
+    scale = 1 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale / 2**20
+
+
+def read_input(data_dir):
+    """Pipeline input table read in one piece, as read_chunks() reads each chunk."""
+    df = pl.read_csv(
+        os.path.join(data_dir, "input.tsv"), separator="\t", infer_schema_length=0, null_values=_NA_VALUES
+    ).fill_null("")
+    return df, detect_chain_sets(df.columns)
+
+
+def stand_in_probabilities(entries):
+    """
+    Unique-sequence probability matrix with deterministic values and the entries'
+    rows in it, as the pipeline keeps them; only the layout matters for extraction.
+    """
+    flanked = entries["flanked"]
+    unique = flanked.filter(flanked != "").unique(maintain_order=True)
+    entries = entries.join(
+        pl.DataFrame({"flanked": unique, "uidx": pl.int_range(len(unique), eager=True, dtype=pl.Int64)}),
+        on="flanked", how="left", maintain_order="left",
+    ).with_columns(pl.col("uidx").fill_null(-1))
+    rng = np.random.default_rng(0)
+    probs = rng.random((len(unique), engine.MAX_LENGTH), dtype=np.float32)
+    lengths = unique.str.len_chars().to_numpy().astype(np.int32)
+    lengths[lengths > engine.MAX_LENGTH] = 0
+    return entries, probs, lengths
+
+
+def run_stage(stage, data_dir, args):
+    """Runs one stage in this process; returns (seconds, items, extra)."""
+    df, chain_sets = read_input(data_dir)
+    if stage == "build_flanked_cdrs":
+        t0 = time.perf_counter()
+        build_flanked_cdrs(df, chain_sets)
+        return time.perf_counter() - t0, len(df), {}
+
+    entries = build_flanked_cdrs(df, chain_sets)
+    if stage == "predict_batch":
+        flanked = entries["flanked"]
+        sequences = flanked.filter(flanked != "").unique(maintain_order=True).head(args.predict_limit).to_list()
+        t0 = time.perf_counter()
+        engine.import_runtime()
+        model = engine.load_model()
+        load_seconds = time.perf_counter() - t0
+        batches, _ = plan_batches(sequences)
+        t0 = time.perf_counter()
+        for _ in engine.predict_sequences(model, [[sequences[i] for i in batch] for batch in batches]):
+            pass
+        return time.perf_counter() - t0, len(sequences), {"load_seconds": round(load_seconds, 3)}
+
+    if stage in ("extract_paratopes", "histogram"):
+        entries, probs, lengths = stand_in_probabilities(entries)
+        entries_per_row = 3 * len(chain_sets)
+        if stage == "extract_paratopes":
+            t0 = time.perf_counter()
+            cdr_probs, valid, _ = gather_cdr_probabilities(entries, probs, lengths)
+            cdr_residues = cdr_residue_matrix(entries, cdr_probs.shape[1])
+            extract_paratopes(cdr_residues, cdr_probs, valid, 0.5, entries_per_row)
+            return time.perf_counter() - t0, len(df), {}
+        cdr_probs, valid, _ = gather_cdr_probabilities(entries, probs, lengths)
+        cdr_lengths = entries["cdr_end"].to_numpy() - entries["cdr_start"].to_numpy()
+        t0 = time.perf_counter()
+        np.histogram(cdr_probs[valid], bins=np.linspace(0.0, 1.0, 11))
+        ProbabilityProfile(len(chain_sets), 0.5).update(cdr_probs, valid, cdr_lengths)
+        return time.perf_counter() - t0, int(valid.sum()), {}
+
+    raise ValueError(f"Unknown stage: {stage}")
+
+
+def run_process_results(data_dir):
+    """process_results.py in a scratch copy of the inputs; returns (seconds, clonotypes, extra)."""
+    work_dir = os.path.join(data_dir, "process_results")
+    os.makedirs(work_dir, exist_ok=True)
+    for name in ["cloneTable.tsv", "paratopeSequences.tsv", "clusters.tsv"]:
+        target = os.path.join(work_dir, name)
+        if not os.path.exists(target):
+            os.symlink(os.path.join(os.path.abspath(data_dir), name), target)
+    t0 = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, os.path.join(SRC_DIR, "process_results.py")],
+        cwd=work_dir, capture_output=True, text=True,
+    )
+    seconds = time.perf_counter() - t0
+    if result.returncode != 0:
+        raise RuntimeError(f"process_results.py failed:\n{result.stderr}")
+    stages = {}
+    for line in result.stdout.splitlines():
+        match = _TIMING_LINE.match(line)
+        if match:
+            stages[match.group(1)] = float(match.group(2))
+    clonotypes = pl.scan_csv(os.path.join(data_dir, "paratopeSequences.tsv"), separator="\t").select(pl.len()).collect().item()
+    return seconds, clonotypes, {"stages": stages}
+
+
+def worker(args):
+    """Entry point of the per-stage subprocess: prints one JSON result line."""
+    if args.stage == "process_results":
+        seconds, items, extra = run_process_results(args.data_dir)
+        rss = children_peak_rss_mb()
+    else:
+        seconds, items, extra = run_stage(args.stage, args.data_dir, args)
+        rss = peak_rss_mb()
+    print(json.dumps({"seconds": seconds, "items": items, "max_rss_mb": rss, **extra}))
+
+
+def parapred_available():
+    return all(importlib.util.find_spec(name) is not None for name in ("torch", "parapred"))
+
+
+def dataset_dir(work_dir, scale, chains, seed):
+    """Generate (once) and return the directory of a synthetic dataset."""
+    path = os.path.join(work_dir, f"repertoire-{scale}-{chains}ch-seed{seed}")
+    if not os.path.exists(os.path.join(path, "clusters.tsv")):
+        t0 = time.time()
+        synthetic_repertoire.write(path, scale, chains=chains, seed=seed)
+        print(f"Generated {path}: {time.time() - t0:.1f}s", file=sys.stderr)
+    return path
+
+
+def compare(results, baseline, max_slowdown, max_rss_growth, min_delta=0.0, min_rss_delta=0.0):
+    """
+    Returns the list of regressions of results against a baseline: a stage regressed when it
+    exceeds the baseline both by the allowed ratio and by the absolute minimum (seconds, MiB).
+    """
+    reference = {(r["stage"], r["scale"], r["chains"]): r for r in baseline["results"]}
+    regressions = []
+    for result in results:
+        ref = reference.get((result["stage"], result["scale"], result["chains"]))
+        if ref is None or "seconds" not in ref or "seconds" not in result:
+            continue
+        if (result["seconds"] > ref["seconds"] * max_slowdown
+                and result["seconds"] - ref["seconds"] > min_delta):
+            regressions.append(f"{result['stage']} @ {result['scale']} x{result['chains']}: "
+                               f"{result['seconds']:.3f}s vs {ref['seconds']:.3f}s baseline")
+        if (result["max_rss_mb"] > ref["max_rss_mb"] * max_rss_growth
+                and result["max_rss_mb"] - ref["max_rss_mb"] > min_rss_delta):
+            regressions.append(f"{result['stage']} @ {result['scale']} x{result['chains']}: "
+                               f"{result['max_rss_mb']:.0f} MiB vs {ref['max_rss_mb']:.0f} MiB baseline")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the paratope clustering software on synthetic data")
+    parser.add_argument("--scales", type=int, nargs="+", default=[10_000, 100_000, 1_000_000],
+                        help="Numbers of clonotypes")
+    parser.add_argument("--chains", type=int, nargs="+", choices=[1, 2], default=[1, 2],
+                        help="Chain layouts: 1 plain FR/CDR columns, 2 heavy + light (CDR1_0, CDR1_1, ...)")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES)
+    parser.add_argument("--predict-limit", type=int, default=20_000,
+                        help="Unique sequences run through Parapred in predict_batch")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--work-dir", default="benchmark-data", help="Where synthetic datasets are generated")
+    parser.add_argument("--save-baseline", default=None, help="Write results as a baseline JSON")
+    parser.add_argument("--compare", default=None, help="Baseline JSON to compare against")
+    parser.add_argument("--max-slowdown", type=float, default=1.25, help="Allowed time ratio to the baseline")
+    parser.add_argument("--max-rss-growth", type=float, default=1.25, help="Allowed peak RSS ratio to the baseline")
+    parser.add_argument("--min-delta", type=float, default=0.05,
+                        help="Slowdowns of at most this many seconds are never regressions")
+    parser.add_argument("--min-rss-delta", type=float, default=16,
+                        help="Peak RSS growth of at most this many MiB is never a regression")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--stage", help=argparse.SUPPRESS)
+    parser.add_argument("--data-dir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(args)
+        return
+
+    has_parapred = parapred_available()
+    results = []
+    print(f"{'stage':<48} {'scale':>9} {'chains':>6} {'seconds':>9} {'items/s':>12} {'peak MiB':>9}")
+    for scale in args.scales:
+        for chains in args.chains:
+            data_dir = dataset_dir(args.work_dir, scale, chains, args.seed)
+            for stage in args.stages:
+                result = {"stage": stage, "scale": scale, "chains": chains}
+                if stage == "predict_batch" and not has_parapred:
+                    result["skipped"] = "torch / parapred-pytorch not installed"
+                    results.append(result)
+                    print(f"{stage:<48} {scale:>9} {chains:>6} {'skipped: ' + result['skipped']:>40}")
+                    continue
+
+                completed = subprocess.run(
+                    [sys.executable, __file__, "--worker", "--stage", stage, "--data-dir", data_dir,
+                     "--predict-limit", str(args.predict_limit)],
+                    capture_output=True, text=True,
+                )
+                if completed.returncode != 0:
+                    sys.exit(f"Stage {stage} failed at scale {scale}:\n{completed.stderr}")
+                measured = json.loads(completed.stdout.strip().splitlines()[-1])
+                result.update(measured)
+                result["throughput"] = measured["items"] / measured["seconds"] if measured["seconds"] else None
+                results.append(result)
+                print(f"{stage:<48} {scale:>9} {chains:>6} {result['seconds']:>9.3f} "
+                      f"{result['throughput'] or 0:>12.0f} {result['max_rss_mb']:>9.0f}")
+                for name, seconds in measured.get("stages", {}).items():
+                    print(f"  {name:<46} {'':>9} {'':>6} {seconds:>9.2f}")
+
+    report = {
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "polars": pl.__version__,
+            "numpy": np.__version__,
+        },
+        "results": results,
+    }
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.max_slowdown, args.max_rss_growth,
+                              args.min_delta, args.min_rss_delta)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions against {args.compare}")
+
+
+if __name__ == "__main__":
+    main()
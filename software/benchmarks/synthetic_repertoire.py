@@ -0,0 +1,205 @@
+"""
+Deterministic synthetic antibody repertoires for benchmarks.
+
+Clonotypes come in clonal families: each family picks a human germline
+(IGHV3-23, IGHV1-69, IGHV4-34 heavy; IGKV1-39, IGKV3-20 light) and a CDR3, and
+its members carry somatic mutations on top. Writes the tables the software reads:
+
+  input.tsv               run_parapred_pipeline.py input: clonotypeKey, FR1..FR4 / CDR1..CDR3
+                          (FR1_0, CDR1_0, ... FR4_1 with --chains 2)
+  cloneTable.tsv          process_results.py input: sampleId, clonotypeKey, abundance,
+                          sequence_* (CDR3 per chain), clonotypeKeyLabel
+  paratopeSequences.tsv   clonotypeKey, paratope_sequence (X-masked CDRs), flanked_sequence
+  clusters.tsv            MMseqs2-style clusters: one cluster per clonal family
+
+    python synthetic_repertoire.py --clonotypes 100000 --chains 2 --output-dir data
+"""
+
+import argparse
+import os
+
+import numpy as np
+import polars as pl
+
+AMINO_ACIDS = np.frombuffer(b"ACDEFGHIKLMNPQRSTVWY", dtype=np.uint8)
+# CDR3 junction residue usage, enriched in Y, G, S and D like human repertoires
+CDR3_WEIGHTS = np.array([7, 1, 7, 3, 3, 11, 2, 2, 2, 4, 2, 2, 4, 2, 5, 9, 5, 5, 3, 12], dtype=np.float64)
+CDR3_WEIGHTS /= CDR3_WEIGHTS.sum()
+
+REGIONS = ["FR1", "CDR1", "FR2", "CDR2", "FR3", "CDR3", "FR4"]
+
+# FR1, CDR1, FR2, CDR2, FR3 of V germlines (IMGT amino acid sequences) and FR4 of the J germline
+HEAVY_GERMLINES = [
+    ("EVQLLESGGGLVQPGGSLRLSCAAS", "GFTFSSYA", "MSWVRQAPGKGLEWVS", "ISGSGGST",
+     "YYADSVKGRFTISRDNSKNTLYLQMNSLRAEDTAVYYC", "WGQGTLVTVSS"),
+    ("QVQLVQSGAEVKKPGSSVKVSCKAS", "GGTFSSYA", "ISWVRQAPGQGLEWMG", "IIPIFGTA",
+     "NYAQKFQGRVTITADESTSTAYMELSSLRSEDTAVYYC", "WGQGTTVTVSS"),
+    ("QVQLQQWGAGLLKPSETLSLTCAVY", "GGSFSGYY", "WSWIRQPPGKGLEWIG", "INHSGST",
+     "NYNPSLKSRVTISVDTSKNQFSLKLSSVTAADTAVYYC", "WGRGTLVTVSS"),
+]
+LIGHT_GERMLINES = [
+    ("DIQMTQSPSSLSASVGDRVTITCRAS", "QSISSY", "LNWYQQKPGKAPKLLIY", "AAS",
+     "SLQSGVPSRFSGSGSGTDFTLTISSLQPEDFATYYC", "FGQGTKVEIK"),
+    ("EIVLTQSPGTLSLSPGERATLSCRAS", "QSVSSSY", "LAWYQQKPGQAPRLLIY", "GAS",
+     "SRATGIPDRFSGSGSGTDFTLTISRLEPEDFAVYYC", "FGGGTKVEIK"),
+]
+# CDR3: conserved ends, junction length (mean, sd, min, max)
+HEAVY_CDR3 = ("AR", "DY", (10, 3, 2, 22))
+LIGHT_CDR3 = ("QQ", "T", (6, 1, 3, 10))
+
+FR_MUTATION_RATE = 0.01
+CDR_MUTATION_RATE = 0.04
+# Share of CDR residues Parapred would call paratope
+PARATOPE_RATE = 0.45
+
+
+def _matrix(strings):
+    """Strings -> zero-padded uint8 matrix and lengths."""
+    lengths = np.fromiter(map(len, strings), dtype=np.int64, count=len(strings))
+    width = int(lengths.max()) if len(strings) else 0
+    padded = np.array([s.encode("ascii") for s in strings], dtype=f"S{max(width, 1)}")
+    matrix = np.frombuffer(padded.tobytes(), dtype=np.uint8).reshape(len(strings), max(width, 1)).copy()
+    return matrix, lengths
+
+
+def _strings(matrix):
+    """Zero-padded uint8 matrix -> list of strings (trailing zero bytes dropped)."""
+    if matrix.shape[1] == 0:
+        return [""] * len(matrix)
+    return np.char.decode(np.ascontiguousarray(matrix).view(f"S{matrix.shape[1]}").ravel(), "ascii").tolist()
+
+
+def _mutate(matrix, lengths, rate, rng):
+    """Point mutations at the given per-residue rate, in place."""
+    mask = (rng.random(matrix.shape) < rate) & (np.arange(matrix.shape[1]) < lengths[:, None])
+    matrix[mask] = rng.choice(AMINO_ACIDS, size=int(mask.sum()))
+    return matrix
+
+
+def family_sizes(num_clonotypes, rng):
+    """Clonal family of every clonotype; family sizes are geometric with mean ~3."""
+    sizes = rng.geometric(0.35, size=num_clonotypes)
+    family_of = np.repeat(np.arange(num_clonotypes), sizes)[:num_clonotypes]
+    return family_of, int(family_of[-1]) + 1 if num_clonotypes else 0
+
+
+def generate_chain(family_of, num_families, germlines, cdr3, rng):
+    """Region -> list of per-clonotype strings for one chain, plus CDR matrices for paratopes."""
+    germline = rng.integers(len(germlines), size=num_families)
+    prefix, suffix, (mean, sd, low, high) = cdr3
+    junction_lengths = np.clip(np.rint(rng.normal(mean, sd, size=num_families)), low, high).astype(np.int64)
+    junctions = rng.choice(AMINO_ACIDS, size=(num_families, high), p=CDR3_WEIGHTS)
+    junctions[np.arange(high) >= junction_lengths[:, None]] = 0
+    ancestors_cdr3 = [prefix + s + suffix for s in _strings(junctions)]
+
+    chain = {}
+    cdr_matrices = []
+    for region in REGIONS:
+        if region == "CDR3":
+            ancestors = ancestors_cdr3
+        else:
+            column = {"FR1": 0, "CDR1": 1, "FR2": 2, "CDR2": 3, "FR3": 4, "FR4": 5}[region]
+            ancestors = [germlines[g][column] for g in germline]
+        matrix, lengths = _matrix(ancestors)
+        matrix, lengths = matrix[family_of], lengths[family_of]
+        rate = CDR_MUTATION_RATE if region.startswith("CDR") else FR_MUTATION_RATE
+        _mutate(matrix, lengths, rate, rng)
+        chain[region] = _strings(matrix)
+        if region.startswith("CDR"):
+            cdr_matrices.append((matrix, lengths))
+    return chain, cdr_matrices
+
+
+def paratopes(cdr_matrices, family_of, rng):
+    """X-masked paratope strings: the same family shares most of its paratope positions."""
+    parts = []
+    for matrix, lengths in cdr_matrices:
+        family_mask = rng.random((int(family_of.max()) + 1, matrix.shape[1])) < PARATOPE_RATE
+        keep = family_mask[family_of] ^ (rng.random(matrix.shape) < 0.05)
+        in_cdr = np.arange(matrix.shape[1]) < lengths[:, None]
+        parts.append(_strings(np.where(in_cdr, np.where(keep, matrix, ord("X")), 0).astype(np.uint8)))
+    return ["".join(p) for p in zip(*parts)]
+
+
+def generate(num_clonotypes, chains=1, samples=4, seed=0):
+    """
+    Returns (input_table, clone_table, paratope_table, clusters) polars frames for a
+    repertoire of num_clonotypes clonotypes with 1 (heavy) or 2 (heavy + light) chains.
+    """
+    rng = np.random.default_rng(seed)
+    family_of, num_families = family_sizes(num_clonotypes, rng)
+    keys = [f"c{i:09d}" for i in range(num_clonotypes)]
+
+    chain_specs = [(HEAVY_GERMLINES, HEAVY_CDR3), (LIGHT_GERMLINES, LIGHT_CDR3)][:chains]
+    input_columns = {"clonotypeKey": keys}
+    sequence_columns = {}
+    paratope_parts, flanked_parts = [], []
+    for chain_idx, (germlines, cdr3) in enumerate(chain_specs):
+        chain, cdr_matrices = generate_chain(family_of, num_families, germlines, cdr3, rng)
+        suffix = f"_{chain_idx}" if chains > 1 else ""
+        for region in REGIONS:
+            input_columns[region + suffix] = chain[region]
+        sequence_columns[f"sequence_{chain_idx}"] = chain["CDR3"]
+        paratope_parts.append(paratopes(cdr_matrices, family_of, rng))
+        frame = pl.DataFrame(chain)
+        flanked_parts.append(frame.select(pl.concat_str([
+            pl.col(left).str.slice(-2) + pl.col(cdr) + pl.col(right).str.slice(0, 2)
+            for left, cdr, right in [("FR1", "CDR1", "FR2"), ("FR2", "CDR2", "FR3"), ("FR3", "CDR3", "FR4")]
+        ])).to_series().to_list())
+
+    input_table = pl.DataFrame(input_columns)
+    paratope_table = pl.DataFrame({
+        "clonotypeKey": keys,
+        "paratope_sequence": ["".join(p) for p in zip(*paratope_parts)],
+        "flanked_sequence": ["".join(f) for f in zip(*flanked_parts)],
+    })
+
+    # Each clonotype is seen in one or more samples; counts are heavy-tailed
+    present = rng.random((num_clonotypes, samples)) < 1.5 / samples
+    present[np.arange(num_clonotypes), rng.integers(samples, size=num_clonotypes)] = True
+    rows, sample_idx = np.nonzero(present)
+    abundance = np.ceil(rng.pareto(1.2, size=len(rows)) + 1).astype(np.int64)
+    clone_table = pl.DataFrame({
+        "sampleId": pl.Series([f"S{i + 1}" for i in range(samples)])[sample_idx],
+        "clonotypeKey": pl.Series(keys)[rows],
+        "abundance": abundance,
+        **{name: pl.Series(values)[rows] for name, values in sequence_columns.items()},
+        "clonotypeKeyLabel": pl.Series([f"C-{i:06X}" for i in range(num_clonotypes)])[rows],
+    })
+
+    # First clonotype of a family is its representative
+    first = np.searchsorted(family_of, family_of)
+    clusters = pl.DataFrame({
+        "representative": pl.Series(keys)[first],
+        "member": keys,
+    }).select(
+        (pl.lit("s-") + pl.col("representative")).alias("representative"),
+        (pl.lit("s-") + pl.col("member")).alias("member"),
+    )
+    return input_table, clone_table, paratope_table, clusters
+
+
+def write(output_dir, num_clonotypes, chains=1, samples=4, seed=0):
+    """Generate a repertoire and write its tables to output_dir."""
+    os.makedirs(output_dir, exist_ok=True)
+    input_table, clone_table, paratope_table, clusters = generate(num_clonotypes, chains, samples, seed)
+    input_table.write_csv(os.path.join(output_dir, "input.tsv"), separator="\t")
+    clone_table.write_csv(os.path.join(output_dir, "cloneTable.tsv"), separator="\t")
+    paratope_table.write_csv(os.path.join(output_dir, "paratopeSequences.tsv"), separator="\t")
+    clusters.write_csv(os.path.join(output_dir, "clusters.tsv"), separator="\t", include_header=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a deterministic synthetic repertoire")
+    parser.add_argument("--clonotypes", type=int, default=10_000, help="Number of clonotypes")
+    parser.add_argument("--chains", type=int, choices=[1, 2], default=1,
+                        help="1: plain FR1/CDR1 columns, 2: heavy and light chain (FR1_0, FR1_1, ...)")
+    parser.add_argument("--samples", type=int, default=4, help="Number of samples in the clone table")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output-dir", default=".")
+    args = parser.parse_args()
+    write(args.output_dir, args.clonotypes, args.chains, args.samples, args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+"""
+Distance of cluster members to their centroid: Levenshtein distance of the
+paratopes divided by the centroid paratope length, capped at 1.0.
+
+Paratopes are X-masked and highly redundant, so distances are computed once per
+distinct (member, centroid) paratope pair and joined back to the members:
+
+  identical paratopes           0
+  empty centroid                1
+  length difference >= centroid 1: the edit distance is at least the difference
+  equal length, Hamming <= 2    Hamming / length: with equal lengths an edit distance
+                                of 1 is a single substitution, so up to 2 the
+                                Hamming distance is the edit distance
+  all other pairs               Levenshtein distance capped at the centroid length,
+                                bit-parallel over batches of pairs with numpy; a batch
+                                stops once all its pairs reached the cap. Batches run
+                                on a thread per available CPU (numpy releases the GIL)
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from parapred_engine import available_cpus
+
+# Pairs compared together in one batch
+_BATCH_PAIRS = 1 << 16
+# An equal-length pair differing in at most this many positions has edit distance = Hamming distance
+_EXACT_HAMMING = 2
+
+
+def _codes(strings, width):
+    """Code points of strings as a len(strings) x width matrix, 0-padded."""
+    width = max(width, 1)
+    return np.array(strings, dtype=f"<U{width}").view(np.uint32).reshape(len(strings), width)
+
+
+def _batches(indices, lengths):
+    """indices sorted by lengths, in batches of _BATCH_PAIRS."""
+    indices = indices[np.argsort(lengths[indices], kind="stable")]
+    return (indices[start:start + _BATCH_PAIRS] for start in range(0, len(indices), _BATCH_PAIRS))
+
+
+def hamming_distances(a, b):
+    """Number of differing positions of equal-length strings a[k] and b[k]."""
+    width = max(map(len, a), default=0)
+    return (_codes(a, width) != _codes(b, width)).sum(axis=1)
+
+
+# Columns between checks whether every pair of a batch reached its cap
+_CAP_CHECK_INTERVAL = 16
+
+
+def _add(a, b):
+    """a + b of multi-word unsigned integers (words x n, least significant word first)."""
+    if len(a) == 1:
+        return a + b
+    total = a + b
+    # A word overflowed when its sum is below an addend; adding a carry of 1 overflows only at the maximum
+    carry = total[0] < a[0]
+    for w in range(1, len(a)):
+        overflow = total[w] < a[w]
+        total[w] += carry
+        carry = overflow | (carry & (total[w] == 0))
+    return total
+
+
+def _shift_left(a, shift_in):
+    """(a << 1) | shift_in of multi-word unsigned integers."""
+    shifted = a << np.uint64(1)
+    shifted[0] |= np.uint64(shift_in)
+    shifted[1:] |= a[:-1] >> np.uint64(63)
+    return shifted
+
+
+def _vertical_sum(pv, mv):
+    """Sum of the vertical differences of a column: its bottom cell minus its top cell."""
+    return (np.bitwise_count(pv).sum(axis=0, dtype=np.int64)
+            - np.bitwise_count(mv).sum(axis=0, dtype=np.int64))
+
+
+def _letters(a_codes, b_codes):
+    """Code points as indices into the letters of b; letters absent from b get the last index."""
+    if max(int(a_codes.max()), int(b_codes.max())) < 256:
+        present = np.bincount(b_codes.ravel(), minlength=256) > 0
+        index = np.full(256, present.sum(), dtype=np.int64)
+        index[present] = np.arange(present.sum())
+        return index[a_codes], index[b_codes], int(present.sum())
+    alphabet, b_letters = np.unique(b_codes, return_inverse=True)
+    a_letters = np.where(np.isin(a_codes, alphabet), np.searchsorted(alphabet, a_codes), len(alphabet))
+    return a_letters, b_letters.reshape(b_codes.shape), len(alphabet)
+
+
+def _bit_vectors(mask, words):
+    """Boolean n x (words * 64) matrix as words x n bit vectors, bit i of the row at position i."""
+    return np.ascontiguousarray(np.packbits(mask, axis=1, bitorder="little").view("<u8").T)
+
+
+def capped_levenshtein(a, b, cap):
+    """
+    Levenshtein distance of strings a[k] and b[k], or cap[k] if it is at least cap[k].
+
+    Bit-parallel (Myers / Hyyro) over all pairs at once: b[k] is encoded as bit vectors
+    of 64-bit words, and each character of a[k] updates the column of vertical
+    differences with a few word operations, so the work is len(a) x words per pair
+    rather than len(a) x len(b).
+    """
+    n = len(a)
+    a_len = np.fromiter(map(len, a), dtype=np.int64, count=n)
+    b_len = np.fromiter(map(len, b), dtype=np.int64, count=n)
+    cap = np.asarray(cap, dtype=np.int64)
+    # Distance to an empty string is the other length
+    result = np.minimum(np.maximum(a_len, b_len), cap)
+    # Longest a first: the pairs still being extended are always a prefix
+    pairs = np.flatnonzero((a_len > 0) & (b_len > 0))
+    pairs = pairs[np.argsort(-a_len[pairs], kind="stable")]
+    if len(pairs) == 0:
+        return result
+    a_len, b_len, cap = a_len[pairs], b_len[pairs], cap[pairs]
+    words = (int(b_len.max()) + 63) // 64
+    a_codes = _codes([a[k] for k in pairs], int(a_len.max()))
+    b_codes = _codes([b[k] for k in pairs], words * 64)
+    a_letters, b_letters, num_letters = _letters(a_codes, b_codes)
+
+    # peq[:, letter]: bit i of pair k set where b[k][i] is the letter; the extra last letter matches nothing
+    within = np.arange(words * 64) < b_len[:, None]
+    peq = np.zeros((words, num_letters + 1, len(pairs)), dtype=np.uint64)
+    for letter in range(num_letters):
+        peq[:, letter] = _bit_vectors((b_letters == letter) & within, words)
+    # Flat peq column of each pair's letter, column by column
+    peq = peq.reshape(words, -1)
+    a_letters = np.ascontiguousarray(a_letters.T) * len(pairs) + np.arange(len(pairs))
+
+    # Vertical positive / negative differences of the current column, within b's length;
+    # column 0 goes 0, 1, ..., len(b)
+    pv = _bit_vectors(within, words)
+    mv = np.zeros_like(pv)
+    lengths = pv.copy()
+    score = np.empty(len(pairs), dtype=np.int64)
+
+    active_until = np.searchsorted(-a_len, -np.arange(1, int(a_len[0]) + 1), side="right")
+    count = len(pairs)
+    for j, active in enumerate(active_until):
+        if active < count:
+            # Pairs whose a ended at column j: bottom cell = top cell (j) + vertical differences
+            score[active:count] = j + _vertical_sum(pv[:, active:count], mv[:, active:count])
+            pv, mv, lengths, count = pv[:, :active], mv[:, :active], lengths[:, :active], active
+        if j % _CAP_CHECK_INTERVAL == 0 and j:
+            # The final distance is at least the current bottom cell minus the columns left
+            bottom = j + _vertical_sum(pv, mv)
+            if np.all(bottom - (a_len[:count] - j) >= cap[:count]):
+                score[:count] = cap[:count]
+                count = 0
+                break
+        eq = peq.take(a_letters[j, :count], axis=1)
+        xv = eq | mv
+        xh = (_add(eq & pv, pv) ^ pv) | eq
+        ph = _shift_left(mv | ~(xh | pv), 1)
+        mh = _shift_left(pv & xh, 0)
+        pv = (mh | ~(xv | ph)) & lengths
+        mv = ph & xv & lengths
+    if count:
+        score[:count] = int(a_len[0]) + _vertical_sum(pv, mv)
+
+    result[pairs] = np.minimum(score, cap)
+    return result
+
+
+def centroid_distances(members, centroids):
+    """
+    Normalized distance of each member paratope to its centroid paratope:
+    min(1, Levenshtein distance / centroid length), 0 for identical paratopes and
+    1 for an empty centroid. members and centroids are equal-length sequences of strings;
+    pass distinct pairs, the result is per pair.
+    """
+    members = list(members)
+    centroids = list(centroids)
+    n = len(members)
+    member_len = np.fromiter(map(len, members), dtype=np.int64, count=n)
+    centroid_len = np.fromiter(map(len, centroids), dtype=np.int64, count=n)
+    differs = np.fromiter((m != c for m, c in zip(members, centroids)), dtype=bool, count=n)
+
+    # Edit distance capped at the centroid length; the cap is reached by the length difference alone
+    raw = np.where(differs, centroid_len, 0)
+    within_reach = differs & (np.abs(member_len - centroid_len) < centroid_len)
+
+    edit = [np.flatnonzero(within_reach & (member_len != centroid_len))]
+    for batch in _batches(np.flatnonzero(within_reach & (member_len == centroid_len)), centroid_len):
+        hamming = hamming_distances([members[k] for k in batch], [centroids[k] for k in batch])
+        exact = hamming <= _EXACT_HAMMING
+        raw[batch[exact]] = hamming[exact]
+        edit.append(batch[~exact])
+
+    def levenshtein(batch):
+        raw[batch] = capped_levenshtein(
+            [members[k] for k in batch], [centroids[k] for k in batch], centroid_len[batch]
+        )
+
+    with ThreadPoolExecutor(available_cpus()) as pool:
+        list(pool.map(levenshtein, _batches(np.concatenate(edit), centroid_len)))
+
+    return np.where(centroid_len > 0, raw / np.maximum(centroid_len, 1), differs.astype(np.float64))
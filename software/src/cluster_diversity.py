@@ -0,0 +1,159 @@
+"""
+Within-cluster paratope diversity: mean, median and 90th percentile of the
+normalized Levenshtein distance (distance / longer paratope) over all member
+pairs, and the most common paratope of each cluster.
+
+Members sharing a paratope are collapsed first: a pair of distinct paratopes
+stands for all member pairs between them, and pairs within one paratope are at
+distance 0. Clusters with up to `pair_budget` distinct-paratope pairs are
+computed exactly. Larger clusters are estimated from `pair_budget` member pairs
+drawn with a fixed seed, so results are reproducible; only distinct sampled
+pairs are aligned. All pairs of all clusters go through one parallel
+Levenshtein call.
+"""
+
+import numpy as np
+import polars as pl
+import polars_ds as pds
+
+DEFAULT_PAIR_BUDGET = 5000
+_SEED = 0
+
+
+def _exact_pairs(starts, sizes):
+    """All pairs i < j within each block of `sizes` rows starting at `starts`."""
+    # Row at position p of its block pairs with the size - 1 - p rows after it
+    position = np.arange(sizes.sum()) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+    rows = np.repeat(starts, sizes) + position
+    partners = np.repeat(sizes, sizes) - 1 - position
+    i = np.repeat(rows, partners)
+    step = np.arange(len(i)) - np.repeat(np.cumsum(partners) - partners, partners) + 1
+    return i, i + step
+
+
+def _sampled_pairs(member_starts, member_counts, member_ends, pair_budget, rng):
+    """
+    pair_budget pairs of two different members for each block of member_counts
+    members; returns the rows (distinct paratopes) the members belong to.
+    """
+    n = np.repeat(member_counts, pair_budget)
+    a = np.floor(rng.random(len(n)) * n).astype(np.int64)
+    b = np.floor(rng.random(len(n)) * (n - 1)).astype(np.int64)
+    b += b >= a
+    start = np.repeat(member_starts, pair_budget)
+    return (np.searchsorted(member_ends, start + a, side="right"),
+            np.searchsorted(member_ends, start + b, side="right"))
+
+
+def _normalized_distances(paratopes, i, j):
+    """Levenshtein distance / longer length for the pairs (i, j) of paratopes."""
+    if len(i) == 0:
+        return np.zeros(0, dtype=np.float64)
+    pairs = pl.DataFrame({"a": paratopes.gather(i), "b": paratopes.gather(j)})
+    distance, longer = pairs.select(
+        pds.str_leven("a", "b", parallel=True).cast(pl.Float64).alias("distance"),
+        pl.max_horizontal(pl.col("a").str.len_chars(), pl.col("b").str.len_chars()).alias("longer"),
+    ).get_columns()
+    longer = longer.to_numpy()
+    return np.where(longer > 0, distance.to_numpy() / np.maximum(longer, 1), 0.0)
+
+
+def _weighted_stats(groups, values, weights, num_groups):
+    """Weighted mean, median and 90th percentile of values per group; 0 for groups without values."""
+    order = np.lexsort((values, groups))
+    groups, values, weights = groups[order], values[order], weights[order]
+    total = np.bincount(groups, weights=weights, minlength=num_groups)
+    mean = np.divide(np.bincount(groups, weights=weights * values, minlength=num_groups), total,
+                     out=np.zeros(num_groups), where=total > 0)
+
+    if len(values) == 0:
+        return mean, np.zeros(num_groups), np.zeros(num_groups)
+
+    # First value of each group whose cumulative weight reaches q of the group total
+    cumulative = np.cumsum(weights)
+    before = np.concatenate([[0], cumulative])[np.searchsorted(groups, np.arange(num_groups))]
+    quantiles = []
+    for q in (0.5, 0.9):
+        index = np.minimum(np.searchsorted(cumulative, before + q * total, side="left"), len(values) - 1)
+        quantiles.append(np.where(total > 0, values[index], 0.0))
+    return mean, *quantiles
+
+
+def cluster_diversity(members, pair_budget=DEFAULT_PAIR_BUDGET):
+    """
+    members: DataFrame of clusterId, paratope_sequence (one row per clonotype).
+
+    Returns one row per cluster: clusterId, meanPairwiseDistance,
+    medianPairwiseDistance, p90PairwiseDistance (0 for single-member clusters),
+    mostCommonParatope, mostCommonParatopeFraction and pairsSampled.
+    """
+    distinct = members.select(
+        "clusterId", pl.col("paratope_sequence").fill_null("")
+    ).group_by("clusterId", "paratope_sequence").len("count").sort("clusterId", "paratope_sequence")
+
+    counts = distinct["count"].to_numpy().astype(np.int64)
+    clusters = distinct.group_by("clusterId", maintain_order=True).agg(
+        pl.len().alias("distinct"), pl.col("count").sum().alias("members")
+    )
+    sizes = clusters["distinct"].to_numpy().astype(np.int64)
+    num_members = clusters["members"].to_numpy().astype(np.int64)
+    starts = np.cumsum(sizes) - sizes
+    cluster_of = np.repeat(np.arange(len(sizes)), sizes)
+
+    sampled = sizes * (sizes - 1) // 2 > pair_budget
+
+    # Exact: every pair of distinct paratopes, weighted by the member pairs it stands for
+    i, j = _exact_pairs(starts[~sampled], sizes[~sampled])
+    weights = counts[i] * counts[j]
+    # Member pairs sharing a paratope
+    same = np.flatnonzero((counts > 1) & ~sampled[cluster_of])
+    i = np.concatenate([i, same])
+    j = np.concatenate([j, same])
+    weights = np.concatenate([weights, counts[same] * (counts[same] - 1) // 2])
+
+    # Sampled: random pairs of different members of large clusters
+    member_ends = np.cumsum(counts)
+    member_starts = member_ends[starts] - counts[starts]
+    si, sj = _sampled_pairs(member_starts[sampled], num_members[sampled], member_ends,
+                            pair_budget, np.random.default_rng(_SEED))
+    sampled_keys, inverse = np.unique(np.minimum(si, sj) * len(counts) + np.maximum(si, sj),
+                                      return_inverse=True)
+    i = np.concatenate([i, sampled_keys // max(len(counts), 1)])
+    j = np.concatenate([j, sampled_keys % max(len(counts), 1)])
+
+    # Each distinct pair of different paratopes is aligned once
+    distances = np.zeros(len(i), dtype=np.float64)
+    different = i != j
+    distances[different] = _normalized_distances(distinct["paratope_sequence"], i[different], j[different])
+    # Sampled pairs count as often as they were drawn
+    weights = np.concatenate([weights, np.bincount(inverse, minlength=len(sampled_keys))])
+
+    mean, median, p90 = _weighted_stats(cluster_of[i], distances, weights, len(sizes))
+
+    # Most common paratope; ties go to the alphabetically first one
+    most_common = distinct.with_columns(
+        pl.Series("cluster", cluster_of)
+    ).sort("cluster", "count", "paratope_sequence", descending=[False, True, False]).group_by(
+        "cluster", maintain_order=True
+    ).agg(
+        pl.col("paratope_sequence").first().alias("mostCommonParatope"),
+        pl.col("count").first().alias("mostCommonCount"),
+    )
+
+    return pl.DataFrame({
+        "cluster": np.arange(len(sizes)),
+        "clusterId": clusters["clusterId"],
+        "meanPairwiseDistance": mean,
+        "medianPairwiseDistance": median,
+        "p90PairwiseDistance": p90,
+        "members": num_members,
+        "pairsSampled": sampled,
+    }).join(most_common, on="cluster", how="left").select(
+        "clusterId",
+        "meanPairwiseDistance",
+        "medianPairwiseDistance",
+        "p90PairwiseDistance",
+        "mostCommonParatope",
+        (pl.col("mostCommonCount") / pl.col("members")).alias("mostCommonParatopeFraction"),
+        "pairsSampled",
+    )
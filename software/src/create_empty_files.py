@@ -1,6 +1,7 @@
-import pandas as pd
 import argparse
 
+from result_tables import write_empty
+
 
 def main():
     parser = argparse.ArgumentParser(
@@ -11,6 +12,9 @@ def main():
                         help='Number of sequence columns (default: 0)')
     parser.add_argument('--is-single-cell', action='store_true',
                         help='Whether this is single-cell data')
+    parser.add_argument('--level-identities', type=float, nargs='+', default=None,
+                        help='Identities of cascaded clustering levels, finest first; adds '
+                             'clone-to-cluster-levels.tsv and abundances-levels.tsv')
     args = parser.parse_args()
 
     num_sequences = args.num_sequences
@@ -18,56 +22,45 @@ def main():
     # Build sequence column names
     sequence_cols = [f"sequence_{i}" for i in range(num_sequences)]
 
-    # 1. abundances.tsv: sampleId, clusterId, abundance, abundance_normalized
-    pd.DataFrame(columns=["sampleId", "clusterId", "abundance", "abundance_normalized"]).to_csv(
-        "abundances.tsv", sep="\t", index=False
-    )
-
-    # 2. cluster-to-seq.tsv: clusterId, clusterLabel, size, sequence_*, paratope_sequence, flanked_sequence
     cluster_to_seq_cols = ["clusterId", "clusterLabel", "size"] + sequence_cols + ["paratope_sequence", "flanked_sequence"]
-    pd.DataFrame(columns=cluster_to_seq_cols).to_csv(
-        "cluster-to-seq.tsv", sep="\t", index=False
-    )
-
-    # 3. clone-to-cluster.tsv: clusterId, clonotypeKey, clusterLabel, link
-    pd.DataFrame(columns=["clusterId", "clonotypeKey", "clusterLabel", "link"]).to_csv(
-        "clone-to-cluster.tsv", sep="\t", index=False
-    )
-
-    # 4. abundances-per-cluster.tsv: clusterId, abundance_per_cluster, abundance_fraction_per_cluster
-    pd.DataFrame(columns=["clusterId", "abundance_per_cluster", "abundance_fraction_per_cluster"]).to_csv(
-        "abundances-per-cluster.tsv", sep="\t", index=False
-    )
-
-    # 5. distance_to_centroid.tsv: clonotypeKey, clusterId, clonotypeKeyLabel, clusterLabel, distanceToCentroid
-    pd.DataFrame(columns=["clonotypeKey", "clusterId", "clonotypeKeyLabel", "clusterLabel", "distanceToCentroid"]).to_csv(
-        "distance_to_centroid.tsv", sep="\t", index=False
-    )
 
-    # 6. cluster-radius.tsv: clusterId, clusterRadius
-    pd.DataFrame(columns=["clusterId", "clusterRadius"]).to_csv(
-        "cluster-radius.tsv", sep="\t", index=False
-    )
-
-    # 7. cluster-to-seq-top.tsv: same as cluster-to-seq.tsv
-    pd.DataFrame(columns=cluster_to_seq_cols).to_csv(
-        "cluster-to-seq-top.tsv", sep="\t", index=False
-    )
-
-    # 8. cluster-radius-top.tsv: same as cluster-radius.tsv
-    pd.DataFrame(columns=["clusterId", "clusterRadius"]).to_csv(
-        "cluster-radius-top.tsv", sep="\t", index=False
-    )
-
-    # 9. abundances-top.tsv: same as abundances.tsv
-    pd.DataFrame(columns=["sampleId", "clusterId", "abundance", "abundance_normalized"]).to_csv(
-        "abundances-top.tsv", sep="\t", index=False
-    )
-
-    # 10. paratope-sequences.tsv: clonotypeKey, paratope_sequence, flanked_sequence
-    pd.DataFrame(columns=["clonotypeKey", "paratope_sequence", "flanked_sequence"]).to_csv(
-        "paratope-sequences.tsv", sep="\t", index=False
-    )
+    tables = {
+        # 1. sampleId, clusterId, abundance, abundance_normalized
+        "abundances.tsv": ["sampleId", "clusterId", "abundance", "abundance_normalized"],
+        # 2. clusterId, clusterLabel, size, sequence_*, paratope_sequence, flanked_sequence
+        "cluster-to-seq.tsv": cluster_to_seq_cols,
+        # 3. clusterId, clonotypeKey, clusterLabel, link
+        "clone-to-cluster.tsv": ["clusterId", "clonotypeKey", "clusterLabel", "link"],
+        # 4. clusterId, abundance_per_cluster, abundance_fraction_per_cluster
+        "abundances-per-cluster.tsv": ["clusterId", "abundance_per_cluster", "abundance_fraction_per_cluster"],
+        # 5. clonotypeKey, clusterId, clonotypeKeyLabel, clusterLabel, distanceToCentroid
+        "distance_to_centroid.tsv": ["clonotypeKey", "clusterId", "clonotypeKeyLabel", "clusterLabel", "distanceToCentroid"],
+        # 6. clusterId, clusterRadius
+        "cluster-radius.tsv": ["clusterId", "clusterRadius"],
+        # 7. same as cluster-to-seq.tsv
+        "cluster-to-seq-top.tsv": cluster_to_seq_cols,
+        # 8. same as cluster-radius.tsv
+        "cluster-radius-top.tsv": ["clusterId", "clusterRadius"],
+        # 9. same as abundances.tsv
+        "abundances-top.tsv": ["sampleId", "clusterId", "abundance", "abundance_normalized"],
+        # 10. clonotypeKey, paratope_sequence, flanked_sequence
+        "paratope-sequences.tsv": ["clonotypeKey", "paratope_sequence", "flanked_sequence"],
+        # 11. clusterId, pairwise distance mean / median / p90, most common paratope
+        "cluster-diversity.tsv": ["clusterId", "meanPairwiseDistance", "medianPairwiseDistance",
+                                  "p90PairwiseDistance", "mostCommonParatope", "mostCommonParatopeFraction",
+                                  "pairsSampled"],
+    }
+
+    if args.level_identities:
+        # 12. clonotypeKey, clusterId_<identity> per level
+        tables["clone-to-cluster-levels.tsv"] = ["clonotypeKey"] + [
+            f"clusterId_{identity:g}" for identity in args.level_identities
+        ]
+        # 13. identity, sampleId, clusterId, abundance, abundance_normalized
+        tables["abundances-levels.tsv"] = ["identity", "sampleId", "clusterId", "abundance", "abundance_normalized"]
+
+    for name, columns in tables.items():
+        write_empty(name, columns)
 
     print("Created all empty files with proper column headers")
 
@@ -0,0 +1,43 @@
+import argparse
+import json
+import os
+
+import polars as pl
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Replace anonymized sample ids in result tables with the original ones.',
+        formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument('--mapping', required=True,
+                        help='JSON object: anonymized id -> original id')
+    parser.add_argument('--column', default='sampleId',
+                        help='Column holding the anonymized ids (default: sampleId)')
+    parser.add_argument('--output-dir', required=True,
+                        help='Directory for the de-anonymized tables, written under their input names')
+    parser.add_argument('tables', nargs='+', help='TSV tables to de-anonymize')
+    args = parser.parse_args()
+
+    with open(args.mapping) as f:
+        mapping = json.load(f)
+
+    # replace() with old/new series is a hash join against the mapping, so the
+    # cost does not depend on the number of samples
+    old_ids = pl.Series(list(mapping.keys()), dtype=pl.String)
+    new_ids = pl.Series(list(mapping.values()), dtype=pl.String)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    # All columns are read as strings so values are written back unchanged
+    frames = [
+        pl.scan_csv(path, separator='\t', infer_schema=False).with_columns(
+            pl.col(args.column).replace(old_ids, new_ids)
+        ).sink_csv(os.path.join(args.output_dir, os.path.basename(path)), separator='\t', lazy=True)
+        for path in args.tables
+    ]
+    pl.collect_all(frames, engine='streaming')
+    print(f"De-anonymized {len(args.tables)} table(s) with {len(mapping)} sample ids")
+
+
+if __name__ == '__main__':
+    main()
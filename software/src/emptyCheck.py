@@ -1,34 +1,150 @@
-import pandas as pd
+"""
+Profile the Parapred input table in one streaming pass, without loading it.
+
+Writes isFileEmpty.txt ("empty" / "notEmpty") and profile.json, which the
+workflow uses to size memory and CPU of the later steps and to choose the
+clustering engine:
+
+  numRows                 data rows (clonotypes)
+  numChains               chains detected from the column names
+  uniqueCdrs              distinct flanked CDR sequences, i.e. Parapred inputs
+  uniqueClonotypeCdrs     distinct per-clonotype sets of flanked CDRs; an upper
+                          bound on the records of the paratope FASTA
+  maxCdrLengths           longest value of each CDR column
+  maxFlankedCdrLength     longest flanked CDR
+  estimatedFastaBytes     paratope FASTA size if every clonotype had a distinct
+                          paratope as long as its CDRs
+
+With --rows-only any table is accepted and profile.json holds numRows only; the
+workflow uses this for the clone table (one row per sample and clonotype).
+"""
+
 import argparse
+import csv
+import json
 import os
+import sys
+
+# Parapred expects CDRs flanked by 2 residues of the surrounding FRs
+FLANK = 2
+
+
+def chain_columns(header):
+    """(cdr_columns, fr_columns) per chain: chain-indexed (CDR1_0, CDR1_1) or plain (CDR1)."""
+    if "CDR1_0" not in header:
+        return [(["CDR1", "CDR2", "CDR3"], ["FR1", "FR2", "FR3", "FR4"])]
+    chains = []
+    while f"CDR1_{len(chains)}" in header:
+        i = len(chains)
+        chains.append(([f"CDR{k}_{i}" for k in (1, 2, 3)], [f"FR{k}_{i}" for k in (1, 2, 3, 4)]))
+    return chains
+
+
+def profile_table(path, separator):
+    csv.field_size_limit(sys.maxsize)
+    with open(path, newline="") as f:
+        reader = csv.reader(f, delimiter=separator)
+        header = next(reader, [])
+        index = {name: i for i, name in enumerate(header)}
+        chains = chain_columns(index)
+        key_idx = index.get("clonotypeKey", 0)
+        # (cdr, left FR, right FR) column indices; missing columns give empty values
+        cdrs = [
+            (index.get(cdr), index.get(frs[k]), index.get(frs[k + 1]))
+            for cdr_cols, frs in chains for k, cdr in enumerate(cdr_cols)
+        ]
+        cdr_names = [cdr for cdr_cols, _ in chains for cdr in cdr_cols if cdr in index]
+
+        def cell(row, i):
+            return row[i] if i is not None and i < len(row) else ""
+
+        num_rows = 0
+        fasta_bytes = 0
+        max_flanked = 0
+        max_lengths = dict.fromkeys(cdr_names, 0)
+        # Hashes rather than sequences keep memory at a few dozen bytes per distinct value
+        unique_cdrs = set()
+        unique_clonotypes = set()
+        for row in reader:
+            if not row:
+                continue
+            num_rows += 1
+            flanked_cdrs = []
+            cdr_length = 0
+            for cdr_idx, left_idx, right_idx in cdrs:
+                cdr = cell(row, cdr_idx)
+                if not cdr:
+                    flanked_cdrs.append("")
+                    continue
+                flanked = cell(row, left_idx)[-FLANK:] + cdr + cell(row, right_idx)[:FLANK]
+                flanked_cdrs.append(flanked)
+                unique_cdrs.add(hash(flanked))
+                cdr_length += len(cdr)
+                max_flanked = max(max_flanked, len(flanked))
+                name = header[cdr_idx]
+                max_lengths[name] = max(max_lengths[name], len(cdr))
+            unique_clonotypes.add(hash(tuple(flanked_cdrs)))
+            # ">s-<clonotypeKey>\n<paratope>\n"
+            fasta_bytes += len(cell(row, key_idx)) + 5 + cdr_length
+
+    return {
+        "numRows": num_rows,
+        "numChains": len(chains),
+        "uniqueCdrs": len(unique_cdrs),
+        "uniqueClonotypeCdrs": len(unique_clonotypes),
+        "maxCdrLengths": max_lengths,
+        "maxFlankedCdrLength": max_flanked,
+        "estimatedFastaBytes": fasta_bytes,
+    }
+
+
+def count_rows(path):
+    """Data rows of a table without quoted line breaks, read in blocks."""
+    lines = 0
+    last = b"\n"
+    with open(path, "rb") as f:
+        while block := f.read(1 << 20):
+            lines += block.count(b"\n")
+            last = block[-1:]
+    # Last line without a trailing newline; the header is not a data row
+    if last != b"\n":
+        lines += 1
+    return max(lines - 1, 0)
+
 
 def main():
     parser = argparse.ArgumentParser(
-        description='Check if input table is empty.',
+        description='Check if input table is empty and profile its size.',
         formatter_class=argparse.RawTextHelpFormatter
     )
     parser.add_argument('-i', '--input', required=True,
                         help='Input file')
     parser.add_argument('-s', '--input-separator', default='\t',
                         help='Input table file separator (default: "\t")')
+    parser.add_argument('--rows-only', action='store_true',
+                        help='Only count the rows of the table; any columns are accepted')
     parser.add_argument('--output-dir', default='.',
                         help='Directory to save output files (default: current directory)')
     args = parser.parse_args()
 
-    # Open input file
-    df_input = pd.read_csv(args.input, sep=args.input_separator, dtype=str)
+    if args.rows_only:
+        profile = {"numRows": count_rows(args.input)}
+    else:
+        profile = profile_table(args.input, args.input_separator)
 
     # Check if input table is empty
-    fileContent = "empty"
-    if df_input.empty:
+    if profile["numRows"] == 0:
         print("Input table is empty.")
         fileContent = "empty"
     else:
         print("Input table is not empty.")
         fileContent = "notEmpty"
+    print(json.dumps(profile))
 
     with open(os.path.join(args.output_dir, 'isFileEmpty.txt'), 'w') as f:
         f.write(fileContent)
+    with open(os.path.join(args.output_dir, 'profile.json'), 'w') as f:
+        json.dump(profile, f)
 
 if __name__ == '__main__':
     main()
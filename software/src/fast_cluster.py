@@ -0,0 +1,187 @@
+"""
+In-process clustering of small paratope FASTA files, used instead of MMseqs2
+easy-cluster when process startup and database setup dominate the run.
+
+All pairs are compared with a global Levenshtein alignment, with the masked
+residue X never identical to anything, X included; a representative covers a
+member when
+
+  identity  1 - distance / longer length >= --identity
+  coverage  length ratio for --coverage-mode (MMseqs2 numbering; the
+            representative is the query and the member the target):
+              0, 5  shorter / longer
+              1, 4  representative / member
+              2, 3  member / representative
+
+This approximates MMseqs2 with --similarity-type 2 (sequence identity): MMseqs2
+measures identity over a local alignment and coverage over the aligned part, so
+pairs near the thresholds can be decided differently. Its k-mer prefilter also
+skips seeds with X, so it links fewer heavily masked paratopes than their identity
+allows: counting X as a mismatch keeps the two close on X-masked paratopes. There
+is no alignment-score (BLOSUM) mode, so the workflow uses it only for
+sequence-identity runs; tests/test_fast_cluster.py compares it with MMseqs2 on a
+fixture.
+
+Clusters are then built by greedy set cover, as MMseqs2 --cluster-mode 0 does:
+the sequence covering the most unassigned sequences becomes a representative
+(ties: longer sequence, then FASTA order) and takes all of them.
+
+Writes result_cluster.tsv (representative, member; no header) like easy-cluster.
+With more than --max-sequences records nothing is clustered: the result file is
+left empty and --engine-file says "mmseqs" so the workflow runs MMseqs2 instead.
+"""
+
+import argparse
+import time
+
+import numpy as np
+import polars as pl
+import polars_ds as pds
+
+from fasta import read_fasta
+
+# Sequence pairs compared per Levenshtein call
+_PAIRS_PER_BLOCK = 2_000_000
+
+
+def covers(rep_lengths, member_lengths, threshold, mode):
+    """Whether representatives of rep_lengths meet the coverage threshold for members of member_lengths."""
+    rep_lengths = rep_lengths.astype(np.float64)
+    member_lengths = member_lengths.astype(np.float64)
+    if mode in (0, 5):
+        ratio = np.minimum(rep_lengths, member_lengths) / np.maximum(rep_lengths, member_lengths)
+    elif mode in (1, 4):
+        ratio = rep_lengths / member_lengths
+    elif mode in (2, 3):
+        ratio = member_lengths / rep_lengths
+    else:
+        raise ValueError(f"Unknown coverage mode: {mode}")
+    return ratio >= threshold
+
+
+def similar_pairs(sequences, identity, coverage, coverage_mode):
+    """
+    Directed edges (representative, member) between distinct sequences that pass
+    the identity and coverage thresholds.
+    """
+    n = len(sequences)
+    lengths = np.array([len(seq) for seq in sequences], dtype=np.int64)
+    series = pl.Series(sequences, dtype=pl.String)
+    # Different placeholders on each side, so that X never matches X
+    left = series.str.replace_all("X", "1", literal=True)
+    right = series.str.replace_all("X", "2", literal=True)
+    sources, targets = [], []
+
+    rows_per_block = max(1, _PAIRS_PER_BLOCK // max(n, 1))
+    for start in range(0, n, rows_per_block):
+        stop = min(n, start + rows_per_block)
+        # Upper-triangle pairs i < j of this block of rows
+        i = np.repeat(np.arange(start, stop), n)
+        j = np.tile(np.arange(n), stop - start)
+        keep = j > i
+        i, j = i[keep], j[keep]
+
+        # Length bounds: the distance is at least the length difference, and at
+        # least one direction has to pass the coverage threshold
+        longer = np.maximum(lengths[i], lengths[j])
+        max_distance = np.floor((1.0 - identity) * longer + 1e-9)
+        forward = covers(lengths[i], lengths[j], coverage, coverage_mode)
+        backward = covers(lengths[j], lengths[i], coverage, coverage_mode)
+        keep = (np.abs(lengths[i] - lengths[j]) <= max_distance) & (forward | backward)
+        i, j, max_distance = i[keep], j[keep], max_distance[keep]
+        forward, backward = forward[keep], backward[keep]
+        if len(i) == 0:
+            continue
+
+        distance = pl.DataFrame({"a": left.gather(i), "b": right.gather(j)}).select(
+            pds.str_leven("a", "b", parallel=True)
+        ).to_series().to_numpy()
+        similar = distance <= max_distance
+
+        sources += [i[similar & forward], j[similar & backward]]
+        targets += [j[similar & forward], i[similar & backward]]
+
+    if not sources:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    return np.concatenate(sources), np.concatenate(targets)
+
+
+def greedy_set_cover(n, sources, targets, lengths):
+    """Representative index for each of n sequences, given directed cover edges."""
+    outgoing = np.argsort(sources, kind="stable")
+    out_targets = targets[outgoing]
+    out_offsets = np.concatenate([[0], np.cumsum(np.bincount(sources, minlength=n))])
+    incoming = np.argsort(targets, kind="stable")
+    in_sources = sources[incoming]
+    in_offsets = np.concatenate([[0], np.cumsum(np.bincount(targets, minlength=n))])
+
+    # Unassigned sequences each sequence would take, itself included
+    degree = np.diff(out_offsets) + 1
+    lengths = np.asarray(lengths, dtype=np.int64)
+    representative = np.full(n, -1, dtype=np.int64)
+    unassigned = np.ones(n, dtype=bool)
+    for _ in range(n):
+        if not unassigned.any():
+            break
+        # Most unassigned members, then longer sequence; argmax keeps FASTA order on ties
+        priority = np.where(unassigned, degree * (lengths.max() + 1) + lengths, -1)
+        rep = int(np.argmax(priority))
+
+        members = out_targets[out_offsets[rep]:out_offsets[rep + 1]]
+        members = np.concatenate([[rep], members[unassigned[members]]])
+        representative[members] = rep
+        unassigned[members] = False
+
+        # Newly assigned sequences no longer count for whoever covers them
+        covering = np.concatenate([in_sources[in_offsets[m]:in_offsets[m + 1]] for m in members])
+        np.subtract.at(degree, covering, 1)
+    return representative
+
+
+def main():
+    parser = argparse.ArgumentParser(description="In-process greedy clustering of a small paratope FASTA")
+    parser.add_argument("--input", default="input.fasta", help="Paratope FASTA")
+    parser.add_argument("--output", default="result_cluster.tsv", help="Cluster TSV in MMseqs2 easy-cluster format")
+    parser.add_argument("--identity", type=float, required=True, help="Minimum sequence identity (--min-seq-id)")
+    parser.add_argument("--coverage", type=float, required=True, help="Minimum coverage (-c)")
+    parser.add_argument("--coverage-mode", type=int, default=0, help="MMseqs2 coverage mode (--cov-mode)")
+    parser.add_argument("--max-sequences", type=int, default=None,
+                        help="Leave larger inputs to MMseqs2 (see --engine-file)")
+    parser.add_argument("--engine-file", default="engine.txt",
+                        help="Written with the engine that has to produce the clusters: fast or mmseqs")
+    args = parser.parse_args()
+
+    t0 = time.time()
+    records = read_fasta(args.input)
+    names = list(records)
+    sequences = list(records.values())
+    print(f"Read {len(names)} sequences: {time.time() - t0:.2f}s")
+
+    if args.max_sequences is not None and len(names) > args.max_sequences:
+        open(args.output, "w").close()
+        with open(args.engine_file, "w") as f:
+            f.write("mmseqs")
+        print(f"More than {args.max_sequences} sequences, leaving clustering to MMseqs2")
+        return
+
+    t0 = time.time()
+    sources, targets = similar_pairs(sequences, args.identity, args.coverage, args.coverage_mode)
+    print(f"Found {len(sources)} cover edges: {time.time() - t0:.2f}s")
+
+    t0 = time.time()
+    representative = greedy_set_cover(len(names), sources, targets, [len(seq) for seq in sequences])
+    print(f"Greedy set cover: {time.time() - t0:.2f}s")
+
+    # Representative first, then members in FASTA order, clusters by representative
+    order = np.lexsort((np.arange(len(names)), np.arange(len(names)) != representative, representative))
+    pl.DataFrame({
+        "representative": pl.Series(names, dtype=pl.String).gather(representative[order]),
+        "member": pl.Series(names, dtype=pl.String).gather(order),
+    }).write_csv(args.output, separator="\t", include_header=False)
+    with open(args.engine_file, "w") as f:
+        f.write("fast")
+    print(f"Clustered {len(names)} sequences into {len(np.unique(representative))} clusters")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,28 @@
+"""Minimal FASTA reading and writing for paratope FASTA files."""
+
+
+def read_fasta(path):
+    """Return dict id -> sequence (insertion ordered)."""
+    records = {}
+    name = None
+    chunks = []
+    with open(path) as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if line.startswith(">"):
+                if name is not None:
+                    records[name] = "".join(chunks)
+                name = line[1:].split()[0] if len(line) > 1 else ""
+                chunks = []
+            elif line:
+                chunks.append(line)
+    if name is not None:
+        records[name] = "".join(chunks)
+    return records
+
+
+def write_fasta(path, records):
+    """Write (id, sequence) pairs."""
+    with open(path, "w") as f:
+        for name, seq in records:
+            f.write(f">{name}\n{seq}\n")
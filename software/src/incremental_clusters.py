@@ -0,0 +1,200 @@
+"""
+Incremental MMseqs2 clustering support: reuse a previous clustering and cluster
+only new or changed paratopes.
+
+  prepare  Compare the current paratope FASTA with the previous run's FASTA and
+           result_cluster.tsv, by sequence. A current record keeps the previous
+           record's id when that clonotype still has the paratope (--paratopes),
+           and the renamed FASTA is written to stable.fasta. Clusters whose
+           representative paratope is still present keep their members that are
+           still present, under these ids (kept_clusters.tsv); their
+           representatives go to representatives.fasta. Every other paratope goes
+           to new.fasta.
+           mode.txt tells the workflow what to run:
+             unchanged    nothing to cluster, kept_clusters.tsv is the result
+             full         no representative can be reused, cluster new.fasta only
+             incremental  cluster new.fasta, then search its representatives
+                          against representatives.fasta
+
+  merge    Combine kept_clusters.tsv, the clustering of new.fasta and the search
+           hits into result_cluster.tsv. A new cluster whose representative hits
+           a previous representative joins that cluster; the others stay new.
+
+Cluster ids are representative FASTA ids of the current run. Records are named
+after the first clonotype with the paratope, so new clonotypes can change the
+name of a paratope; with the previous ids mapped back, a cluster that survives
+keeps its id as long as its representative clonotype keeps its paratope. The
+workflow exports stable.fasta as the paratope FASTA of the run, so ids stay
+stable over any number of incremental runs.
+"""
+
+import argparse
+import os
+
+import polars as pl
+
+from fasta import read_fasta, write_fasta
+
+_CLUSTER_SCHEMA = {"representative": pl.String, "member": pl.String}
+# Default easy-search output columns
+_HIT_COLUMNS = ["query", "target", "fident", "alnlen", "mismatch", "gapopen",
+                "qstart", "qend", "tstart", "tend", "evalue", "bits"]
+
+
+def read_clusters(path):
+    """MMseqs2 cluster TSV (representative, member) without header."""
+    if os.path.getsize(path) == 0:
+        return pl.DataFrame(schema=_CLUSTER_SCHEMA)
+    return pl.read_csv(path, separator="\t", has_header=False, schema=_CLUSTER_SCHEMA)
+
+
+def read_hits(path):
+    """MMseqs2 easy-search hits; only query, target and bit score are used."""
+    if path is None or os.path.getsize(path) == 0:
+        return pl.DataFrame(schema={"query": pl.String, "target": pl.String, "bits": pl.Float64})
+    return pl.read_csv(path, separator="\t", has_header=False, new_columns=_HIT_COLUMNS,
+                       infer_schema_length=0).select("query", "target", pl.col("bits").cast(pl.Float64))
+
+
+def write_clusters(path, clusters):
+    clusters.write_csv(path, separator="\t", include_header=False)
+
+
+def read_paratopes(path):
+    """Paratope sequences TSV as (name, paratope) with FASTA record names (s-<clonotypeKey>)."""
+    return pl.read_csv(path, separator="\t", columns=["clonotypeKey", "paratope_sequence"],
+                       schema_overrides={"clonotypeKey": pl.String, "paratope_sequence": pl.String}).select(
+        ("s-" + pl.col("clonotypeKey")).alias("name"),
+        pl.col("paratope_sequence").alias("paratope"),
+    )
+
+
+def stable_names(current, previous, paratopes):
+    """
+    Current record name -> previous record name of the same paratope, for records
+    whose previous name is a clonotype that still has this paratope.
+    """
+    records = pl.DataFrame(
+        {"current": list(current), "paratope": list(current.values())},
+        schema={"current": pl.String, "paratope": pl.String},
+    ).join(
+        pl.DataFrame(
+            {"previous": list(previous), "paratope": list(previous.values())},
+            schema={"previous": pl.String, "paratope": pl.String},
+        ).unique(subset=["paratope"], keep="first"),
+        on="paratope",
+        how="inner",
+    ).filter(pl.col("current") != pl.col("previous"))
+    renamed = records.join(paratopes, left_on=["previous", "paratope"], right_on=["name", "paratope"], how="semi")
+    return dict(zip(renamed["current"], renamed["previous"]))
+
+
+def prepare(args):
+    current = read_fasta(args.fasta)
+    previous = read_fasta(args.previous_fasta)
+    if args.paratopes is not None:
+        renames = stable_names(current, previous, read_paratopes(args.paratopes))
+        current = {renames.get(name, name): seq for name, seq in current.items()}
+        print(f"Kept previous ids of {len(renames)} renamed paratopes")
+    write_fasta(args.stable_fasta, current.items())
+    previous_clusters = read_clusters(args.previous_clusters)
+
+    # Records are named after the first clonotype with the paratope, which can change
+    # between runs: match by sequence and rename previous records to current names
+    current_names = {}
+    for name, seq in current.items():
+        current_names.setdefault(seq, name)
+    renamed = pl.DataFrame(
+        [(name, current_names[seq]) for name, seq in previous.items() if seq in current_names],
+        schema={"previous": pl.String, "current": pl.String},
+        orient="row",
+    )
+    kept = previous_clusters.join(
+        renamed.rename({"previous": "representative"}), on="representative", how="inner", maintain_order="left"
+    ).join(
+        renamed.rename({"previous": "member", "current": "current_member"}), on="member", how="inner",
+        maintain_order="left"
+    ).select(
+        pl.col("current").alias("representative"),
+        pl.col("current_member").alias("member"),
+    ).unique(subset=["member"], keep="first", maintain_order=True)
+    representatives = kept["representative"].unique(maintain_order=True).to_list()
+    assigned = set(kept["member"].to_list())
+    new = [name for name in current if name not in assigned]
+
+    if not new:
+        mode = "unchanged"
+    elif not representatives:
+        mode = "full"
+    else:
+        mode = "incremental"
+
+    write_clusters(args.kept, kept)
+    write_fasta(args.representatives, ((name, current[name]) for name in representatives))
+    write_fasta(args.new, ((name, current[name]) for name in new))
+    with open(args.mode, "w") as f:
+        f.write(mode)
+
+    print(f"Paratopes: {len(current)} current, {len(previous)} previous")
+    print(f"Reused {kept.height} memberships in {len(representatives)} clusters; "
+          f"{len(new)} new or changed paratopes to cluster")
+    print(f"Mode: {mode}")
+
+
+def merge(args):
+    kept = read_clusters(args.kept)
+    new_clusters = read_clusters(args.new_clusters)
+
+    # Best hit per new representative by bit score
+    best_hits = read_hits(args.hits).sort("bits", descending=True).unique(subset=["query"], keep="first").select(
+        pl.col("query").alias("representative"),
+        pl.col("target").alias("previous_representative"),
+    )
+
+    merged_new = new_clusters.join(best_hits, on="representative", how="left").select(
+        pl.coalesce("previous_representative", "representative").alias("representative"),
+        "member",
+    )
+    result = pl.concat([kept, merged_new])
+    write_clusters(args.output, result)
+
+    joined = best_hits.join(new_clusters, on="representative").height
+    print(f"Kept {kept.height} memberships; {new_clusters.height} new memberships, "
+          f"{joined} of them joined existing clusters")
+    print(f"Result: {result.height} memberships in {result['representative'].n_unique()} clusters")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Incremental MMseqs2 clustering of paratopes")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    prepare_parser = subparsers.add_parser("prepare", help="Split paratopes into reused and new ones")
+    prepare_parser.add_argument("--fasta", required=True, help="Current paratope FASTA")
+    prepare_parser.add_argument("--previous-fasta", required=True, help="Paratope FASTA of the previous run")
+    prepare_parser.add_argument("--previous-clusters", required=True,
+                                help="result_cluster.tsv of the previous run")
+    prepare_parser.add_argument("--paratopes", default=None,
+                                help="Current paratope sequences TSV (clonotypeKey, paratope_sequence); "
+                                     "keeps previous record ids of clonotypes that kept their paratope")
+    prepare_parser.add_argument("--stable-fasta", default="stable.fasta",
+                                help="Current FASTA with previous record ids kept")
+    prepare_parser.add_argument("--kept", default="kept_clusters.tsv")
+    prepare_parser.add_argument("--representatives", default="representatives.fasta")
+    prepare_parser.add_argument("--new", default="new.fasta")
+    prepare_parser.add_argument("--mode", default="mode.txt")
+    prepare_parser.set_defaults(func=prepare)
+
+    merge_parser = subparsers.add_parser("merge", help="Merge reused and new clusters")
+    merge_parser.add_argument("--kept", default="kept_clusters.tsv")
+    merge_parser.add_argument("--new-clusters", required=True, help="Cluster TSV of new.fasta")
+    merge_parser.add_argument("--hits", default=None,
+                              help="easy-search hits of new representatives against previous ones")
+    merge_parser.add_argument("--output", default="result_cluster.tsv")
+    merge_parser.set_defaults(func=merge)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,434 @@
+"""
+Parapred inference engine: model loading, inference backends and batched prediction.
+
+torch and parapred-pytorch are imported by import_runtime() rather than at module
+import, so callers whose sequences are all served from saved probabilities, the
+prediction cache or a warm inference server never pay for them.
+"""
+
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+import time
+
+import numpy as np
+
+# Standard amino acid letters accepted by Parapred's MEILER encoding
+VALID_AA = set("ACDEFGHIKLMNPQRSTVWY")
+
+WEIGHTS_PATH = os.path.join(os.path.dirname(__file__), "weights", "parapred_pytorch.h5")
+
+# Longest flanked CDR Parapred is run on; longer sequences are skipped
+MAX_LENGTH = 40
+# Default padded tensor size per batch (rows x longest sequence), same as 512 sequences at MAX_LENGTH
+DEFAULT_BATCH_RESIDUES = 512 * MAX_LENGTH
+# Batches queued between the encoder, model and post-processing threads of in-process inference
+PIPELINE_DEPTH = 2
+
+BACKENDS = ["eager", "int8", "torchscript", "compile", "bf16"]
+# Accuracy gate defaults: largest allowed per-residue probability difference from the float32
+# reference, and the share of reference paratopes that must come out identical
+DEFAULT_BACKEND_MAX_ERROR = 0.02
+DEFAULT_BACKEND_MIN_AGREEMENT = 0.98
+
+# Set by import_runtime()
+torch = None
+Parapred = clean_output = generate_mask = encode_batch = None
+# encode_batch/generate_mask replacement used by encode_sequences(), set by import_runtime()
+_encoder = None
+
+
+def import_runtime():
+    """Import torch and parapred-pytorch; exits with an error if they are not installed."""
+    global torch, Parapred, clean_output, generate_mask, encode_batch, _encoder
+    if torch is not None:
+        return
+    try:
+        import torch as _torch
+        from parapred.model import Parapred as _Parapred, clean_output as _clean_output
+        from parapred.cnn import generate_mask as _generate_mask
+        from parapred.preprocessing import encode_batch as _encode_batch
+    except ImportError as e:
+        print(
+            f"ERROR: parapred-pytorch not installed. This script requires the parapred environment. ({e})",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+    torch, Parapred, clean_output = _torch, _Parapred, _clean_output
+    generate_mask, encode_batch = _generate_mask, _encode_batch
+    _encoder = load_encoder()
+
+
+class LookupEncoder:
+    """
+    Vectorized encode_batch + generate_mask. The per-residue features (one-hot plus
+    MEILER) are read off encode_batch once, for each letter of VALID_AA; a batch is
+    then turned into a uint8 index matrix through a byte translation table and the
+    feature rows are gathered straight into the memory of a torch tensor.
+    """
+
+    def __init__(self):
+        alphabet = sorted(VALID_AA)
+        features, lengths = encode_batch(alphabet, max_length=1)
+        # Row 0: padding and anything outside VALID_AA
+        self.table = np.zeros((len(alphabet) + 1, features.shape[-1]), dtype=features.numpy().dtype)
+        self.table[1:] = features[:, 0, :].numpy()
+        self.translation = np.zeros(256, dtype=np.uint8)
+        for idx, letter in enumerate(alphabet, start=1):
+            self.translation[ord(letter)] = idx
+        self.dtype = features.dtype
+        self.lengths_dtype = lengths.dtype
+
+    def __call__(self, sequences, max_length):
+        """Returns (encoded, lengths, mask) like encode_batch and generate_mask, or None if a
+        sequence has a residue outside VALID_AA."""
+        try:
+            padded = np.array(sequences, dtype=f"S{max_length}")
+        except UnicodeEncodeError:
+            return None
+        raw = np.frombuffer(padded.tobytes(), dtype=np.uint8).reshape(len(sequences), max_length)
+        index = self.translation[raw]
+        if np.any((index == 0) & (raw != 0)):
+            return None
+
+        encoded = torch.empty((len(sequences), max_length, self.table.shape[1]), dtype=self.dtype)
+        np.take(self.table, index, axis=0, out=encoded.numpy())
+        lengths = torch.as_tensor(np.fromiter(map(len, sequences), dtype=np.int64, count=len(sequences)),
+                                  dtype=self.lengths_dtype)
+        mask = (torch.arange(max_length) < lengths[:, None])[:, :, None].expand_as(encoded)
+        return encoded, lengths, mask
+
+
+def load_encoder():
+    """
+    LookupEncoder, or None if it cannot be built from this parapred version's
+    encode_batch (encode_sequences() then uses encode_batch and generate_mask
+    directly). Its equivalence to them is checked in tests/test_parapred_engine.py.
+    """
+    try:
+        return LookupEncoder()
+    except Exception as e:
+        print(f"WARNING: lookup table encoder unavailable ({e}), using parapred encode_batch")
+        return None
+
+
+def load_model():
+    """Load the Parapred model with pretrained weights."""
+    import_runtime()
+    model = Parapred()
+    model.load_state_dict(torch.load(WEIGHTS_PATH, map_location="cpu"))
+    model.eval()
+    return model
+
+
+class _Bfloat16Autocast:
+    """Runs the wrapped model under CPU bf16 autocast and returns float32 probabilities."""
+
+    def __init__(self, model):
+        self.model = model
+
+    def __call__(self, encoded, mask, lengths):
+        with torch.autocast("cpu", dtype=torch.bfloat16):
+            return self.model(encoded, mask, lengths).float()
+
+
+def build_backend(model, backend):
+    """Return an inference variant of the float32 eager model for the given backend."""
+    if backend == "eager":
+        return model
+    if backend == "int8":
+        return torch.ao.quantization.quantize_dynamic(
+            model, {torch.nn.LSTM, torch.nn.Linear}, dtype=torch.qint8
+        )
+    if backend == "torchscript":
+        return torch.jit.freeze(torch.jit.script(model))
+    if backend == "compile":
+        return torch.compile(model, dynamic=True)
+    if backend == "bf16":
+        if not torch.ops.mkldnn._is_mkldnn_bf16_supported():
+            raise RuntimeError("CPU has no native bf16 support")
+        return _Bfloat16Autocast(model)
+    raise ValueError(f"Unknown backend: {backend}")
+
+
+def reference_sequences(count=64, seed=0):
+    """Fixed pseudo-random flanked CDR-like sequences spanning all lengths Parapred accepts."""
+    rng = np.random.default_rng(seed)
+    alphabet = np.array(sorted(VALID_AA))
+    lengths = np.linspace(5, MAX_LENGTH, count).astype(int)
+    return ["".join(rng.choice(alphabet, size=n)) for n in lengths]
+
+
+def check_backend(reference_model, model, threshold, max_error, min_agreement):
+    """
+    Accuracy gate: compare per-residue probabilities and thresholded paratope strings
+    of `model` against the float32 reference on reference_sequences().
+    Returns (passed, max_abs_error, paratope_agreement).
+    """
+    sequences = reference_sequences()
+    expected = predict_batch(reference_model, sequences)
+    actual = predict_batch(model, sequences)
+
+    max_abs_error = 0.0
+    agreeing = 0
+    for seq, ref_probs, probs in zip(sequences, expected, actual):
+        max_abs_error = max(max_abs_error, float(np.max(np.abs(ref_probs - probs))))
+        residues = np.frombuffer(seq.encode("ascii"), dtype=np.uint8)
+        ref_paratope = np.where(ref_probs >= threshold, residues, ord("X"))
+        paratope = np.where(probs >= threshold, residues, ord("X"))
+        agreeing += bool(np.array_equal(ref_paratope, paratope))
+    agreement = agreeing / len(sequences)
+    return max_abs_error <= max_error and agreement >= min_agreement, max_abs_error, agreement
+
+
+def load_backend(backend, threshold, max_error, min_agreement):
+    """
+    Load Parapred and prepare the requested inference backend. Non-eager backends
+    must pass check_backend() against the float32 model, otherwise (or if the
+    backend cannot be built on this machine) eager float32 is used.
+    Returns (model, backend actually used).
+    """
+    model = load_model()
+    if backend == "eager":
+        return model, backend
+
+    try:
+        candidate = build_backend(model, backend)
+        passed, max_abs_error, agreement = check_backend(
+            model, candidate, threshold, max_error, min_agreement
+        )
+    except Exception as e:
+        print(f"WARNING: {backend} backend unavailable ({e}), using eager float32")
+        return model, "eager"
+
+    print(f"[TIMING] Backend {backend} accuracy gate: max probability error {max_abs_error:.4f} "
+          f"(limit {max_error}), paratope agreement {100 * agreement:.1f}% (required {100 * min_agreement:.1f}%)")
+    if not passed:
+        print(f"WARNING: {backend} backend failed the accuracy gate, using eager float32")
+        return model, "eager"
+    return candidate, backend
+
+
+def encode_sequences(flanked_sequences, max_length=MAX_LENGTH):
+    """
+    Python-side half of predict_batch before the forward pass: sorts the predictable
+    sequences by length and encodes them. Returns the prepared batch for run_model().
+    """
+    valid = [(i, seq) for i, seq in enumerate(flanked_sequences) if seq and len(seq) <= max_length]
+    if not valid:
+        return len(flanked_sequences), [], [], None
+
+    # Sort by length descending (required for pack_padded_sequence in LSTM)
+    valid_sorted = sorted(valid, key=lambda x: len(x[1]), reverse=True)
+    indices_sorted = [v[0] for v in valid_sorted]
+    seqs_sorted = [v[1] for v in valid_sorted]
+
+    encoded = _encoder(seqs_sorted, len(seqs_sorted[0])) if _encoder is not None else None
+    if encoded is not None:
+        encoded, lengths, mask = encoded
+    else:
+        encoded, lengths = encode_batch(seqs_sorted, max_length=len(seqs_sorted[0]))
+        mask = generate_mask(encoded, lengths)
+    return len(flanked_sequences), indices_sorted, [len(seq) for seq in seqs_sorted], (encoded, mask, lengths)
+
+
+def run_model(model, prepared):
+    """Forward pass over a batch from encode_sequences(); None when it has nothing to predict."""
+    tensors = prepared[3]
+    if tensors is None:
+        return None
+    with torch.no_grad():
+        return model(*tensors)
+
+
+def extract_probabilities(prepared, probs):
+    """Per-sequence probability arrays in input order from the output of run_model()."""
+    num_sequences, indices_sorted, seq_lengths, _ = prepared
+    results = [np.array([]) for _ in range(num_sequences)]
+    for batch_idx, orig_idx in enumerate(indices_sorted):
+        seq_probs = clean_output(probs[batch_idx], seq_lengths[batch_idx])
+        results[orig_idx] = seq_probs.numpy().flatten()
+    return results
+
+
+def predict_batch(model, flanked_sequences, max_length=MAX_LENGTH):
+    """
+    Run Parapred on a list of flanked CDR sequences.
+    Returns list of numpy arrays with per-residue probabilities.
+    Empty sequences get empty arrays. Sequences longer than max_length are skipped.
+    The batch is padded to its longest sequence only.
+    """
+    prepared = encode_sequences(flanked_sequences, max_length)
+    return extract_probabilities(prepared, run_model(model, prepared))
+
+
+class PipelineStats:
+    """Queue statistics of pipelined in-process inference, summed over all calls."""
+
+    def __init__(self):
+        self.batches = 0
+        # Encoded batches already waiting whenever the model took the next one
+        self.encoded_depth = 0
+        # Model idle waiting for the encoder, encoder blocked on a full queue,
+        # model blocked on a full post-processing queue (seconds)
+        self.model_waits = 0.0
+        self.encoder_stalls = 0.0
+        self.postprocess_stalls = 0.0
+
+    def summary(self):
+        return {
+            "batches": self.batches,
+            "queue_size": PIPELINE_DEPTH,
+            "mean_encoded_queue_depth": round(self.encoded_depth / max(self.batches, 1), 2),
+            "model_wait_seconds": round(self.model_waits, 4),
+            "encoder_stall_seconds": round(self.encoder_stalls, 4),
+            "postprocess_stall_seconds": round(self.postprocess_stalls, 4),
+        }
+
+
+_DONE = object()
+
+
+def _predict_pipelined(model, batches, stats):
+    """
+    predict_batch over batches with encoding and post-processing on helper threads:
+    while the model runs batch N, batch N+1 is encoded and batch N-1 converted to
+    numpy. torch releases the GIL in the forward pass, so the helpers overlap it.
+    Queues hold up to PIPELINE_DEPTH batches. Yields (batch_num, batch_probs).
+    """
+    encoded = queue.Queue(PIPELINE_DEPTH)
+    forwarded = queue.Queue(PIPELINE_DEPTH)
+    finished = queue.Queue()
+    errors = []
+
+    def encode():
+        try:
+            for batch_num, batch in enumerate(batches):
+                item = (batch_num, encode_sequences(batch))
+                t0 = time.perf_counter()
+                encoded.put(item)
+                stats.encoder_stalls += time.perf_counter() - t0
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            encoded.put(_DONE)
+
+    def postprocess():
+        # Keeps draining after an error so the model thread never blocks on the queue
+        while (item := forwarded.get()) is not _DONE:
+            if errors:
+                continue
+            batch_num, prepared, probs = item
+            try:
+                finished.put((batch_num, extract_probabilities(prepared, probs)))
+            except BaseException as e:
+                errors.append(e)
+        finished.put(_DONE)
+
+    helpers = [threading.Thread(target=encode, daemon=True), threading.Thread(target=postprocess, daemon=True)]
+    for thread in helpers:
+        thread.start()
+    taken = 0
+    try:
+        while True:
+            depth = encoded.qsize()
+            t0 = time.perf_counter()
+            item = encoded.get()
+            stats.model_waits += time.perf_counter() - t0
+            if item is _DONE or errors:
+                break
+            # Only batches count towards the depth, not the end marker queued behind the last one
+            stats.encoded_depth += min(depth, len(batches) - taken)
+            taken += 1
+            batch_num, prepared = item
+            probs = run_model(model, prepared)
+            t0 = time.perf_counter()
+            forwarded.put((batch_num, prepared, probs))
+            stats.postprocess_stalls += time.perf_counter() - t0
+            stats.batches += 1
+            while not finished.empty():
+                yield finished.get_nowait()
+    finally:
+        forwarded.put(_DONE)
+    while (item := finished.get()) is not _DONE:
+        yield item
+    if errors:
+        raise errors[0]
+
+
+def _cgroup_cpu_limit():
+    """CPU limit of the container's cgroup quota (v2 or v1), rounded up; None if unlimited."""
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()[:2]
+        if quota == "max":
+            return None
+        quota, period = int(quota), int(period)
+    except (OSError, ValueError):
+        try:
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+                quota = int(f.read())
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+                period = int(f.read())
+        except (OSError, ValueError):
+            return None
+    if quota <= 0 or period <= 0:
+        return None
+    return max(1, -(-quota // period))
+
+
+def available_cpus():
+    """Number of CPUs this process may run on: its CPU affinity, capped by the cgroup quota."""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    limit = _cgroup_cpu_limit()
+    return cpus if limit is None else min(cpus, limit)
+
+
+# Model shared with forked inference workers (copy-on-write, never modified)
+_worker_model = None
+
+
+def _init_worker(threads):
+    torch.set_num_threads(threads)
+
+
+def _predict_in_worker(task):
+    batch_num, sequences = task
+    return batch_num, predict_batch(_worker_model, sequences)
+
+
+def predict_sequences(model, batches, workers=1, threads_per_worker=None, stats=None):
+    """
+    Run predict_batch over a list of batches (lists of sequences).
+
+    In-process (workers == 1) encoding and post-processing overlap the forward
+    passes on helper threads; queue statistics are added to stats (PipelineStats).
+    Only this path is pipelined: pool workers encode, run and post-process each
+    of their batches in turn, and leave stats unchanged.
+
+    With workers > 1 the batches are sharded across forked worker processes that
+    share the already loaded model read-only; each worker runs torch with
+    threads_per_worker intra-op threads (default: available CPUs / workers).
+    Yields (batch_num, batch_probs) pairs in completion order.
+    """
+    global _worker_model
+
+    workers = max(1, min(workers, len(batches)))
+    if threads_per_worker is None:
+        threads_per_worker = max(1, available_cpus() // workers)
+
+    if workers == 1:
+        torch.set_num_threads(threads_per_worker)
+        yield from _predict_pipelined(model, batches, stats if stats is not None else PipelineStats())
+        return
+
+    _worker_model = model
+    ctx = multiprocessing.get_context("fork")
+    with ctx.Pool(workers, initializer=_init_worker, initargs=(threads_per_worker,)) as pool:
+        yield from pool.imap_unordered(_predict_in_worker, enumerate(batches))
+    _worker_model = None
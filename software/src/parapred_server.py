@@ -0,0 +1,133 @@
+"""
+Warm Parapred inference server.
+
+Keeps torch imported and the model loaded between pipeline runs, so small
+datasets do not pay for startup on every invocation. Listens on a Unix socket:
+
+    python parapred_server.py --socket /tmp/parapred.sock [--backend int8] [--workers 4]
+
+run_parapred_pipeline.py --server /tmp/parapred.sock (or PARAPRED_SERVER_SOCKET)
+sends its batches here and falls back to in-process inference when no server
+is listening. Requests are served one connection at a time.
+"""
+
+import argparse
+import os
+import signal
+import sys
+import time
+from multiprocessing.connection import Client, Listener
+
+import parapred_engine as engine
+from prediction_cache import hash_file
+
+
+class InferenceClient:
+    """Connection to a running inference server."""
+
+    def __init__(self, conn):
+        self._conn = conn
+        self._conn.send(("info", None))
+        self.info = self._receive()
+
+    @classmethod
+    def connect(cls, path):
+        """Connect to the server at path; returns None if none is listening there."""
+        if not path or not os.path.exists(path):
+            return None
+        try:
+            return cls(Client(path, family="AF_UNIX"))
+        except (OSError, EOFError):
+            return None
+
+    def predict(self, batches):
+        """Send batches (lists of sequences); yields (batch_num, batch_probs) as the server completes them."""
+        self._conn.send(("predict", batches))
+        while True:
+            kind, payload = self._conn.recv()
+            if kind == "done":
+                return
+            if kind == "error":
+                raise RuntimeError(f"Inference server error: {payload}")
+            yield payload
+
+    def close(self):
+        self._conn.close()
+
+    def _receive(self):
+        kind, payload = self._conn.recv()
+        if kind == "error":
+            raise RuntimeError(f"Inference server error: {payload}")
+        return payload
+
+
+def serve(listener, model, info, workers, threads_per_worker):
+    while True:
+        with listener.accept() as conn:
+            try:
+                while True:
+                    kind, payload = conn.recv()
+                    if kind == "info":
+                        conn.send(("info", info))
+                    elif kind == "predict":
+                        t0 = time.time()
+                        for result in engine.predict_sequences(model, payload, workers, threads_per_worker):
+                            conn.send(("batch", result))
+                        conn.send(("done", None))
+                        print(f"[TIMING] Served {len(payload)} batches: {time.time() - t0:.2f}s", flush=True)
+                    else:
+                        conn.send(("error", f"unknown request {kind!r}"))
+            except EOFError:
+                pass
+            except Exception as e:
+                try:
+                    conn.send(("error", str(e)))
+                except OSError:
+                    pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Warm Parapred inference server")
+    parser.add_argument("--socket", type=str, required=True, help="Unix socket path to listen on")
+    parser.add_argument("--backend", choices=engine.BACKENDS, default="eager", help="Inference backend")
+    parser.add_argument("--threshold", type=float, default=0.5, help="Threshold used by the backend accuracy gate")
+    parser.add_argument("--backend-max-error", type=float, default=engine.DEFAULT_BACKEND_MAX_ERROR)
+    parser.add_argument("--backend-min-agreement", type=float, default=engine.DEFAULT_BACKEND_MIN_AGREEMENT)
+    parser.add_argument("--workers", type=int, default=1, help="Inference worker processes per request")
+    parser.add_argument("--threads-per-worker", type=int, default=None, help="Torch threads per worker")
+    args = parser.parse_args()
+
+    t0 = time.time()
+    engine.import_runtime()
+    t_import = time.time() - t0
+    t0 = time.time()
+    model, backend = engine.load_backend(
+        args.backend, args.threshold, args.backend_max_error, args.backend_min_agreement
+    )
+    t_load = time.time() - t0
+    print(f"[TIMING] Import torch/parapred: {t_import:.2f}s")
+    print(f"[TIMING] Load Parapred model ({backend} backend): {t_load:.2f}s")
+
+    info = {
+        "requested_backend": args.backend,
+        "backend": backend,
+        "weights_hash": hash_file(engine.WEIGHTS_PATH),
+    }
+
+    if os.path.exists(args.socket):
+        os.unlink(args.socket)
+    listener = Listener(args.socket, family="AF_UNIX")
+    os.chmod(args.socket, 0o600)
+    # Exit through the finally below so the socket file is removed
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    print(f"Parapred inference server listening on {args.socket}", flush=True)
+    try:
+        serve(listener, model, info, args.workers, args.threads_per_worker)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        listener.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""
+Persistent on-disk cache of Parapred per-residue probabilities.
+
+Predictions are keyed by the flanked CDR sequence and scoped by a hash of the
+model weights, so replacing parapred_pytorch.h5 never serves stale values.
+The cache is a single SQLite database in WAL mode: any number of pipeline runs
+can read it concurrently while one of them writes. Once the stored payload
+exceeds the size cap, least-recently-used entries are evicted.
+
+The cache is used by command-line runs with --cache-dir / $PARAPRED_CACHE_DIR.
+The workflow does not pass one: its runs have no directory that outlives them.
+"""
+
+import contextlib
+import hashlib
+import os
+import sqlite3
+import time
+
+import numpy as np
+
+CACHE_FILENAME = "parapred-cache.sqlite"
+
+# SQLite limits the number of bound parameters per statement
+_QUERY_CHUNK = 500
+
+
+def hash_file(path, chunk_size=1 << 20):
+    """Return the hex SHA-256 digest of a file."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class PredictionCache:
+    """
+    Content-addressed store of per-residue probabilities for flanked CDR sequences.
+
+    Probabilities are stored as raw float32 bytes. `hits` and `misses` count
+    lookups made through this instance.
+    """
+
+    def __init__(self, cache_dir, model_hash, max_bytes):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, CACHE_FILENAME)
+        self.model_hash = model_hash
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+        self._conn = sqlite3.connect(self.path, timeout=300, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS predictions ("
+            " model TEXT NOT NULL,"
+            " sequence TEXT NOT NULL,"
+            " probs BLOB NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " last_used REAL NOT NULL,"
+            " PRIMARY KEY (model, sequence)"
+            ") WITHOUT ROWID"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS predictions_last_used ON predictions (last_used)"
+        )
+
+    def get_many(self, sequences):
+        """
+        Look up sequences in the cache.
+        Returns dict sequence -> float32 probability array for cache hits only.
+        Hits are marked as recently used.
+        """
+        found = {}
+        for start in range(0, len(sequences), _QUERY_CHUNK):
+            chunk = sequences[start:start + _QUERY_CHUNK]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self._conn.execute(
+                f"SELECT sequence, probs FROM predictions "
+                f"WHERE model = ? AND sequence IN ({placeholders})",
+                [self.model_hash, *chunk],
+            ).fetchall()
+            for seq, blob in rows:
+                found[seq] = np.frombuffer(blob, dtype=np.float32)
+
+        self.hits += len(found)
+        self.misses += len(sequences) - len(found)
+
+        if found:
+            now = time.time()
+            with self._transaction():
+                self._conn.executemany(
+                    "UPDATE predictions SET last_used = ? WHERE model = ? AND sequence = ?",
+                    ((now, self.model_hash, seq) for seq in found),
+                )
+        return found
+
+    def put_many(self, predictions):
+        """Store a dict sequence -> probability array. Empty arrays are not cached. Returns number stored."""
+        now = time.time()
+        rows = []
+        for seq, probs in predictions.items():
+            if len(probs) == 0:
+                continue
+            blob = np.asarray(probs, dtype=np.float32).tobytes()
+            rows.append((self.model_hash, seq, blob, len(blob) + len(seq), now))
+        if not rows:
+            return 0
+        with self._transaction():
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO predictions (model, sequence, probs, size, last_used) "
+                "VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+        return len(rows)
+
+    def evict(self):
+        """Drop least-recently-used entries until the cache fits into max_bytes. Returns number evicted."""
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM predictions").fetchone()[0]
+        excess = total - self.max_bytes
+        if excess <= 0:
+            return 0
+
+        victims = []
+        freed = 0
+        for model, seq, size in self._conn.execute(
+            "SELECT model, sequence, size FROM predictions ORDER BY last_used"
+        ):
+            victims.append((model, seq))
+            freed += size
+            if freed >= excess:
+                break
+
+        with self._transaction():
+            self._conn.executemany(
+                "DELETE FROM predictions WHERE model = ? AND sequence = ?", victims
+            )
+        return len(victims)
+
+    def close(self):
+        """Enforce the size cap and release the database connection."""
+        evicted = self.evict()
+        self._conn.close()
+        return evicted
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield self._conn
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        self._conn.execute("COMMIT")
@@ -0,0 +1,102 @@
+"""
+Per-region Parapred probability profiles, accumulated chunk by chunk in fixed
+memory: counts, sums and fine-grained histograms per chain, CDR and relative
+position within the CDR. Nothing per residue is kept.
+
+Writes two tables:
+
+  probability-profile.tsv    chain, cdr, relativePosition, residueCount,
+                             meanProbability, stdProbability, fractionAboveThreshold
+  probability-histogram.tsv  chain, cdr, relativePosition, probabilityBin, residueCount
+                             (empty bins are left out)
+"""
+
+import numpy as np
+
+CDRS = ["CDR1", "CDR2", "CDR3"]
+DEFAULT_POSITION_BINS = 10
+DEFAULT_PROBABILITY_BINS = 50
+
+
+def _bin_labels(num_bins):
+    """Percent range labels: "0-10%", "10-20%", ..."""
+    edges = np.linspace(0, 100, num_bins + 1)
+    return [f"{edges[i]:g}-{edges[i + 1]:g}%" for i in range(num_bins)]
+
+
+class ProbabilityProfile:
+    """
+    Running statistics of Parapred probabilities per region: chain, CDR and
+    relative position bin within the CDR (position_bins equal slices of its
+    length). For each region it keeps the residue count, the sum and sum of
+    squares of probabilities, the count at or above `threshold` and a histogram
+    of `probability_bins` equal-width bins, so memory does not grow with the input.
+    """
+
+    def __init__(self, num_chains, threshold, position_bins=DEFAULT_POSITION_BINS,
+                 probability_bins=DEFAULT_PROBABILITY_BINS):
+        self.num_chains = num_chains
+        self.threshold = threshold
+        self.position_bins = position_bins
+        self.probability_bins = probability_bins
+        # (chain, cdr, position bin) regions, flattened
+        num_regions = num_chains * len(CDRS) * position_bins
+        self.counts = np.zeros(num_regions, dtype=np.int64)
+        self.above = np.zeros(num_regions, dtype=np.int64)
+        self.sums = np.zeros(num_regions, dtype=np.float64)
+        self.squares = np.zeros(num_regions, dtype=np.float64)
+        self.histogram = np.zeros(num_regions * probability_bins, dtype=np.int64)
+
+    def update(self, cdr_probs, valid, cdr_lengths):
+        """
+        Add the predicted CDR residues of one chunk.
+
+        cdr_probs, valid: entries x longest-CDR matrices from gather_cdr_probabilities;
+        entries are in build_flanked_cdrs order, (row, chain, cdr) row-major.
+        cdr_lengths: CDR length of each entry.
+        """
+        entry, position = np.nonzero(valid)
+        if len(entry) == 0:
+            return
+        probs = cdr_probs[entry, position].astype(np.float64)
+        # Entry e is CDR e % 3 of chain (e // 3) % num_chains
+        chain_cdr = entry % (self.num_chains * len(CDRS))
+        position_bin = position * self.position_bins // cdr_lengths[entry]
+        region = chain_cdr * self.position_bins + position_bin
+        probability_bin = np.minimum((probs * self.probability_bins).astype(np.int64), self.probability_bins - 1)
+
+        size = len(self.counts)
+        self.counts += np.bincount(region, minlength=size)
+        self.above += np.bincount(region[probs >= self.threshold], minlength=size)
+        self.sums += np.bincount(region, weights=probs, minlength=size)
+        self.squares += np.bincount(region, weights=probs * probs, minlength=size)
+        self.histogram += np.bincount(region * self.probability_bins + probability_bin,
+                                      minlength=len(self.histogram))
+
+    def _regions(self):
+        """(chain, cdr, relativePosition) labels in region order."""
+        positions = _bin_labels(self.position_bins)
+        return [(str(chain), cdr, position)
+                for chain in range(self.num_chains) for cdr in CDRS for position in positions]
+
+    def write(self, profile_path, histogram_path):
+        counts = np.maximum(self.counts, 1)
+        mean = self.sums / counts
+        std = np.sqrt(np.maximum(self.squares / counts - mean * mean, 0.0))
+        fraction_above = self.above / counts
+
+        with open(profile_path, "w") as f:
+            f.write("chain\tcdr\trelativePosition\tresidueCount\tmeanProbability\tstdProbability\t"
+                    "fractionAboveThreshold\n")
+            for i, (chain, cdr, position) in enumerate(self._regions()):
+                if self.counts[i]:
+                    f.write(f"{chain}\t{cdr}\t{position}\t{self.counts[i]}\t{mean[i]:.6g}\t{std[i]:.6g}\t"
+                            f"{fraction_above[i]:.6g}\n")
+
+        bins = _bin_labels(self.probability_bins)
+        histogram = self.histogram.reshape(-1, self.probability_bins)
+        with open(histogram_path, "w") as f:
+            f.write("chain\tcdr\trelativePosition\tprobabilityBin\tresidueCount\n")
+            for (chain, cdr, position), row in zip(self._regions(), histogram):
+                for j in np.flatnonzero(row):
+                    f.write(f"{chain}\t{cdr}\t{position}\t{bins[j]}\t{row[j]}\n")
@@ -1,9 +1,30 @@
 import polars as pl
-import polars_ds as pds
 import argparse
+import os
+
+from centroid_distance import centroid_distances
+from cluster_diversity import DEFAULT_PAIR_BUDGET, cluster_diversity
+from result_tables import sink
+from step_metrics import StepMetrics, start_profiler
 
 parser = argparse.ArgumentParser(description='Process paratope clustering results and compute summaries')
+parser.add_argument('--diversity-pair-budget', type=int, default=DEFAULT_PAIR_BUDGET,
+                    help='Clusters with more distinct paratope pairs get pairwise diversity '
+                         'estimated from this many sampled member pairs')
+parser.add_argument('--identity', type=float, default=None,
+                    help='Identity of clusters.tsv; when given, writes clone-to-cluster-levels.tsv and '
+                         'abundances-levels.tsv with this level first, followed by any --level')
+parser.add_argument('--level', nargs=2, action='append', default=[], metavar=('IDENTITY', 'CLUSTERS'),
+                    help='Coarser cascaded clustering level, finest first: cluster TSV of the '
+                         'representatives of the previous level at IDENTITY. Adds '
+                         'clone-to-cluster-levels.tsv and abundances-levels.tsv')
+parser.add_argument('--metrics', default=None,
+                    help='Write per-stage wall/CPU time, peak RSS and row counts to this JSON file')
+parser.add_argument('--profile', default=None,
+                    help='Profile the run with cProfile and write the stats to this file')
 args = parser.parse_args()
+metrics = StepMetrics("process-results")
+start_profiler(args.profile)
 
 clustersTsv = "clusters.tsv"
 cloneTableTsv = "cloneTable.tsv"
@@ -13,224 +34,170 @@ cloneToClusterTsv = "clone-to-cluster.tsv"
 abundancesTsv = "abundances.tsv"
 abundancesPerClusterTsv = "abundances-per-cluster.tsv"
 clusterRadiusTsv = "cluster-radius.tsv"
+clusterDiversityTsv = "cluster-diversity.tsv"
+cloneToClusterLevelsTsv = "clone-to-cluster-levels.tsv"
+abundancesLevelsTsv = "abundances-levels.tsv"
+
+# Outputs are built as one lazy query graph over scanned inputs. Nodes that several
+# outputs read (clonotypes, cluster assignments, per-sample cluster abundances,
+# distances) are collected once with collect_all(): left lazy, projection pushdown
+# specializes them per output and polars no longer recognizes them as common
+# subplans. All outputs are then written by sinks run in one collect_all() call.
+
+# Keys and labels are identifiers, never let schema inference turn them into numbers
+key_schema = {"sampleId": pl.String, "clonotypeKey": pl.String, "clonotypeKeyLabel": pl.String}
 
 # sampleId, clonotypeKey, clonotypeKeyLabel, sequence_* columns, abundance
-cloneTable = pl.read_csv(cloneTableTsv, separator="\t")
+cloneTable = pl.scan_csv(cloneTableTsv, separator="\t", schema_overrides=key_schema)
 
-# clonotypeKey, paratope_sequence
-paratopeSequences = pl.read_csv(paratopeSequencesTsv, separator="\t")
+# clonotypeKey, paratope_sequence[, flanked_sequence]
+paratopeSequences = pl.scan_csv(paratopeSequencesTsv, separator="\t",
+                                schema_overrides={"clonotypeKey": pl.String})
 
 # Get all sequence columns
-sequence_cols = [col for col in cloneTable.columns
+sequence_cols = [col for col in cloneTable.collect_schema().names()
                  if col.startswith('sequence_')]
+has_flanked = "flanked_sequence" in paratopeSequences.collect_schema().names()
 
-# Create fullSequence by concatenating sequence columns
-if sequence_cols:
-    sorted_sequence_cols = sorted(sequence_cols)
-    cloneTable = cloneTable.with_columns(
-        pl.concat_str([pl.col(c).fill_null("") for c in sorted_sequence_cols], separator="====").alias('fullSequence')
-    )
+# One row per clonotype: labels and sequences do not depend on the sample, so
+# every per-clonotype lookup below reads this table
+clonotypes = cloneTable.drop("sampleId", "abundance").unique(subset=["clonotypeKey"], keep="first")
 
 # Transform clonotypeKeyLabel from "C-XXXXXX" to "CL-XXXXXX"
-cloneTable = cloneTable.with_columns(
+clonotypes = clonotypes.with_columns(
     pl.col('clonotypeKeyLabel').str.replace('C-', 'CL-', n=1).alias('clusterLabel')
 )
 
-# Join paratope sequences to clone table
-cloneTable = cloneTable.join(
+# Join paratope sequences to clonotypes
+clonotypes = clonotypes.join(
     paratopeSequences.unique(subset=["clonotypeKey"], keep="first"),
     on="clonotypeKey",
     how="left"
 )
 
 # clusterId, clonotypeKey
-clusters = pl.read_csv(clustersTsv, separator="\t", has_header=False,
-                       new_columns=["clusterId", "clonotypeKey"])
+cluster_schema = {"clusterId": pl.String, "clonotypeKey": pl.String}
+if os.path.getsize(clustersTsv) == 0:
+    cluster_members = pl.LazyFrame(schema=cluster_schema)
+else:
+    cluster_members = pl.scan_csv(clustersTsv, separator="\t", has_header=False, schema=cluster_schema)
 
 # Remove the "s-" prefix from clusterId and clonotypeKey
-clusters = clusters.with_columns(
+cluster_members = cluster_members.with_columns(
     pl.col("clusterId").str.strip_prefix("s-"),
     pl.col("clonotypeKey").str.strip_prefix("s-")
 )
 
+t0 = metrics.clock()
+clonotypes, cluster_members = (frame.lazy() for frame in pl.collect_all([clonotypes, cluster_members]))
+print(f"[TIMING] Load clonotypes and cluster members: {metrics.add('load', t0):.2f}s")
+
+# The FASTA holds one record per distinct paratope, named after the first
+# clonotype that has it: clonotypes missing from clusters.tsv join the cluster
+# of their paratope. A FASTA with one record per clonotype gives the same result.
+clonotype_paratopes = clonotypes.select("clonotypeKey", "paratope_sequence").filter(
+    pl.col("paratope_sequence").is_not_null() & (pl.col("paratope_sequence") != "")
+)
+paratope_clusters = cluster_members.join(
+    clonotype_paratopes, on="clonotypeKey", how="inner"
+).unique(subset=["paratope_sequence"], keep="first").select("paratope_sequence", "clusterId")
+expanded_members = clonotype_paratopes.join(
+    cluster_members, on="clonotypeKey", how="anti"
+).join(
+    paratope_clusters, on="paratope_sequence", how="inner"
+).select("clusterId", "clonotypeKey")
+
+clusters = pl.concat([cluster_members, expanded_members])
+
 # Calculate cluster sizes
 clusters = clusters.with_columns(
     pl.col('clonotypeKey').count().over('clusterId').alias('size')
 )
 
 # Merge clusters with cloneTable to get clusterLabel for the centroid
-labelsTable_for_join = cloneTable.select(
-    pl.col('clonotypeKey').alias('clusterId'),
-    'clusterLabel'
-).unique(subset=['clusterId'], keep='first')
-
 clusters = clusters.join(
-    labelsTable_for_join,
+    clonotypes.select(pl.col('clonotypeKey').alias('clusterId'), 'clusterLabel'),
     on='clusterId',
     how='left'
 )
 
-# --- Generate cluster-to-seq.tsv ---
-unique_clusters_info = clusters.select(["clusterId", "clusterLabel", "size"]).unique(subset=["clusterId"], keep="first")
-
-centroid_select_cols = [pl.col('clonotypeKey').alias("centroid_key_cts")] + sequence_cols + ["paratope_sequence"]
-if "flanked_sequence" in cloneTable.columns:
-    centroid_select_cols.append("flanked_sequence")
-
-centroid_sequences_for_cts = cloneTable.select(
-    centroid_select_cols
-).unique("centroid_key_cts", keep="first")
+t0 = metrics.clock()
+clusters = clusters.collect().lazy()
+print(f"[TIMING] Expand clusters: {metrics.add('expand', t0):.2f}s")
 
-cluster_to_seq_df = unique_clusters_info.join(
-    centroid_sequences_for_cts,
-    left_on="clusterId",
-    right_on="centroid_key_cts",
-    how="left"
-)
+# --- cluster-to-seq.tsv ---
+unique_clusters_info = clusters.select(["clusterId", "clusterLabel", "size"]).unique(subset=["clusterId"], keep="first")
 
 required_cols_cts = ['clusterId', 'clusterLabel', 'size'] + sequence_cols + ['paratope_sequence']
-if "flanked_sequence" in cluster_to_seq_df.columns:
+if has_flanked:
     required_cols_cts.append("flanked_sequence")
-cluster_to_seq = cluster_to_seq_df.select(required_cols_cts)
-cluster_to_seq.write_csv(clusterToSeqTsv, separator="\t")
 
+cluster_to_seq = unique_clusters_info.join(
+    clonotypes.select([pl.col('clonotypeKey').alias("clusterId")] + required_cols_cts[3:]),
+    on="clusterId",
+    how="left"
+).select(required_cols_cts)
 
-# --- Generate clone-to-cluster.tsv ---
+# --- clone-to-cluster.tsv ---
 clone_to_cluster = clusters.select(['clusterId',
                                     'clonotypeKey',
                                     'clusterLabel']
                                    ).with_columns(pl.lit(1).alias('link'))
-clone_to_cluster.write_csv(cloneToClusterTsv, separator="\t")
 
-
-# --- Generate abundances.tsv ---
-merged_abundances = cloneTable.select(['sampleId', 'clonotypeKey', 'abundance']).join(
+# --- abundances.tsv ---
+cluster_abundances = cloneTable.select(['sampleId', 'clonotypeKey', 'abundance']).join(
     clusters.select(['clusterId', 'clonotypeKey']).unique(subset=["clonotypeKey"], keep="first"),
-    left_on='clonotypeKey',
-    right_on='clonotypeKey',
+    on='clonotypeKey',
     how='inner'
-)
-
-cluster_abundances = merged_abundances.group_by(['sampleId', 'clusterId']).agg(
+).group_by(['sampleId', 'clusterId']).agg(
     pl.sum('abundance').alias('abundance')
+).with_columns(
+    (pl.col('abundance') / pl.sum('abundance').over('sampleId')).alias('abundance_normalized')
 )
 
-cluster_abundances = cluster_abundances.with_columns(
-    pl.sum('abundance').over('sampleId').alias('total_sample_abundance')
-)
-cluster_abundances = cluster_abundances.with_columns(
-    (pl.col('abundance') / pl.col('total_sample_abundance')).alias('abundance_normalized')
-)
-cluster_abundances = cluster_abundances.drop('total_sample_abundance')
-
-cluster_abundances.write_csv(abundancesTsv, separator="\t")
-
-# --- Generate abundances-per-cluster.tsv ---
-abundances_per_cluster = cluster_abundances.group_by(
-    'clusterId').agg(pl.sum('abundance').alias('abundance_per_cluster'))
-
-total_abundance = abundances_per_cluster.select(pl.sum('abundance_per_cluster')).item()
-abundances_per_cluster = abundances_per_cluster.with_columns(
-    pl.when(pl.lit(total_abundance) > 0)
-      .then(pl.col('abundance_per_cluster') / pl.lit(total_abundance))
-      .otherwise(pl.lit(0.0, dtype=pl.Float64))
-      .alias('abundance_fraction_per_cluster')
-)
-
-abundances_per_cluster.write_csv(abundancesPerClusterTsv, separator="\t")
-
-# --- Get top clusters for bubble plot ---
-top_cluster_ids_df = abundances_per_cluster.sort(
-    'abundance_per_cluster', descending=True
-).head(100).select('clusterId')
-
-# --- Export per-clonotype paratope sequences ---
+# --- Per-clonotype paratope sequences ---
 paratope_out_cols = ["clonotypeKey", "paratope_sequence"]
-if "flanked_sequence" in cloneTable.columns:
+if has_flanked:
     paratope_out_cols.append("flanked_sequence")
+paratope_sequences_out = clonotypes.select(paratope_out_cols)
 
-if "paratope_sequence" in cloneTable.columns:
-    (
-        cloneTable
-        .select(paratope_out_cols)
-        .unique(subset=["clonotypeKey"], keep="first")
-    ).write_csv("paratope-sequences.tsv", separator="\t")
-else:
-    empty_data = {"clonotypeKey": [], "paratope_sequence": [], "flanked_sequence": []}
-    pl.DataFrame(empty_data).write_csv("paratope-sequences.tsv", separator="\t")
-
-
-# --- Generate distance_to_centroid.tsv ---
-distance_df_base = clusters.select([
+# --- distance_to_centroid.tsv ---
+# Use paratope sequences for distance calculation
+distance_df = clusters.select([
     pl.col("clonotypeKey"),
     pl.col("clusterId"),
     pl.col("clusterLabel")
-])
-
-member_original_labels = cloneTable.select([
-    pl.col("clonotypeKey").alias("member_key_for_label_join"),
-    pl.col("clonotypeKeyLabel")
-]).unique("member_key_for_label_join", keep="first")
-
-distance_df = distance_df_base.join(
-    member_original_labels,
-    left_on="clonotypeKey",
-    right_on="member_key_for_label_join",
+]).join(
+    clonotypes.select(
+        "clonotypeKey",
+        "clonotypeKeyLabel",
+        pl.col("paratope_sequence").fill_null("").alias("member_paratope")
+    ),
+    on="clonotypeKey",
     how="left"
-)
-
-# Use paratope sequences for distance calculation
-member_para_seq = cloneTable.select([
-    pl.col("clonotypeKey").alias("member_join_key"),
-    pl.col("paratope_sequence").fill_null("").alias("member_paratope")
-]).unique("member_join_key", keep="first")
-
-centroid_para_seq = cloneTable.select([
-    pl.col("clonotypeKey").alias("centroid_join_key"),
-    pl.col("paratope_sequence").fill_null("").alias("centroid_paratope")
-]).unique("centroid_join_key", keep="first")
-
-distance_df = distance_df.join(
-    member_para_seq,
-    left_on="clonotypeKey",
-    right_on="member_join_key",
+).join(
+    clonotypes.select(
+        pl.col("clonotypeKey").alias("clusterId"),
+        pl.col("paratope_sequence").fill_null("").alias("centroid_paratope")
+    ),
+    on="clusterId",
     how="left"
 )
 
-distance_df = distance_df.join(
-    centroid_para_seq,
-    left_on="clusterId",
-    right_on="centroid_join_key",
-    how="left"
-)
-
-# Calculate normalized Levenshtein distance on paratope sequences
-distance_df = distance_df.with_columns(
-    pl.when(pl.col("member_paratope").is_not_null() & pl.col("centroid_paratope").is_not_null())
-      .then(pds.str_leven(pl.col("member_paratope"), pl.col("centroid_paratope"), return_sim=False))
-      .when(pl.col("member_paratope").is_not_null() & pl.col("centroid_paratope").is_null())
-      .then(pl.col("member_paratope").str.len_chars())
-      .when(pl.col("member_paratope").is_null() & pl.col("centroid_paratope").is_not_null())
-      .then(pl.col("centroid_paratope").str.len_chars())
-      .otherwise(0)
-      .alias("raw_distance"),
-
-    pl.col("centroid_paratope").str.len_chars().fill_null(0).alias("centroid_length")
-)
-
-distance_df = distance_df.with_columns(
-    pl.when(pl.col("centroid_length") > 0)
-      .then(
-          pl.min_horizontal(
-              pl.lit(1.0, dtype=pl.Float64),
-              pl.col("raw_distance").cast(pl.Float64) / pl.col("centroid_length").cast(pl.Float64)
-          )
-      )
-      .when(pl.col("raw_distance") == 0)
-      .then(pl.lit(0.0, dtype=pl.Float64))
-      .otherwise(pl.lit(1.0, dtype=pl.Float64))
-      .alias("distanceToCentroid")
+# Normalized Levenshtein distance on paratope sequences, once per distinct
+# (member, centroid) paratope pair, see centroid_distance.py
+t0 = metrics.clock()
+distance_df = distance_df.collect()
+distance_pairs = distance_df.select("member_paratope", "centroid_paratope").unique()
+distance_pairs = distance_pairs.with_columns(pl.Series(
+    "distanceToCentroid",
+    centroid_distances(distance_pairs["member_paratope"], distance_pairs["centroid_paratope"]),
+    dtype=pl.Float64,
+))
+distance_df = distance_df.lazy().join(
+    distance_pairs.lazy(), on=["member_paratope", "centroid_paratope"], how="left"
 )
+print(f"[TIMING] Distances of {len(distance_pairs)} distinct paratope pairs: {metrics.add('centroid_distances', t0):.2f}s")
 
 output_columns = [
     "clonotypeKey",
@@ -239,26 +206,120 @@ output_columns = [
     "clusterLabel",
     "distanceToCentroid"
 ]
-distance_df_to_write = distance_df.select(output_columns)
-distance_df_to_write = distance_df_to_write.unique(subset=["clonotypeKey"], keep="first")
+distance_to_centroid = distance_df.select(output_columns).unique(subset=["clonotypeKey"], keep="first")
 
-output_distance_tsv = "distance_to_centroid.tsv"
-distance_df_to_write.write_csv(output_distance_tsv, separator="\t")
-print(f"Generated {output_distance_tsv}")
+t0 = metrics.clock()
+cluster_abundances, distance_to_centroid = (
+    frame.lazy() for frame in pl.collect_all([cluster_abundances, distance_to_centroid])
+)
+print(f"[TIMING] Cluster abundances and distances to centroid: {metrics.add('distances', t0):.2f}s")
 
-# --- Generate cluster-radius.tsv ---
-cluster_radius_df = distance_df_to_write.group_by("clusterId").agg(
-    pl.max("distanceToCentroid").alias("clusterRadius")
+# --- abundances-per-cluster.tsv ---
+total_abundance = pl.sum('abundance_per_cluster')
+abundances_per_cluster = cluster_abundances.group_by(
+    'clusterId').agg(pl.sum('abundance').alias('abundance_per_cluster')).with_columns(
+    pl.when(total_abundance > 0)
+      .then(pl.col('abundance_per_cluster') / total_abundance)
+      .otherwise(pl.lit(0.0, dtype=pl.Float64))
+      .alias('abundance_fraction_per_cluster')
 )
-cluster_radius_df.write_csv(clusterRadiusTsv, separator="\t")
-print(f"Generated {clusterRadiusTsv}")
 
-# --- Generate files for top clusters for bubble plotting ---
-cluster_abundances_top_df = cluster_abundances.join(top_cluster_ids_df, on="clusterId", how="inner")
-cluster_abundances_top_df.write_csv("abundances-top.tsv", separator="\t")
+# --- Top clusters for bubble plot ---
+top_cluster_ids = abundances_per_cluster.sort(
+    'abundance_per_cluster', descending=True
+).head(100).select('clusterId')
 
-cluster_to_seq_top_df = cluster_to_seq.join(top_cluster_ids_df, on="clusterId", how="inner")
-cluster_to_seq_top_df.write_csv("cluster-to-seq-top.tsv", separator="\t")
+# --- cluster-radius.tsv ---
+cluster_radius = distance_to_centroid.group_by("clusterId").agg(
+    pl.max("distanceToCentroid").alias("clusterRadius")
+)
 
-cluster_radius_top_df = cluster_radius_df.join(top_cluster_ids_df, on="clusterId", how="inner")
-cluster_radius_top_df.write_csv("cluster-radius-top.tsv", separator="\t")
+# --- cluster-diversity.tsv ---
+t0 = metrics.clock()
+cluster_diversity_df = cluster_diversity(
+    clusters.select("clusterId", "clonotypeKey").join(
+        clonotypes.select("clonotypeKey", "paratope_sequence"), on="clonotypeKey", how="left"
+    ).collect(),
+    args.diversity_pair_budget,
+)
+print(f"[TIMING] Pairwise diversity of {len(cluster_diversity_df)} clusters "
+      f"({cluster_diversity_df['pairsSampled'].sum()} sampled): {metrics.add('diversity', t0):.2f}s")
+
+# --- clone-to-cluster-levels.tsv, abundances-levels.tsv ---
+# Cascaded clustering: each coarser level clustered the representatives of the
+# previous one, so a clonotype's cluster at a level is the cluster of its cluster
+# at the previous level. Cluster ids stay representative clonotype keys.
+level_outputs = {}
+if args.identity is not None:
+    identities = [args.identity] + [float(identity) for identity, _ in args.level]
+    level_columns = [f"clusterId_{identity:g}" for identity in identities]
+    clone_to_levels = clusters.select("clonotypeKey", pl.col("clusterId").alias(level_columns[0]))
+    for column, previous, (_, path) in zip(level_columns[1:], level_columns, args.level):
+        level_clusters = pl.scan_csv(path, separator="\t", has_header=False,
+                                     schema={column: pl.String, previous: pl.String}).select(
+            pl.col(column).str.strip_prefix("s-"),
+            pl.col(previous).str.strip_prefix("s-"),
+        ).unique(subset=[previous], keep="first")
+        # A representative missing from the level (no record in its FASTA) stays its own cluster
+        clone_to_levels = clone_to_levels.join(level_clusters, on=previous, how="left").with_columns(
+            pl.coalesce(column, previous).alias(column)
+        )
+    clone_to_levels = clone_to_levels.unique(subset=["clonotypeKey"], keep="first").collect().lazy()
+
+    # Abundances of the finest level summed per coarser cluster
+    level_map = clone_to_levels.select(level_columns).unique(subset=[level_columns[0]], keep="first")
+    abundances_levels = pl.concat([
+        cluster_abundances.join(
+            level_map.select(pl.col(level_columns[0]).alias("clusterId"), column),
+            on="clusterId", how="inner"
+        ).group_by(["sampleId", column]).agg(pl.sum("abundance")).select(
+            pl.lit(identity, dtype=pl.Float64).alias("identity"),
+            "sampleId",
+            pl.col(column).alias("clusterId"),
+            "abundance",
+            (pl.col("abundance") / pl.sum("abundance").over("sampleId")).alias("abundance_normalized"),
+        )
+        for identity, column in zip(identities, level_columns)
+    ])
+    level_outputs = {cloneToClusterLevelsTsv: clone_to_levels, abundancesLevelsTsv: abundances_levels}
+
+# --- Write all outputs in one pass ---
+outputs = {
+    clusterToSeqTsv: cluster_to_seq,
+    cloneToClusterTsv: clone_to_cluster,
+    abundancesTsv: cluster_abundances,
+    abundancesPerClusterTsv: abundances_per_cluster,
+    "paratope-sequences.tsv": paratope_sequences_out,
+    "distance_to_centroid.tsv": distance_to_centroid,
+    clusterRadiusTsv: cluster_radius,
+    clusterDiversityTsv: cluster_diversity_df.lazy(),
+    # Top clusters for bubble plotting
+    "abundances-top.tsv": cluster_abundances.join(top_cluster_ids, on="clusterId", how="inner"),
+    "cluster-to-seq-top.tsv": cluster_to_seq.join(top_cluster_ids, on="clusterId", how="inner"),
+    "cluster-radius-top.tsv": cluster_radius.join(top_cluster_ids, on="clusterId", how="inner"),
+    **level_outputs,
+}
+t0 = metrics.clock()
+pl.collect_all(
+    [sink(frame, path) for path, frame in outputs.items()],
+    engine="streaming",
+)
+for path in outputs:
+    print(f"Generated {path}")
+print(f"[TIMING] Write outputs: {metrics.add('write', t0):.2f}s")
+print(f"[TIMING] Total: {metrics.elapsed():.2f}s")
+
+if args.metrics:
+    num_clonotypes = clonotypes.select(pl.len()).collect().item()
+    metrics.set(
+        num_clonotypes=num_clonotypes,
+        num_clustered_clonotypes=clusters.select(pl.len()).collect().item(),
+        num_expanded_clonotypes=expanded_members.select(pl.len()).collect().item(),
+        num_clusters=clusters.select(pl.col("clusterId").n_unique()).collect().item(),
+        num_clusters_per_level=(
+            clone_to_levels.select(pl.all().exclude("clonotypeKey").n_unique()).collect().row(0, named=True)
+            if args.identity is not None else None
+        ),
+        clonotypes_per_second=round(num_clonotypes / max(metrics.elapsed(), 1e-9), 1),
+    )
+    metrics.write(args.metrics)
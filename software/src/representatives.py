@@ -0,0 +1,28 @@
+"""
+Write the representatives of a clustering as FASTA, the input of the next, coarser
+level of cascaded clustering: each level clusters only the representatives of the
+previous one.
+"""
+
+import argparse
+
+from fasta import read_fasta, write_fasta
+from incremental_clusters import read_clusters
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract cluster representatives from a paratope FASTA")
+    parser.add_argument("--fasta", required=True, help="Clustered paratope FASTA")
+    parser.add_argument("--clusters", required=True, help="Cluster TSV (representative, member) of the FASTA")
+    parser.add_argument("--output", default="representatives.fasta")
+    args = parser.parse_args()
+
+    records = read_fasta(args.fasta)
+    representatives = read_clusters(args.clusters)["representative"].unique(maintain_order=True).to_list()
+    write_fasta(args.output, ((name, records[name]) for name in representatives))
+
+    print(f"{len(representatives)} representatives of {len(records)} sequences")
+
+
+if __name__ == "__main__":
+    main()
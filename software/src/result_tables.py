@@ -0,0 +1,22 @@
+"""
+Writing of clustering result tables, shared by process_results and create_empty_files.
+
+Tables are TSV only. main.tpl.tengo imports every table with xsv.importFile,
+which parses CSV/TSV text and stores the resulting columns as Parquet
+(storageFormat: "Parquet") itself; the pframes import has no entry point for a
+Parquet or Arrow IPC input file, so typed binary outputs would have no reader.
+For the same reason each table stays in its own file rather than one
+multi-table file: one import call maps one file to one set of columns.
+"""
+
+import polars as pl
+
+
+def sink(frame, path):
+    """Lazy sink writing a LazyFrame as a TSV result table; run with pl.collect_all()."""
+    return frame.sink_csv(path, separator="\t", lazy=True)
+
+
+def write_empty(path, columns):
+    """Write a header-only TSV table."""
+    pl.DataFrame(schema=dict.fromkeys(columns, pl.String)).write_csv(path, separator="\t")
@@ -5,132 +5,410 @@ extracts paratope residues above threshold, and outputs FASTA + paratope positio
 Input: TSV with columns clonotypeKey, FR1, CDR1, FR2, CDR2, FR3, CDR3, FR4
        (optionally duplicated for heavy/light chains as FR1_0, CDR1_0, ... FR4_1, CDR1_1, ...)
 Output:
-  - output.fasta: paratope sequences for MMseqs2 clustering
-  - paratope-sequences.tsv: clonotypeKey -> paratope_sequence mapping
+  - output.fasta: unique paratope sequences for MMseqs2 clustering, each named after
+    the first clonotype that has it
+  - paratope-sequences.tsv: clonotypeKey -> paratope_sequence mapping, used to expand
+    clusters back to all clonotypes sharing a paratope
+  - probability-distribution.tsv: 10-bin histogram of all CDR residue probabilities
+  - probability-profile.tsv, probability-histogram.tsv: the same per chain, CDR and
+    relative position, with finer bins (see probability_profile.py)
+  - fallbacks.tsv: clonotypes clustered by their full CDR sequence, and why (--fallback-report)
+  - optional --metrics JSON with per-stage timings, peak memory and throughput
+
+The input is streamed in row chunks (--chunk-size); outputs are appended per chunk,
+so memory is bounded by the chunk size plus the predictions of unique sequences.
 """
 
 import argparse
+import contextlib
 import os
-import re
 import sys
-import time
 
-import pandas as pd
 import numpy as np
-
-# Standard amino acid letters accepted by Parapred's MEILER encoding
-_VALID_AA = set("ACDEFGHIKLMNPQRSTVWY")
-_INVALID_AA_RE = re.compile(r"[^ACDEFGHIKLMNPQRSTVWY]")
-
-try:
-    import torch
-    from parapred.model import Parapred, clean_output
-    from parapred.cnn import generate_mask
-    from parapred.preprocessing import encode_batch
-except ImportError as e:
-    print(
-        f"ERROR: parapred-pytorch not installed. This script requires the parapred environment. ({e})",
-        file=sys.stderr,
-    )
-    sys.exit(1)
-
-WEIGHTS_PATH = os.path.join(os.path.dirname(__file__), "weights", "parapred_pytorch.h5")
+import polars as pl
+
+import parapred_engine as engine
+from parapred_engine import (
+    BACKENDS,
+    DEFAULT_BACKEND_MAX_ERROR,
+    DEFAULT_BACKEND_MIN_AGREEMENT,
+    DEFAULT_BATCH_RESIDUES,
+    MAX_LENGTH,
+    WEIGHTS_PATH,
+)
+from parapred_server import InferenceClient
+from prediction_cache import PredictionCache, hash_file
+from probability_profile import ProbabilityProfile
+from step_metrics import StepMetrics, start_profiler
+
+# Residues Parapred's MEILER encoding cannot represent
+_INVALID_AA_PATTERN = r"[^ACDEFGHIKLMNPQRSTVWY]"
+
+# Cell values treated as missing (the pandas read_csv defaults)
+_NA_VALUES = [
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN",
+    "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null",
+]
+
+# Why a clonotype fell back to its full CDR sequence, keyed by had_prediction_failure
+_FALLBACK_REASONS = {True: "cdr_too_long", False: "no_residues_above_threshold"}
+
+def detect_chain_sets(columns):
+    """
+    Detect column naming: chain-indexed (CDR1_0, CDR1_1) or plain (CDR1, CDR2).
+    Returns list of (cdr_cols, fr_cols) per chain.
+    """
+    chain_sets = []
+    if "CDR1_0" in columns:
+        chain_idx = 0
+        while f"CDR1_{chain_idx}" in columns:
+            cdr_cols = [
+                f"CDR1_{chain_idx}",
+                f"CDR2_{chain_idx}",
+                f"CDR3_{chain_idx}",
+            ]
+            fr_cols = [
+                f"FR1_{chain_idx}",
+                f"FR2_{chain_idx}",
+                f"FR3_{chain_idx}",
+                f"FR4_{chain_idx}",
+            ]
+            chain_sets.append((cdr_cols, fr_cols))
+            chain_idx += 1
+    else:
+        chain_sets.append(
+            (["CDR1", "CDR2", "CDR3"], ["FR1", "FR2", "FR3", "FR4"])
+        )
+    return chain_sets
 
 
-def load_model():
-    """Load the Parapred model with pretrained weights."""
-    model = Parapred()
-    model.load_state_dict(torch.load(WEIGHTS_PATH, map_location="cpu"))
-    model.eval()
-    return model
+def read_chunks(path, chunk_rows):
+    """Yield the input TSV in chunks of about chunk_rows rows, all columns as strings."""
+    reader = pl.read_csv_batched(
+        path,
+        separator="\t",
+        infer_schema_length=0,
+        null_values=_NA_VALUES,
+        batch_size=chunk_rows,
+    )
+    pending = []
+    pending_rows = 0
+    while True:
+        batches = reader.next_batches(1)
+        if batches:
+            pending.extend(batches)
+            pending_rows += sum(len(b) for b in batches)
+        if pending and (pending_rows >= chunk_rows or not batches):
+            yield pl.concat(pending).fill_null("")
+            pending = []
+            pending_rows = 0
+        if not batches:
+            return
+
+
+class ProbabilityStore:
+    """
+    Predictions for every unique flanked sequence seen so far, across input chunks.
 
+    Each sequence gets one row of a padded float32 matrix (MAX_LENGTH columns);
+    `lengths` holds the number of predicted residues per row, 0 meaning the
+    sequence was not predicted (too long for Parapred). Capacity grows geometrically.
+    """
 
-def build_flanked_cdrs(row, cdr_cols, fr_cols):
+    def __init__(self, capacity=1024):
+        self.index = {}  # sequence -> row
+        self._probs = np.zeros((capacity, MAX_LENGTH), dtype=np.float32)
+        self._lengths = np.zeros(capacity, dtype=np.int32)
+
+    def __len__(self):
+        return len(self.index)
+
+    @property
+    def probs(self):
+        return self._probs[:len(self.index)]
+
+    @property
+    def lengths(self):
+        return self._lengths[:len(self.index)]
+
+    def add(self, sequences):
+        """Allocate rows for sequences not seen before; returns their row numbers."""
+        start = len(self.index)
+        end = start + len(sequences)
+        if end > len(self._lengths):
+            capacity = max(end, 2 * len(self._lengths))
+            probs = np.zeros((capacity, MAX_LENGTH), dtype=np.float32)
+            probs[:start] = self._probs[:start]
+            lengths = np.zeros(capacity, dtype=np.int32)
+            lengths[:start] = self._lengths[:start]
+            self._probs, self._lengths = probs, lengths
+        for row, seq in enumerate(sequences, start):
+            self.index[seq] = row
+        return np.arange(start, end)
+
+    def set(self, row, values):
+        self._probs[row, :len(values)] = values
+        self._lengths[row] = len(values)
+
+    def get(self, row):
+        return self._probs[row, :self._lengths[row]]
+
+    def rows(self, sequences):
+        return np.fromiter((self.index[s] for s in sequences), dtype=np.int64, count=len(sequences))
+
+    def save(self, path):
+        """
+        Write all predictions to a compact .npz file: concatenated sequences with
+        their lengths, predicted lengths, and the unpadded float32 probabilities.
+        """
+        sequences = list(self.index)  # insertion order is row order
+        lengths = self.lengths
+        with open(path, "wb") as f:
+            np.savez(
+                f,
+                sequences=np.frombuffer("".join(sequences).encode("ascii"), dtype=np.uint8),
+                sequence_lengths=np.fromiter(map(len, sequences), dtype=np.int32, count=len(sequences)),
+                lengths=lengths.astype(np.uint8),
+                probs=self.probs[np.arange(MAX_LENGTH) < lengths[:, None]],
+            )
+
+    @classmethod
+    def load(cls, path):
+        """Read predictions written by save()."""
+        with np.load(path) as data:
+            joined = data["sequences"].tobytes().decode("ascii")
+            sequence_lengths = data["sequence_lengths"]
+            lengths = data["lengths"].astype(np.int32)
+            flat_probs = data["probs"]
+
+        ends = np.cumsum(sequence_lengths)
+        sequences = [joined[end - n:end] for end, n in zip(ends.tolist(), sequence_lengths.tolist())]
+        store = cls(capacity=max(len(sequences), 1024))
+        store.add(sequences)
+        store._probs[:len(sequences)][np.arange(MAX_LENGTH) < lengths[:, None]] = flat_probs
+        store._lengths[:len(sequences)] = lengths
+        return store
+
+
+def build_flanked_cdrs(df, chain_sets):
     """
     Build flanked CDR sequences for Parapred from FR and CDR columns.
     Parapred expects CDR sequences flanked by 2 residues from surrounding FRs.
 
-    Returns list of (flanked_cdr, cdr_start, cdr_end) tuples for CDR1, CDR2, CDR3.
-    cdr_start/cdr_end are 0-based indices of the actual CDR within the flanked sequence.
+    Works on whole columns: each FR/CDR column is sanitized once, flanks are cut
+    with column-wise string slicing. Columns missing from df read as empty.
+
+    Returns a polars DataFrame with one entry per (row, chain, CDR) in row-major
+    order, i.e. entry (row, chain, cdr) is at (row * len(chain_sets) + chain) * 3 + cdr.
+    Columns: row, flanked, cdr_seq, cdr_start, cdr_end. cdr_start/cdr_end are 0-based
+    indices of the actual CDR within the flanked sequence; entries with an empty
+    CDR have flanked = "" and cdr_start = cdr_end = 0.
+    """
+    used_cols = list(dict.fromkeys(
+        col for cdr_cols, fr_cols in chain_sets for col in (*fr_cols, *cdr_cols)
+    ))
+    clean = df.with_columns(
+        pl.col(col).fill_null("").str.replace_all(_INVALID_AA_PATTERN, "").alias(col)
+        if col in df.columns else pl.lit("", dtype=pl.String).alias(col)
+        for col in used_cols
+    ).select(used_cols)
+
+    flanked, cdr_seqs, cdr_starts, cdr_ends = [], [], [], []
+    for cdr_cols, fr_cols in chain_sets:
+        for cdr_idx in range(3):
+            # Take last 2 residues from left FR, first 2 from right FR
+            left_flank = pl.col(fr_cols[cdr_idx]).str.slice(-2)
+            right_flank = pl.col(fr_cols[cdr_idx + 1]).str.slice(0, 2)
+            cdr = pl.col(cdr_cols[cdr_idx])
+            cdr_len = cdr.str.len_chars().cast(pl.Int32)
+            has_cdr = cdr_len > 0
+            cdr_start = pl.when(has_cdr).then(left_flank.str.len_chars().cast(pl.Int32)).otherwise(0)
+
+            flanked.append(pl.when(has_cdr).then(pl.concat_str([left_flank, cdr, right_flank])).otherwise(pl.lit("")))
+            cdr_seqs.append(cdr)
+            cdr_starts.append(cdr_start)
+            cdr_ends.append(cdr_start + cdr_len)
+
+    entry_cols = ["flanked", "cdr_seq", "cdr_start", "cdr_end"]
+    return clean.select(
+        pl.int_range(pl.len(), dtype=pl.UInt32).alias("row"),
+        pl.concat_list(flanked).alias("flanked"),
+        pl.concat_list(cdr_seqs).alias("cdr_seq"),
+        pl.concat_list(cdr_starts).cast(pl.List(pl.Int32)).alias("cdr_start"),
+        pl.concat_list(cdr_ends).cast(pl.List(pl.Int32)).alias("cdr_end"),
+    ).explode(entry_cols)
+
+
+def plan_batches(sequences, max_residues=DEFAULT_BATCH_RESIDUES, max_length=MAX_LENGTH):
     """
-    results = []
-    flank_pairs = [
-        (fr_cols[0], cdr_cols[0], fr_cols[1]),  # FR1, CDR1, FR2
-        (fr_cols[1], cdr_cols[1], fr_cols[2]),  # FR2, CDR2, FR3
-        (fr_cols[2], cdr_cols[2], fr_cols[3]),  # FR3, CDR3, FR4
-    ]
+    Bucket sequences by length and cut them into batches by a residue budget.
 
-    for left_fr, cdr, right_fr in flank_pairs:
-        left_seq = _INVALID_AA_RE.sub("", str(row.get(left_fr, "") or ""))
-        cdr_seq = _INVALID_AA_RE.sub("", str(row.get(cdr, "") or ""))
-        right_seq = _INVALID_AA_RE.sub("", str(row.get(right_fr, "") or ""))
+    All sequences are ordered by length (longest first) before batching, so each
+    batch holds sequences of near-identical length and is padded only to its own
+    longest member. A batch is filled while rows x longest length stays within
+    max_residues. Empty sequences and sequences longer than max_length are left out.
 
-        if not cdr_seq:
-            results.append(("", 0, 0))
-            continue
+    Returns (batches, stats): batches is a list of index arrays into `sequences`;
+    stats holds residue counts for padding reports.
+    """
+    lengths = np.fromiter((len(s) for s in sequences), dtype=np.int64, count=len(sequences))
+    candidates = np.flatnonzero((lengths > 0) & (lengths <= max_length))
+    order = candidates[np.argsort(-lengths[candidates], kind="stable")]
+    sorted_lengths = lengths[order]
+
+    batches = []
+    padded = 0
+    start = 0
+    while start < len(order):
+        longest = int(sorted_lengths[start])
+        size = max(1, max_residues // longest)
+        batch = order[start:start + size]
+        batches.append(batch)
+        padded += len(batch) * longest
+        start += size
+
+    stats = {
+        "sequences": len(order),
+        "residues": int(sorted_lengths.sum()),
+        "padded_residues": padded,
+        "fixed_padded_residues": len(order) * max_length,
+    }
+    return batches, stats
+
+
+def gather_cdr_probabilities(entries, probs, prob_lengths):
+    """
+    Gather the CDR part of each entry's prediction from the probability matrix.
 
-        # Take last 2 residues from left FR, first 2 from right FR
-        left_flank = left_seq[-2:] if len(left_seq) >= 2 else left_seq
-        right_flank = right_seq[:2] if len(right_seq) >= 2 else right_seq
+    entries: frame from build_flanked_cdrs with a `uidx` column holding the entry's
+    row in `probs` (-1 for entries without a flanked sequence). probs is the
+    unique sequences x MAX_LENGTH probability matrix, prob_lengths the number of
+    predicted residues per row (0 when the sequence was not predicted).
 
-        flanked = left_flank + cdr_seq + right_flank
-        cdr_start = len(left_flank)
-        cdr_end = cdr_start + len(cdr_seq)
-        results.append((flanked, cdr_start, cdr_end))
+    Returns (cdr_probs, valid, predicted): entries x longest-CDR matrices of
+    probabilities and of the residues covered by a prediction, and a per-entry
+    flag telling whether the entry's sequence was predicted at all.
+    """
+    uidx = entries["uidx"].to_numpy()
+    cdr_starts = entries["cdr_start"].to_numpy()
+    cdr_lens = entries["cdr_end"].to_numpy() - cdr_starts
+    max_cdr_len = int(cdr_lens.max()) if len(cdr_lens) else 0
+
+    rows = np.maximum(uidx, 0)
+    pred_lens = np.where(uidx >= 0, prob_lengths[rows], 0) if len(prob_lengths) else np.zeros_like(uidx)
+    positions = np.arange(max_cdr_len)
+    cols = cdr_starts[:, None] + positions
+    valid = (positions < cdr_lens[:, None]) & (cols < pred_lens[:, None])
+
+    if len(probs):
+        cdr_probs = probs[rows[:, None], np.minimum(cols, probs.shape[1] - 1)]
+    else:
+        cdr_probs = np.zeros(valid.shape, dtype=np.float32)
+    return cdr_probs, valid, pred_lens > 0
 
-    return results
 
+def cdr_residue_matrix(entries, width):
+    """Entries x width uint8 matrix of CDR residues, zero-padded."""
+    if width == 0:
+        return np.zeros((len(entries), 0), dtype=np.uint8)
+    joined = entries["cdr_seq"].str.pad_end(width, "\0").str.join("").item()
+    return np.frombuffer(joined.encode("ascii"), dtype=np.uint8).reshape(len(entries), width)
 
-def predict_batch(model, flanked_sequences, max_length=40):
-    """
-    Run Parapred on a list of flanked CDR sequences.
-    Returns list of numpy arrays with per-residue probabilities.
-    Empty sequences get empty arrays. Sequences longer than max_length are skipped.
+
+def extract_paratopes(cdr_residues, cdr_probs, valid, threshold, entries_per_row):
     """
-    valid = [(i, seq) for i, seq in enumerate(flanked_sequences) if seq and len(seq) <= max_length]
-    results = [np.array([]) for _ in flanked_sequences]
+    Extract paratopes from CDR regions using X-masking: residues above the probability
+    threshold are kept, others are replaced with 'X'. This preserves positional alignment
+    so that MMseqs2 distances remain meaningful across clonotypes.
 
-    if not valid:
-        return results
+    Works on the entry matrices from gather_cdr_probabilities / cdr_residue_matrix;
+    the consecutive entries of a row are concatenated into one paratope.
+    Returns (paratopes, n_above): per-row paratope strings and number of residues
+    at or above the threshold.
+    """
+    above = valid & (cdr_probs >= threshold)
+    masked = np.where(above, cdr_residues, np.where(valid, ord("X"), 0)).astype(np.uint8)
 
-    # Sort by length descending (required for pack_padded_sequence in LSTM)
-    valid_sorted = sorted(valid, key=lambda x: len(x[1]), reverse=True)
-    indices_sorted = [v[0] for v in valid_sorted]
-    seqs_sorted = [v[1] for v in valid_sorted]
+    per_row = masked.reshape(len(masked) // entries_per_row, entries_per_row * masked.shape[1])
+    n_above = above.reshape(per_row.shape).sum(axis=1)
+    if per_row.shape[1] == 0:
+        return [""] * len(per_row), n_above
 
-    encoded, lengths = encode_batch(seqs_sorted, max_length=max_length)
-    mask = generate_mask(encoded, lengths)
+    # Move residues to the front of each row; trailing zero bytes end the string
+    order = np.argsort(per_row == 0, axis=1, kind="stable")
+    compact = np.ascontiguousarray(np.take_along_axis(per_row, order, axis=1))
+    paratopes = compact.view(f"S{compact.shape[1]}").ravel()
+    return np.char.decode(paratopes, "ascii").tolist(), n_above
 
-    with torch.no_grad():
-        probs = model(encoded, mask, lengths)
 
-    for batch_idx, orig_idx in enumerate(indices_sorted):
-        seq_len = len(seqs_sorted[batch_idx])
-        seq_probs = clean_output(probs[batch_idx], seq_len)
-        results[orig_idx] = seq_probs.numpy().flatten()
+def build_paratope_rows(df, entries, cdr_residues, cdr_probs, valid, predicted, threshold):
+    """
+    Assemble per-clonotype outputs for one chunk.
 
-    return results
+    Returns a frame with clonotypeKey, paratope_sequence, flanked_sequence, and the
+    fallback / had_prediction_failure flags. Clonotypes whose paratope is empty or
+    all-X (no informative residues) fall back to the full CDR sequence.
+    """
+    entries_per_row = len(entries) // max(len(df), 1)
+    paratopes, n_above = extract_paratopes(cdr_residues, cdr_probs, valid, threshold, entries_per_row)
+
+    # Track if prediction was skipped (too long or no probs)
+    has_cdr = (entries["cdr_end"] > entries["cdr_start"]).to_numpy()
+    had_prediction_failure = (has_cdr & ~predicted).reshape(len(df), entries_per_row).any(axis=1)
+
+    return entries.group_by("row", maintain_order=True).agg(
+        pl.col("cdr_seq").str.join("").alias("cdr_sequence"),
+        pl.col("flanked").str.join("").alias("flanked_sequence"),
+    ).with_columns(
+        df["clonotypeKey"].alias("clonotypeKey"),
+        pl.Series("paratope_sequence", paratopes, dtype=pl.String),
+        pl.Series("fallback", n_above == 0) & (pl.col("cdr_sequence") != ""),
+        pl.Series("had_prediction_failure", had_prediction_failure),
+    ).with_columns(
+        pl.when(pl.col("fallback")).then(pl.col("cdr_sequence")).otherwise(pl.col("paratope_sequence"))
+        .alias("paratope_sequence")
+    )
 
 
-def extract_paratope(cdr_seq, probs, cdr_start, cdr_end, threshold):
+def start_inference(args, threshold, weights_hash, metrics, pipeline_stats):
     """
-    Extract paratope from CDR region using X-masking: residues above the probability
-    threshold are kept, others are replaced with 'X'. This preserves positional alignment
-    so that MMseqs2 distances remain meaningful across clonotypes.
+    Use the warm inference server on args.server if one is listening there with the same
+    weights and backend; otherwise import torch and load Parapred in this process
+    (in-process inference adds its queue statistics to pipeline_stats).
+    Returns (function mapping a list of batches to (batch_num, batch_probs) pairs,
+    server client or None, backend description).
     """
-    if not cdr_seq or len(probs) == 0:
-        return ""
+    client = InferenceClient.connect(args.server)
+    if client is not None:
+        info = client.info
+        if info["weights_hash"] == weights_hash and info["requested_backend"] == args.backend:
+            print(f"Using Parapred inference server at {args.server} ({info['backend']} backend)")
+            return client.predict, client, info["backend"]
+        print(f"WARNING: inference server at {args.server} runs different weights or backend, "
+              f"running inference in-process")
+        client.close()
+
+    t0 = metrics.clock()
+    engine.import_runtime()
+    metrics.add("import", t0)
+
+    t0 = metrics.clock()
+    model, backend = engine.load_backend(
+        args.backend, threshold, args.backend_max_error, args.backend_min_agreement
+    )
+    metrics.add("load", t0)
+
+    def predict(batches):
+        return engine.predict_sequences(model, batches, args.workers, args.threads_per_worker, pipeline_stats)
 
-    paratope_residues = []
-    for i in range(cdr_start, min(cdr_end, len(probs))):
-        residue_idx = i - cdr_start
-        if residue_idx < len(cdr_seq):
-            if probs[i] >= threshold:
-                paratope_residues.append(cdr_seq[residue_idx])
-            else:
-                paratope_residues.append('X')
+    return predict, None, backend
 
-    return "".join(paratope_residues)
+
+def output_paths(threshold, is_primary):
+    """FASTA and paratope TSV names for a threshold; the primary one keeps the plain names."""
+    if is_primary:
+        return "output.fasta", "paratope-sequences.tsv"
+    return f"output-{threshold:g}.fasta", f"paratope-sequences-{threshold:g}.tsv"
 
 
 def main():
@@ -138,206 +416,399 @@ def main():
         description="Run Parapred pipeline for paratope extraction"
     )
     parser.add_argument(
-        "--threshold", type=float, default=0.5, help="Paratope probability threshold"
+        "--threshold",
+        type=float,
+        nargs="+",
+        default=[0.5],
+        help="Paratope probability threshold(s). The first one is written to output.fasta and "
+             "paratope-sequences.tsv, others to output-<threshold>.fasta and paratope-sequences-<threshold>.tsv",
     )
     parser.add_argument("--input", type=str, default="input.tsv", help="Input TSV file")
+    parser.add_argument(
+        "--cache-dir",
+        type=str,
+        default=os.environ.get("PARAPRED_CACHE_DIR"),
+        help="Directory of the persistent prediction cache shared across runs "
+             "(default: $PARAPRED_CACHE_DIR; no caching when unset). For command-line runs only: "
+             "block runs have no directory that outlives them and reuse inference through "
+             "--save-probabilities / --load-probabilities instead",
+    )
+    parser.add_argument(
+        "--cache-max-mb", type=int, default=4096, help="Prediction cache size cap in MiB (LRU eviction)"
+    )
+    parser.add_argument(
+        "--batch-residues",
+        type=int,
+        default=DEFAULT_BATCH_RESIDUES,
+        help="Padded residue budget per inference batch (rows x longest sequence)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of inference worker processes. Encoding and post-processing overlap "
+             "inference only with a single worker",
+    )
+    parser.add_argument(
+        "--threads-per-worker",
+        type=int,
+        default=None,
+        help="Torch intra-op threads per worker (default: available CPUs / workers)",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=100_000,
+        help="Input rows processed per chunk; bounds peak memory independently of input size",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=BACKENDS,
+        default="eager",
+        help="Inference backend: eager float32, dynamic int8 quantization, TorchScript, torch.compile or bf16 "
+             "autocast. Non-eager backends fall back to eager if they fail the accuracy gate",
+    )
+    parser.add_argument(
+        "--backend-max-error",
+        type=float,
+        default=DEFAULT_BACKEND_MAX_ERROR,
+        help="Accuracy gate: max per-residue probability difference from float32 on reference sequences",
+    )
+    parser.add_argument(
+        "--backend-min-agreement",
+        type=float,
+        default=DEFAULT_BACKEND_MIN_AGREEMENT,
+        help="Accuracy gate: min share of reference paratopes identical to float32",
+    )
+    parser.add_argument(
+        "--server",
+        type=str,
+        default=os.environ.get("PARAPRED_SERVER_SOCKET"),
+        help="Unix socket of a warm inference server (parapred_server.py); "
+             "inference runs in-process if none is listening (default: $PARAPRED_SERVER_SOCKET)",
+    )
+    parser.add_argument(
+        "--save-probabilities",
+        type=str,
+        default=None,
+        help="Write raw per-residue probabilities of all unique sequences to this .npz file",
+    )
+    parser.add_argument(
+        "--load-probabilities",
+        type=str,
+        default=None,
+        help="Reuse probabilities from a --save-probabilities file; only sequences missing there are predicted",
+    )
+    parser.add_argument(
+        "--predict-only",
+        action="store_true",
+        help="Only run inference (use with --save-probabilities); no paratope outputs are written",
+    )
+    parser.add_argument(
+        "--metrics",
+        type=str,
+        default=None,
+        help="Write per-stage wall/CPU time, peak RSS, throughput and fallback counts to this JSON file",
+    )
+    parser.add_argument(
+        "--profile",
+        type=str,
+        default=None,
+        help="Profile the run with cProfile and write the stats to this file (inspect with pstats or snakeviz)",
+    )
+    parser.add_argument(
+        "--fallback-report",
+        type=str,
+        default="fallbacks.tsv",
+        help="TSV of clonotypes that fell back to the full CDR sequence: threshold, clonotypeKey, reason",
+    )
     args = parser.parse_args()
 
-    threshold = args.threshold
-    t_total = time.time()
-
-    t0 = time.time()
-    df = pd.read_csv(args.input, sep="\t").fillna("")
-    print(f"[TIMING] Read input TSV ({len(df)} rows): {time.time() - t0:.2f}s")
+    thresholds = list(dict.fromkeys(args.threshold))
+    metrics = StepMetrics(
+        "parapred", ["read", "build", "dedup", "cache", "import", "load", "inference", "extract", "write"]
+    )
+    start_profiler(args.profile)
 
-    # Detect column naming: chain-indexed (CDR1_0, CDR1_1) or plain (CDR1, CDR2)
-    chain_sets = []
-    if "CDR1_0" in df.columns:
-        chain_idx = 0
-        while f"CDR1_{chain_idx}" in df.columns:
-            cdr_cols = [
-                f"CDR1_{chain_idx}",
-                f"CDR2_{chain_idx}",
-                f"CDR3_{chain_idx}",
-            ]
-            fr_cols = [
-                f"FR1_{chain_idx}",
-                f"FR2_{chain_idx}",
-                f"FR3_{chain_idx}",
-                f"FR4_{chain_idx}",
-            ]
-            chain_sets.append((cdr_cols, fr_cols))
-            chain_idx += 1
-    else:
-        chain_sets.append(
-            (["CDR1", "CDR2", "CDR3"], ["FR1", "FR2", "FR3", "FR4"])
-        )
+    columns = pl.read_csv(args.input, separator="\t", n_rows=0).columns
+    chain_sets = detect_chain_sets(columns)
+    entries_per_row = 3 * len(chain_sets)
     print(f"[TIMING] Detected {len(chain_sets)} chain(s)")
 
-    t0 = time.time()
-    model = load_model()
-    print(f"[TIMING] Load Parapred model: {time.time() - t0:.2f}s")
-
-    # Collect all flanked CDR sequences for batch prediction
-    t0 = time.time()
-    all_entries = []  # (flanked_seq, cdr_seq, cdr_start, cdr_end)
-    row_chain_cdr_map = {}  # (row_idx, chain_idx, cdr_idx) -> index in all_entries
-
-    for row_idx, row in df.iterrows():
-        for chain_idx, (cdr_cols, fr_cols) in enumerate(chain_sets):
-            flanked_cdrs = build_flanked_cdrs(row, cdr_cols, fr_cols)
-            for cdr_idx, (flanked, cdr_start, cdr_end) in enumerate(flanked_cdrs):
-                idx = len(all_entries)
-                row_chain_cdr_map[(row_idx, chain_idx, cdr_idx)] = idx
-                cdr_seq = _INVALID_AA_RE.sub("", str(row.get(cdr_cols[cdr_idx], "") or ""))
-                all_entries.append(
-                    {
-                        "flanked": flanked,
-                        "cdr_seq": cdr_seq,
-                        "cdr_start": cdr_start,
-                        "cdr_end": cdr_end,
-                    }
+    weights_hash = hash_file(WEIGHTS_PATH)
+    cache = None
+    if args.cache_dir:
+        # Non-eager backends produce slightly different values, so they get their own cache scope
+        model_hash = weights_hash
+        if args.backend != "eager":
+            model_hash += f":{args.backend}"
+        cache = PredictionCache(args.cache_dir, model_hash, args.cache_max_mb * 1024 * 1024)
+
+    if args.load_probabilities:
+        t0 = metrics.clock()
+        store = ProbabilityStore.load(args.load_probabilities)
+        print(f"[TIMING] Load saved probabilities ({len(store)} sequences): {metrics.add('load_probabilities', t0):.2f}s")
+    else:
+        store = ProbabilityStore()
+    num_loaded = len(store)
+    predict = client = None
+    pipeline_stats = engine.PipelineStats()
+    backend = args.backend
+    num_rows = num_entries = num_chunks = num_batches = 0
+    batch_totals = {"residues": 0, "padded_residues": 0, "fixed_padded_residues": 0}
+    bin_edges = np.linspace(0.0, 1.0, 11)  # 10 bins
+    hist_counts = np.zeros(len(bin_edges) - 1, dtype=np.int64)
+    # Per chain, CDR and relative position; fraction above the primary threshold
+    probability_profile = ProbabilityProfile(len(chain_sets), thresholds[0])
+
+    with contextlib.ExitStack() as stack:
+        outputs = []
+        if not args.predict_only:
+            fallback_report = stack.enter_context(open(args.fallback_report, "w"))
+            fallback_report.write("threshold\tclonotypeKey\treason\n")
+            for i, threshold in enumerate(thresholds):
+                fasta_path, tsv_path = output_paths(threshold, i == 0)
+                output = {
+                    "threshold": threshold,
+                    "fasta_path": fasta_path,
+                    "fasta": stack.enter_context(open(fasta_path, "w")),
+                    "tsv": stack.enter_context(open(tsv_path, "w")),
+                    "num_fasta": 0,
+                    "num_clonotypes": 0,
+                    # Paratopes already written to the FASTA, across chunks
+                    "seen": set(),
+                    "fallbacks": dict.fromkeys(_FALLBACK_REASONS.values(), 0),
+                }
+                output["tsv"].write("clonotypeKey\tparatope_sequence\tflanked_sequence\n")
+                outputs.append(output)
+
+        t0 = metrics.clock()
+        for df in read_chunks(args.input, args.chunk_size):
+            metrics.add("read", t0)
+            num_chunks += 1
+            num_rows += len(df)
+
+            # Collect all flanked CDR sequences for batch prediction
+            t0 = metrics.clock()
+            entries = build_flanked_cdrs(df, chain_sets)
+            num_entries += len(entries)
+            metrics.add("build", t0)
+
+            # Deduplicate flanked sequences, also against earlier chunks — predict only new ones
+            t0 = metrics.clock()
+            flanked_col = entries["flanked"]
+            chunk_seqs = flanked_col.filter(flanked_col != "").unique(maintain_order=True).to_list()
+            new_seqs = [seq for seq in chunk_seqs if seq not in store.index]
+            new_rows = store.add(new_seqs)
+            entries = entries.join(
+                pl.DataFrame({
+                    "flanked": pl.Series(chunk_seqs, dtype=pl.String),
+                    "uidx": pl.Series(store.rows(chunk_seqs), dtype=pl.Int64),
+                }),
+                on="flanked",
+                how="left",
+                maintain_order="left",
+            ).with_columns(pl.col("uidx").fill_null(-1))
+            metrics.add("dedup", t0)
+
+            # Reuse predictions from previous runs
+            if cache is not None and new_seqs:
+                t0 = metrics.clock()
+                cached = cache.get_many(new_seqs)
+                for row, seq in zip(new_rows, new_seqs):
+                    seq_probs = cached.get(seq)
+                    if seq_probs is not None:
+                        store.set(row, seq_probs)
+                metrics.add("cache", t0)
+
+            # Batch predict remaining new sequences, bucketed by length
+            t0 = metrics.clock()
+            pending = np.flatnonzero(store.lengths[new_rows] == 0)
+            seqs_to_predict = [new_seqs[i] for i in pending]
+            rows_to_predict = new_rows[pending]
+            batches, batch_stats = plan_batches(seqs_to_predict, max_residues=args.batch_residues)
+            for key in batch_totals:
+                batch_totals[key] += batch_stats[key]
+            num_batches += len(batches)
+
+            if batches and predict is None:
+                predict, client, backend = start_inference(
+                    args, thresholds[0], weights_hash, metrics, pipeline_stats
                 )
-    print(f"[TIMING] Build flanked CDRs ({len(all_entries)} entries): {time.time() - t0:.2f}s")
-
-    # Deduplicate flanked sequences — predict only unique ones
-    t0 = time.time()
-    flanked_seqs = [item["flanked"] for item in all_entries]
-    unique_seqs = list(dict.fromkeys(s for s in flanked_seqs if s))  # preserves order
-    unique_probs = {}  # seq -> probs array
-    print(f"[TIMING] Dedup flanked sequences: {len(flanked_seqs)} total -> "
-          f"{len(unique_seqs)} unique ({100 * (1 - len(unique_seqs) / max(len(flanked_seqs), 1)):.1f}% reduction): "
-          f"{time.time() - t0:.2f}s")
-
-    # Batch predict unique sequences in chunks
-    BATCH_SIZE = 512
-    num_batches = (len(unique_seqs) + BATCH_SIZE - 1) // BATCH_SIZE
-
-    t0 = time.time()
-    for batch_num, start in enumerate(range(0, len(unique_seqs), BATCH_SIZE)):
-        end = min(start + BATCH_SIZE, len(unique_seqs))
-        t_batch = time.time()
-        batch_probs = predict_batch(model, unique_seqs[start:end])
-        for i, probs in enumerate(batch_probs):
-            unique_probs[unique_seqs[start + i]] = probs
-        if (batch_num + 1) % 50 == 0 or batch_num == num_batches - 1:
-            print(f"[TIMING]   Parapred batch {batch_num + 1}/{num_batches}: "
-                  f"{time.time() - t_batch:.2f}s (cumulative: {time.time() - t0:.2f}s)")
-    print(f"[TIMING] Parapred inference total ({num_batches} batches of {BATCH_SIZE}): {time.time() - t0:.2f}s")
-
-    # Map results back to all entries
-    empty_probs = np.array([])
-    all_probs = [unique_probs.get(s, empty_probs) for s in flanked_seqs]
-
-    # Extract paratopes and build outputs
-    t0 = time.time()
-    fasta_lines = []
-    paratope_records = []
-    fallback_count = 0
-
-    for row_idx, row in df.iterrows():
-        clonotype_key = str(row["clonotypeKey"])
-        all_paratope_parts = []
-        all_cdr_parts = []
-        all_flanked_parts = []
-        had_prediction_failure = False
-
-        for chain_idx, (cdr_cols, _fr_cols) in enumerate(chain_sets):
-            for cdr_idx in range(3):
-                idx = row_chain_cdr_map[(row_idx, chain_idx, cdr_idx)]
-                entry = all_entries[idx]
-                probs = all_probs[idx]
-                cdr_seq = entry["cdr_seq"]
-
-                # Track if prediction was skipped (too long or no probs)
-                if cdr_seq and len(probs) == 0:
-                    had_prediction_failure = True
-
-                paratope = extract_paratope(
-                    cdr_seq,
-                    probs,
-                    entry["cdr_start"],
-                    entry["cdr_end"],
-                    threshold,
+
+            batch_seq_lists = [[seqs_to_predict[i] for i in batch] for batch in batches]
+            for batch_num, batch_probs in (predict(batch_seq_lists) if batches else ()):
+                for row, seq_probs in zip(rows_to_predict[batches[batch_num]], batch_probs):
+                    store.set(row, seq_probs)
+            metrics.add("inference", t0)
+
+            if cache is not None and batches:
+                t0 = metrics.clock()
+                cache.put_many({seq: store.get(row) for seq, row in zip(seqs_to_predict, rows_to_predict)})
+                metrics.add("cache", t0)
+
+            if args.predict_only:
+                print(f"[TIMING]   Chunk {num_chunks}: {len(df)} rows, {len(new_seqs)} new unique sequences, "
+                      f"{len(batches)} batches (cumulative: {metrics.elapsed():.2f}s)")
+                t0 = metrics.clock()
+                continue
+
+            # Extract paratopes for every threshold from the same predictions
+            t0 = metrics.clock()
+            cdr_probs, valid, predicted = gather_cdr_probabilities(entries, store.probs, store.lengths)
+            cdr_residues = cdr_residue_matrix(entries, cdr_probs.shape[1])
+            hist_counts += np.histogram(cdr_probs[valid], bins=bin_edges)[0]
+            probability_profile.update(
+                cdr_probs, valid, entries["cdr_end"].to_numpy() - entries["cdr_start"].to_numpy()
+            )
+            metrics.add("extract", t0)
+
+            for i, output in enumerate(outputs):
+                t0 = metrics.clock()
+                threshold = output["threshold"]
+                rows = build_paratope_rows(df, entries, cdr_residues, cdr_probs, valid, predicted, threshold)
+
+                fallbacks = rows.filter(pl.col("fallback")).select(
+                    pl.lit(threshold).alias("threshold"),
+                    "clonotypeKey",
+                    pl.col("had_prediction_failure").replace_strict(_FALLBACK_REASONS).alias("reason"),
                 )
-                all_paratope_parts.append(paratope)
-                all_cdr_parts.append(cdr_seq)
-                all_flanked_parts.append(entry["flanked"])
-
-        paratope_sequence = "".join(all_paratope_parts)
-        cdr_sequence = "".join(all_cdr_parts)
-        flanked_sequence = "".join(all_flanked_parts)
-
-        # Fall back to full CDR sequence when paratope is empty or all-X (no informative residues)
-        is_all_masked = paratope_sequence and all(c == 'X' for c in paratope_sequence)
-        if (not paratope_sequence or is_all_masked) and cdr_sequence:
-            paratope_sequence = cdr_sequence
-            fallback_count += 1
-            if had_prediction_failure:
-                print(f"WARNING: {clonotype_key}: CDR too long for Parapred, "
-                      f"falling back to full CDR sequence for clustering")
-            else:
-                print(f"WARNING: {clonotype_key}: no paratope residues above threshold "
-                      f"({threshold}), falling back to full CDR sequence for clustering")
-
-        if paratope_sequence:
-            fasta_lines.append(f">s-{clonotype_key}")
-            fasta_lines.append(paratope_sequence)
-
-        paratope_records.append(
-            {
-                "clonotypeKey": clonotype_key,
-                "paratope_sequence": paratope_sequence,
-                "flanked_sequence": flanked_sequence,
-            }
-        )
-    print(f"[TIMING] Extract paratopes & build outputs: {time.time() - t0:.2f}s")
-
-    # Collect CDR-region probabilities and write histogram
-    t0 = time.time()
-    cdr_probs = []
-    for entry, probs in zip(all_entries, all_probs):
-        if len(probs) > 0 and entry["cdr_seq"]:
-            cdr_start = entry["cdr_start"]
-            cdr_end = min(entry["cdr_end"], len(probs))
-            for i in range(cdr_start, cdr_end):
-                residue_idx = i - cdr_start
-                if residue_idx < len(entry["cdr_seq"]):
-                    cdr_probs.append(probs[i])
-
-    if cdr_probs:
-        cdr_probs_arr = np.array(cdr_probs)
-        bin_edges = np.linspace(0.0, 1.0, 11)  # 10 bins
-        counts, _ = np.histogram(cdr_probs_arr, bins=bin_edges)
-        with open("probability-distribution.tsv", "w") as f:
-            f.write("probabilityBin\tresidueCount\n")
-            for i in range(len(counts)):
-                label = f"{int(bin_edges[i] * 100)}-{int(bin_edges[i + 1] * 100)}%"
-                f.write(f"{label}\t{counts[i]}\n")
-    else:
+                for reason, count in fallbacks.group_by("reason").len().iter_rows():
+                    output["fallbacks"][reason] += count
+                fallbacks.write_csv(fallback_report, separator="\t", include_header=False)
+
+                # One record per distinct paratope: identical sequences would only be
+                # aligned to each other, process_results.py expands them back
+                paratope_rows = rows.filter(pl.col("paratope_sequence") != "")
+                seen = output["seen"]
+                fasta_records = []
+                for clonotype_key, paratope in paratope_rows.select(
+                    "clonotypeKey", "paratope_sequence"
+                ).unique(subset=["paratope_sequence"], keep="first", maintain_order=True).iter_rows():
+                    if paratope not in seen:
+                        seen.add(paratope)
+                        fasta_records.append(f">s-{clonotype_key}\n{paratope}")
+                output["num_fasta"] += len(fasta_records)
+                output["num_clonotypes"] += len(paratope_rows)
+                metrics.add("extract", t0)
+
+                # Append chunk to FASTA and paratope sequences TSV
+                t0 = metrics.clock()
+                if len(fasta_records):
+                    output["fasta"].write("\n".join(fasta_records) + "\n")
+                rows.select(
+                    "clonotypeKey",
+                    # Empty values are written as empty fields rather than quoted ""
+                    *(pl.when(pl.col(c) != "").then(pl.col(c)).alias(c)
+                      for c in ["paratope_sequence", "flanked_sequence"]),
+                ).write_csv(output["tsv"], separator="\t", include_header=False)
+                metrics.add("write", t0)
+
+            print(f"[TIMING]   Chunk {num_chunks}: {len(df)} rows, {len(new_seqs)} new unique sequences, "
+                  f"{len(batches)} batches (cumulative: {metrics.elapsed():.2f}s)")
+            t0 = metrics.clock()
+
+    if client is not None:
+        client.close()
+
+    if cache is not None:
+        t0 = metrics.clock()
+        evicted = cache.close()
+        metrics.add("cache", t0)
+        print(f"[TIMING] Prediction cache: {cache.hits} hits, {cache.misses} misses "
+              f"({100 * cache.hits / max(cache.hits + cache.misses, 1):.1f}% hit rate), "
+              f"{evicted} evicted: {metrics.wall['cache']:.2f}s")
+
+    if args.save_probabilities:
+        t0 = metrics.clock()
+        store.save(args.save_probabilities)
+        print(f"[TIMING] Save probabilities ({len(store)} sequences): {metrics.add('save_probabilities', t0):.2f}s")
+
+    # Write probability distribution
+    if not args.predict_only:
+        t0 = metrics.clock()
         with open("probability-distribution.tsv", "w") as f:
             f.write("probabilityBin\tresidueCount\n")
-    print(f"[TIMING] Write probability distribution ({len(cdr_probs)} values): {time.time() - t0:.2f}s")
-
-    # Write FASTA output
-    t0 = time.time()
-    with open("output.fasta", "w") as f:
-        f.write("\n".join(fasta_lines) + "\n" if fasta_lines else "")
-    print(f"[TIMING] Write FASTA ({len(fasta_lines) // 2} sequences): {time.time() - t0:.2f}s")
-
-    # Write paratope sequences TSV
-    t0 = time.time()
-    pd.DataFrame(paratope_records).to_csv(
-        "paratope-sequences.tsv", sep="\t", index=False
-    )
-    print(f"[TIMING] Write paratope-sequences TSV: {time.time() - t0:.2f}s")
-
-    print(f"Processed {len(df)} clonotypes")
-    print(f"Generated FASTA with {len(fasta_lines) // 2} sequences")
-    print(f"Paratope threshold: {threshold}")
-    if fallback_count > 0:
-        print(f"WARNING: {fallback_count} clonotype(s) used full CDR sequence fallback")
-    print(f"[TIMING] Total pipeline: {time.time() - t_total:.2f}s")
+            if hist_counts.sum() > 0:
+                for i in range(len(hist_counts)):
+                    label = f"{int(bin_edges[i] * 100)}-{int(bin_edges[i + 1] * 100)}%"
+                    f.write(f"{label}\t{hist_counts[i]}\n")
+        probability_profile.write("probability-profile.tsv", "probability-histogram.tsv")
+        metrics.add("write", t0)
+
+    residues = batch_totals["residues"]
+    padded = batch_totals["padded_residues"]
+    fixed_padded = batch_totals["fixed_padded_residues"]
+    workers = max(1, min(args.workers, num_batches))
+    # Model import and loading happen inside the first inference call
+    metrics.subtract("inference", "import", "load")
+    print(f"[TIMING] Read input TSV ({num_rows} rows in {num_chunks} chunk(s)): {metrics.wall['read']:.2f}s")
+    print(f"[TIMING] Build flanked CDRs ({num_entries} entries): {metrics.wall['build']:.2f}s")
+    num_unique = len(store) - num_loaded
+    print(f"[TIMING] Dedup flanked sequences: {num_entries} total -> "
+          f"{num_unique} unique{' not in saved probabilities' if num_loaded else ''} "
+          f"({100 * (1 - num_unique / max(num_entries, 1)):.1f}% reduction): {metrics.wall['dedup']:.2f}s")
+    print(f"[TIMING] Batches (budget {args.batch_residues} residues): "
+          f"padding {100 * (padded - residues) / max(padded, 1):.1f}% of {padded} tensor residues "
+          f"vs {100 * (fixed_padded - residues) / max(fixed_padded, 1):.1f}% with fixed {MAX_LENGTH}-residue "
+          f"padding ({fixed_padded - padded} residues saved)")
+    print(f"[TIMING] Import torch/parapred: {metrics.wall['import']:.2f}s")
+    print(f"[TIMING] Load Parapred model ({backend} backend): {metrics.wall['load']:.2f}s")
+    print(f"[TIMING] Parapred inference total ({num_batches} batches, {workers} worker(s), {backend}): "
+          f"{metrics.wall['inference']:.2f}s")
+    if pipeline_stats.batches:
+        summary = pipeline_stats.summary()
+        print(f"[TIMING] Inference pipeline: mean {summary['mean_encoded_queue_depth']} of {engine.PIPELINE_DEPTH} "
+              f"encoded batches queued, model waited {summary['model_wait_seconds']:.2f}s for encoding, "
+              f"encoder stalled {summary['encoder_stall_seconds']:.2f}s, "
+              f"post-processing stalled the model {summary['postprocess_stall_seconds']:.2f}s")
+    print(f"[TIMING] Extract paratopes & build outputs ({int(hist_counts.sum())} CDR residues): "
+          f"{metrics.wall['extract']:.2f}s")
+    print(f"[TIMING] Write outputs: {metrics.wall['write']:.2f}s")
+
+    print(f"Processed {num_rows} clonotypes")
+    for output in outputs:
+        print(f"Paratope threshold: {output['threshold']}")
+        print(f"Generated {output['fasta_path']} with {output['num_fasta']} unique sequences "
+              f"for {output['num_clonotypes']} clonotypes")
+        num_fallbacks = sum(output["fallbacks"].values())
+        if num_fallbacks > 0:
+            print(f"WARNING: {num_fallbacks} clonotype(s) used full CDR sequence fallback "
+                  f"({output['fallbacks']['cdr_too_long']} with CDRs too long for Parapred, "
+                  f"{output['fallbacks']['no_residues_above_threshold']} without paratope residues "
+                  f"above threshold), see {args.fallback_report}")
+    print(f"[TIMING] Total pipeline: {metrics.elapsed():.2f}s")
+
+    if args.metrics:
+        metrics.set(
+            backend=backend,
+            workers=workers,
+            num_rows=num_rows,
+            num_chunks=num_chunks,
+            num_entries=num_entries,
+            num_unique_sequences=num_unique,
+            num_loaded_sequences=num_loaded,
+            dedup_ratio=round(num_unique / max(num_entries, 1), 4),
+            num_batches=num_batches,
+            inference_pipeline=pipeline_stats.summary() if pipeline_stats.batches else None,
+            padding_ratio=round((padded - residues) / max(padded, 1), 4),
+            fixed_padding_ratio=round((fixed_padded - residues) / max(fixed_padded, 1), 4),
+            sequences_per_second=(
+                round(num_unique / metrics.wall["inference"], 1) if metrics.wall["inference"] > 0 else None
+            ),
+            clonotypes_per_second=round(num_rows / max(metrics.elapsed(), 1e-9), 1),
+            cache=None if cache is None else {"hits": cache.hits, "misses": cache.misses, "evicted": evicted},
+            thresholds=[
+                {
+                    "threshold": output["threshold"],
+                    "num_fasta_sequences": output["num_fasta"],
+                    "num_clonotypes": output["num_clonotypes"],
+                    "fallbacks": output["fallbacks"],
+                }
+                for output in outputs
+            ],
+        )
+        metrics.write(args.metrics)
 
 
 if __name__ == "__main__":
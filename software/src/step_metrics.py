@@ -0,0 +1,91 @@
+"""
+Machine-readable metrics of a software step.
+
+Stages accumulate wall and CPU time; the JSON written by StepMetrics.write()
+adds peak RSS (of the step and of its worker processes) and whatever values the
+step records with set(). The [TIMING] log lines are kept for humans; this file
+is for tracking runs over time.
+"""
+
+import atexit
+import cProfile
+import json
+import resource
+import sys
+import time
+
+
+def _rss_mb(who):
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    return round(resource.getrusage(who).ru_maxrss * scale / 2**20, 1)
+
+
+class StepMetrics:
+    """Per-stage wall/CPU time and step values, written as one JSON document."""
+
+    def __init__(self, step, stages=()):
+        self.step = step
+        # Stages listed up front are reported (as zero) even when they never run
+        self.wall = dict.fromkeys(stages, 0.0)
+        self.cpu = dict.fromkeys(stages, 0.0)
+        self.values = {}
+        self._start = self.clock()
+
+    @staticmethod
+    def clock():
+        """Current (wall, CPU) time; pass it to add() when the stage ends."""
+        return time.perf_counter(), time.process_time()
+
+    def add(self, stage, start):
+        """Add the time since start (a clock() value) to stage; returns the wall seconds."""
+        wall, cpu = self.clock()
+        self.wall[stage] = self.wall.get(stage, 0.0) + wall - start[0]
+        self.cpu[stage] = self.cpu.get(stage, 0.0) + cpu - start[1]
+        return wall - start[0]
+
+    def subtract(self, stage, *nested):
+        """Remove the time of stages measured inside stage from it."""
+        for other in nested:
+            self.wall[stage] = self.wall.get(stage, 0.0) - self.wall.get(other, 0.0)
+            self.cpu[stage] = self.cpu.get(stage, 0.0) - self.cpu.get(other, 0.0)
+
+    def set(self, **values):
+        self.values.update(values)
+
+    def elapsed(self):
+        """Wall seconds since the step started."""
+        return self.clock()[0] - self._start[0]
+
+    def write(self, path):
+        wall, cpu = self.clock()
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        report = {
+            "step": self.step,
+            "wall_seconds": round(wall - self._start[0], 4),
+            "cpu_seconds": round(cpu - self._start[1], 4),
+            "children_cpu_seconds": round(children.ru_utime + children.ru_stime, 4),
+            "peak_rss_mb": _rss_mb(resource.RUSAGE_SELF),
+            "children_peak_rss_mb": _rss_mb(resource.RUSAGE_CHILDREN),
+            "stages": {
+                stage: {"wall_seconds": round(self.wall[stage], 4), "cpu_seconds": round(self.cpu[stage], 4)}
+                for stage in self.wall
+            },
+            **self.values,
+        }
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+def start_profiler(path):
+    """Profile the rest of the process with cProfile when path is set; stats are written to path at exit."""
+    if not path:
+        return
+    profiler = cProfile.Profile()
+
+    def dump():
+        profiler.disable()
+        profiler.dump_stats(path)
+
+    atexit.register(dump)
+    profiler.enable()
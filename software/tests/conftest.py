@@ -0,0 +1,28 @@
+import os
+import subprocess
+import sys
+
+import polars as pl
+import pytest
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+sys.path.insert(0, SRC)
+
+
+@pytest.fixture
+def process_results():
+    """
+    Runs process_results.py in a directory with the given clusters (representative,
+    member pairs of FASTA ids), clone table and paratope sequences rows (dicts), and
+    returns a function reading an output table of that run.
+    """
+    def run(directory, clusters, clone_table, paratopes, *args):
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, "clusters.tsv"), "w") as f:
+            f.writelines(f"{representative}\t{member}\n" for representative, member in clusters)
+        pl.DataFrame(clone_table).write_csv(os.path.join(directory, "cloneTable.tsv"), separator="\t")
+        pl.DataFrame(paratopes).write_csv(os.path.join(directory, "paratopeSequences.tsv"), separator="\t")
+        subprocess.run([sys.executable, os.path.join(SRC, "process_results.py"), *args],
+                       cwd=directory, check=True, capture_output=True)
+        return lambda name: pl.read_csv(os.path.join(directory, name), separator="\t", infer_schema_length=0)
+    return run
@@ -0,0 +1,73 @@
+"""
+centroid_distance.py against the per-row computation it replaced in
+process_results: polars-ds Levenshtein distance divided by the centroid length,
+clipped at 1.0; an empty centroid gives 0.0 for an empty member and 1.0 otherwise.
+"""
+
+import numpy as np
+import polars as pl
+import polars_ds as pds
+
+from centroid_distance import capped_levenshtein, centroid_distances
+
+ALPHABET = list("ACDEFGHIKLMNPQRSTVWYX")
+
+
+def reference(members, centroids):
+    """Distance to centroid as computed row by row before pair deduplication."""
+    distance = pds.str_leven("member", "centroid").cast(pl.Float64)
+    return pl.DataFrame({"member": members, "centroid": centroids}).select(
+        pl.when(pl.col("centroid").str.len_chars() > 0)
+        .then(pl.min_horizontal(1.0, distance / pl.col("centroid").str.len_chars().cast(pl.Float64)))
+        .when(distance == 0)
+        .then(0.0)
+        .otherwise(1.0)
+    ).to_series().to_numpy()
+
+
+def mutate(rng, sequence, edits):
+    sequence = list(sequence)
+    for _ in range(edits):
+        operation = rng.integers(3)
+        position = int(rng.integers(len(sequence) + 1))
+        if operation == 0 and position < len(sequence):
+            sequence[position] = rng.choice(ALPHABET)
+        elif operation == 1 and position < len(sequence):
+            del sequence[position]
+        else:
+            sequence.insert(position, rng.choice(ALPHABET))
+    return "".join(sequence)
+
+
+def random_pairs(seed, count, max_length):
+    rng = np.random.default_rng(seed)
+    members, centroids = [], []
+    for _ in range(count):
+        centroid = "".join(rng.choice(ALPHABET, int(rng.integers(1, max_length))))
+        # Near members go through the bounded kernel, unrelated ones mostly hit the cap
+        if rng.random() < 0.7:
+            member = mutate(rng, centroid, int(rng.integers(0, 8)))
+        else:
+            member = "".join(rng.choice(ALPHABET, int(rng.integers(0, max_length))))
+        members.append(member)
+        centroids.append(centroid)
+    return members, centroids
+
+
+def test_matches_reference_on_random_pairs():
+    # Lengths above 64 need more than one 64-bit word per centroid
+    members, centroids = random_pairs(seed=1, count=3000, max_length=150)
+    np.testing.assert_array_equal(centroid_distances(members, centroids), reference(members, centroids))
+
+
+def test_matches_reference_on_edge_cases():
+    members = ["", "ACD", "", "ACD", "A", "ACDE", "ACDEFGH", "ACDE", "XXXX", "ACDÉ", "A" * 130, "C" * 70]
+    centroids = ["", "", "ACD", "ACD", "ACDEFGHIK", "ACD", "ACDEFGW", "DCAE", "ACDE", "ACDE", "A" * 129, "C" * 65 + "A" * 5]
+    np.testing.assert_array_equal(centroid_distances(members, centroids), reference(members, centroids))
+
+
+def test_capped_levenshtein_stops_at_cap():
+    members, centroids = random_pairs(seed=2, count=500, max_length=100)
+    exact = pl.DataFrame({"a": members, "b": centroids}).select(pds.str_leven("a", "b")).to_series().to_numpy()
+    for cap in (np.full(len(members), 3), np.array([len(c) for c in centroids])):
+        np.testing.assert_array_equal(capped_levenshtein(members, centroids, cap), np.minimum(exact, cap))
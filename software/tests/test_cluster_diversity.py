@@ -0,0 +1,82 @@
+"""
+cluster_diversity on hand-computed clusters, and its pair sampling above the budget.
+"""
+
+import numpy as np
+import polars as pl
+import pytest
+
+import cluster_diversity as diversity
+from cluster_diversity import cluster_diversity
+
+# c1 member pairs: (AAAA, AAAA) 0, 2x (AAAA, AAAT) 1/4, 2x (AAAA, TTTT) 1, (AAAT, TTTT) 3/4
+# c2: one pair at 1/3 (distance over the longer paratope); c3: a single member
+MEMBERS = pl.DataFrame({
+    "clusterId": ["c1", "c1", "c1", "c1", "c2", "c2", "c3"],
+    "paratope_sequence": ["AAAA", "TTTT", "AAAT", "AAAA", "ABC", "AB", "QQ"],
+})
+
+
+def by_cluster(frame):
+    return {row["clusterId"]: row for row in frame.iter_rows(named=True)}
+
+
+def test_hand_computed_clusters():
+    result = by_cluster(cluster_diversity(MEMBERS))
+
+    c1 = result["c1"]
+    assert c1["meanPairwiseDistance"] == pytest.approx(3.25 / 6)
+    # Weighted: the first distance reaching half (90%) of the 6 pairs
+    assert c1["medianPairwiseDistance"] == 0.25
+    assert c1["p90PairwiseDistance"] == 1.0
+    assert (c1["mostCommonParatope"], c1["mostCommonParatopeFraction"]) == ("AAAA", 0.5)
+
+    c2 = result["c2"]
+    assert c2["meanPairwiseDistance"] == c2["medianPairwiseDistance"] == c2["p90PairwiseDistance"] == \
+        pytest.approx(1 / 3)
+    # Ties go to the alphabetically first paratope
+    assert (c2["mostCommonParatope"], c2["mostCommonParatopeFraction"]) == ("AB", 0.5)
+
+    c3 = result["c3"]
+    assert c3["meanPairwiseDistance"] == c3["medianPairwiseDistance"] == c3["p90PairwiseDistance"] == 0.0
+    assert (c3["mostCommonParatope"], c3["mostCommonParatopeFraction"]) == ("QQ", 1.0)
+
+    assert not any(row["pairsSampled"] for row in result.values())
+
+
+def test_only_clusters_over_the_budget_are_sampled():
+    # c1 has 3 distinct paratope pairs, c2 one
+    result = by_cluster(cluster_diversity(MEMBERS, pair_budget=2))
+    assert result["c1"]["pairsSampled"] and not result["c2"]["pairsSampled"]
+    assert result["c1"]["medianPairwiseDistance"] in (0.0, 0.25, 0.75, 1.0)
+    assert result["c2"]["meanPairwiseDistance"] == pytest.approx(1 / 3)
+    assert result["c1"]["mostCommonParatope"] == "AAAA"
+
+    # Fixed seed: the same estimate every run
+    assert cluster_diversity(MEMBERS, pair_budget=2).equals(cluster_diversity(MEMBERS, pair_budget=2))
+
+
+def test_sampled_estimate_aligns_at_most_the_budget(monkeypatch):
+    rng = np.random.default_rng(1)
+    paratopes = ["".join(rng.choice(list("ACDY"), 8)) for _ in range(300)]
+    members = pl.DataFrame({"clusterId": ["big"] * 300 + ["c3"], "paratope_sequence": paratopes + ["QQ"]})
+    num_distinct = len(set(paratopes))
+    exact = by_cluster(cluster_diversity(members, pair_budget=num_distinct ** 2))["big"]
+    assert not exact["pairsSampled"]
+
+    aligned = []
+    normalized_distances = diversity._normalized_distances
+
+    def counting(paratopes, i, j):
+        aligned.append(len(i))
+        return normalized_distances(paratopes, i, j)
+
+    monkeypatch.setattr(diversity, "_normalized_distances", counting)
+    sampled = by_cluster(cluster_diversity(members, pair_budget=2000))
+    assert sampled["big"]["pairsSampled"]
+    assert sum(aligned) <= 2000
+    assert sampled["big"]["meanPairwiseDistance"] == pytest.approx(exact["meanPairwiseDistance"], abs=0.02)
+    # Distances are multiples of 1/8: the sampled quantiles land on the exact ones
+    assert sampled["big"]["medianPairwiseDistance"] == exact["medianPairwiseDistance"]
+    assert sampled["big"]["p90PairwiseDistance"] == exact["p90PairwiseDistance"]
+    assert sampled["c3"]["meanPairwiseDistance"] == 0.0
@@ -0,0 +1,74 @@
+"""
+fast_cluster.py against MMseqs2 easy-cluster on a fixture of well separated
+groups: equal-length sequences within 1-2 substitutions of a group centre, and
+unrelated sequences between groups. Both have to find exactly the groups.
+"""
+
+import os
+import shutil
+import subprocess
+
+import numpy as np
+import pytest
+
+from fast_cluster import greedy_set_cover, similar_pairs
+from fasta import read_fasta
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "data", "fast_cluster.fasta")
+IDENTITY = 0.8
+COVERAGE = 0.9
+COVERAGE_MODE = 0
+
+
+def partition(pairs):
+    """Clusters as a set of frozensets of member names, from (representative, member) pairs."""
+    clusters = {}
+    for representative, member in pairs:
+        clusters.setdefault(representative, set()).add(member)
+    return {frozenset(members) for members in clusters.values()}
+
+
+def fixture_groups():
+    # Record names are g<group>m<member>
+    return partition((name[:3], name) for name in read_fasta(FIXTURE))
+
+
+def fast_cluster_partition():
+    records = read_fasta(FIXTURE)
+    names, sequences = list(records), list(records.values())
+    sources, targets = similar_pairs(sequences, IDENTITY, COVERAGE, COVERAGE_MODE)
+    representative = greedy_set_cover(len(names), sources, targets, [len(seq) for seq in sequences])
+    return partition((names[rep], name) for rep, name in zip(representative, names)), representative, names
+
+
+def test_fast_cluster_finds_fixture_groups():
+    clusters, representative, names = fast_cluster_partition()
+    assert clusters == fixture_groups()
+    # Every representative is a member of its own cluster
+    assert all(representative[rep] == rep for rep in np.unique(representative))
+
+
+@pytest.mark.skipif(shutil.which("mmseqs") is None, reason="MMseqs2 is not installed")
+def test_fast_cluster_matches_mmseqs(tmp_path):
+    subprocess.run(
+        ["mmseqs", "easy-cluster", FIXTURE, str(tmp_path / "result"), str(tmp_path / "tmp"),
+         "--min-seq-id", str(IDENTITY), "-c", str(COVERAGE), "--cov-mode", str(COVERAGE_MODE),
+         "--similarity-type", "2", "--threads", "1"],
+        check=True, capture_output=True,
+    )
+    with open(tmp_path / "result_cluster.tsv") as f:
+        mmseqs_clusters = partition(line.rstrip("\n").split("\t") for line in f if line.strip())
+
+    clusters, _, _ = fast_cluster_partition()
+    assert clusters == mmseqs_clusters
+
+
+def test_masked_residues_never_match():
+    # Identical but for one residue; 8 of their 11 positions are masked
+    masked = ["ACXXXXXXXXD", "ACXXXXXXXXE"]
+    sources, _ = similar_pairs(masked, IDENTITY, COVERAGE, COVERAGE_MODE)
+    assert len(sources) == 0
+
+    unmasked = [seq.replace("X", "G") for seq in masked]
+    sources, targets = similar_pairs(unmasked, IDENTITY, COVERAGE, COVERAGE_MODE)
+    assert sorted(zip(sources.tolist(), targets.tolist())) == [(0, 1), (1, 0)]
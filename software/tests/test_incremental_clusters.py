@@ -0,0 +1,118 @@
+"""
+incremental_clusters.py prepare: previous clusters are matched to the current
+FASTA by paratope sequence, since record names follow the first clonotype that
+has a paratope and change between runs; with the paratope sequences table,
+records keep their previous names, so clusters keep their ids.
+"""
+
+import argparse
+
+import polars as pl
+
+from fasta import read_fasta, write_fasta
+from incremental_clusters import merge, prepare, read_clusters
+
+PREVIOUS = {"s-a": "AAAAYY", "s-b": "AAAAYW", "s-c": "CCCCDD", "s-d": "CCCCDE", "s-e": "GGGGHH"}
+PREVIOUS_CLUSTERS = [("s-a", "s-a"), ("s-a", "s-b"), ("s-c", "s-c"), ("s-c", "s-d"), ("s-e", "s-e")]
+
+
+def run_prepare(tmp_path, current, paratopes=None, previous=PREVIOUS, previous_clusters=PREVIOUS_CLUSTERS):
+    write_fasta(tmp_path / "previous.fasta", previous.items())
+    with open(tmp_path / "previous_cluster.tsv", "w") as f:
+        f.writelines(f"{representative}\t{member}\n" for representative, member in previous_clusters)
+    write_fasta(tmp_path / "input.fasta", current.items())
+    if paratopes is not None:
+        pl.DataFrame(
+            {"clonotypeKey": list(paratopes), "paratope_sequence": list(paratopes.values())}
+        ).write_csv(tmp_path / "paratopes.tsv", separator="\t")
+    args = argparse.Namespace(
+        fasta=tmp_path / "input.fasta",
+        previous_fasta=tmp_path / "previous.fasta",
+        previous_clusters=tmp_path / "previous_cluster.tsv",
+        paratopes=None if paratopes is None else tmp_path / "paratopes.tsv",
+        stable_fasta=tmp_path / "stable.fasta",
+        kept=tmp_path / "kept_clusters.tsv",
+        representatives=tmp_path / "representatives.fasta",
+        new=tmp_path / "new.fasta",
+        mode=tmp_path / "mode.txt",
+    )
+    prepare(args)
+    kept = sorted(read_clusters(args.kept).iter_rows())
+    return kept, read_fasta(args.representatives), read_fasta(args.new), args.mode.read_text()
+
+
+def test_prepare_matches_renamed_records_by_sequence(tmp_path):
+    # Same paratopes, first seen in other clonotypes this time
+    current = {"s-x": "CCCCDE", "s-y": "AAAAYY", "s-z": "AAAAYW", "s-w": "CCCCDD", "s-v": "GGGGHH"}
+    kept, representatives, new, mode = run_prepare(tmp_path, current)
+
+    assert kept == sorted([("s-y", "s-y"), ("s-y", "s-z"), ("s-w", "s-w"), ("s-w", "s-x"), ("s-v", "s-v")])
+    assert representatives == {"s-y": "AAAAYY", "s-w": "CCCCDD", "s-v": "GGGGHH"}
+    assert new == {}
+    assert mode == "unchanged"
+
+
+def test_prepare_reclusters_changed_paratopes(tmp_path):
+    # s-a keeps its name but not its paratope; s-c's paratope moved to s-q
+    current = {"s-a": "AAAAYF", "s-b": "AAAAYW", "s-q": "CCCCDD", "s-d": "CCCCDE", "s-n": "KKKKLL"}
+    kept, representatives, new, mode = run_prepare(tmp_path, current)
+
+    assert kept == sorted([("s-q", "s-q"), ("s-q", "s-d")])
+    assert representatives == {"s-q": "CCCCDD"}
+    assert new == {"s-a": "AAAAYF", "s-b": "AAAAYW", "s-n": "KKKKLL"}
+    assert mode == "incremental"
+
+
+def test_prepare_keeps_previous_names_of_clonotypes_with_the_same_paratope(tmp_path):
+    # New clonotypes k0 and k9 come first: the current FASTA names AAAAYY after k0
+    # and CCCCDD after k9, but k1 and k3 still have these paratopes
+    paratopes = {"k0": "AAAAYY", "k1": "AAAAYY", "k2": "AAAAYW", "k9": "CCCCDD", "k3": "CCCCDD", "k4": "CCCCDE"}
+    current = {"s-k0": "AAAAYY", "s-k2": "AAAAYW", "s-k9": "CCCCDD", "s-k4": "CCCCDE"}
+    previous = {"s-k1": "AAAAYY", "s-k2": "AAAAYW", "s-k3": "CCCCDD", "s-k4": "CCCCDE"}
+    previous_clusters = [("s-k1", "s-k1"), ("s-k1", "s-k2"), ("s-k3", "s-k3"), ("s-k3", "s-k4")]
+    kept, representatives, new, mode = run_prepare(tmp_path, current, paratopes, previous, previous_clusters)
+
+    assert kept == sorted(previous_clusters)
+    assert representatives == {"s-k1": "AAAAYY", "s-k3": "CCCCDD"}
+    assert read_fasta(tmp_path / "stable.fasta") == {"s-k1": "AAAAYY", "s-k2": "AAAAYW", "s-k3": "CCCCDD", "s-k4": "CCCCDE"}
+    assert mode == "unchanged"
+
+    # k3 changed its paratope: the record keeps the name of the first clonotype
+    paratopes["k3"] = "CCCCDF"
+    kept, representatives, new, mode = run_prepare(tmp_path, current, paratopes, previous, previous_clusters)
+    assert kept == sorted([("s-k1", "s-k1"), ("s-k1", "s-k2"), ("s-k9", "s-k9"), ("s-k9", "s-k4")])
+
+
+def test_second_run_with_extra_clonotypes_keeps_cluster_ids(tmp_path, process_results):
+    def tables(clonotypes):
+        clone_table = [{"sampleId": "S1", "clonotypeKey": key, "abundance": 10, "sequence_0": paratope,
+                        "clonotypeKeyLabel": f"C-{key}"} for key, paratope in clonotypes.items()]
+        paratopes = [{"clonotypeKey": key, "paratope_sequence": paratope} for key, paratope in clonotypes.items()]
+        return clone_table, paratopes
+
+    def cluster_ids(read_table):
+        return dict(read_table("clone-to-cluster.tsv").select("clonotypeKey", "clusterId").iter_rows())
+
+    first = {"k1": "AAAAYY", "k2": "AAAAYW", "k3": "CCCCDD", "k4": "CCCCDE"}
+    first_clusters = [("s-k1", "s-k1"), ("s-k1", "s-k2"), ("s-k3", "s-k3"), ("s-k3", "s-k4")]
+    first_ids = cluster_ids(process_results(tmp_path / "first", first_clusters, *tables(first)))
+
+    # Second run: k0 shares k1's paratope and is listed first; k9 has a new paratope
+    second = {"k0": "AAAAYY", **first, "k9": "GGGGHH"}
+    current = {"s-k0": "AAAAYY", "s-k2": "AAAAYW", "s-k3": "CCCCDD", "s-k4": "CCCCDE", "s-k9": "GGGGHH"}
+    previous = {f"s-{key}": paratope for key, paratope in first.items()}
+    kept, representatives, new, mode = run_prepare(tmp_path, current, second, previous, first_clusters)
+    assert new == {"s-k9": "GGGGHH"}
+    assert mode == "incremental"
+
+    # The new paratope forms its own cluster (no search hit)
+    with open(tmp_path / "new_cluster.tsv", "w") as f:
+        f.write("s-k9\ts-k9\n")
+    merge(argparse.Namespace(kept=tmp_path / "kept_clusters.tsv", new_clusters=tmp_path / "new_cluster.tsv",
+                             hits=None, output=tmp_path / "result_cluster.tsv"))
+    second_clusters = read_clusters(tmp_path / "result_cluster.tsv").iter_rows()
+    second_ids = cluster_ids(process_results(tmp_path / "second", second_clusters, *tables(second)))
+
+    assert {key: second_ids[key] for key in first} == first_ids
+    assert second_ids["k0"] == first_ids["k1"]
+    assert second_ids["k9"] == "k9"
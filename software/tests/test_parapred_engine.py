@@ -0,0 +1,69 @@
+"""
+LookupEncoder against parapred's encode_batch and generate_mask, which it
+replaces in encode_sequences().
+"""
+
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("parapred")
+
+import torch
+
+import parapred_engine as engine
+
+# Sorted by length, longest first, as encode_sequences() passes them
+MIXED_LENGTHS = ["CARDYYGSSYWYFDVW", "GFTFSSYAMSW", "SISSSSSYIYY", "QQYNSYPLT", "WVRQAPG", "AR", "Y"]
+
+
+@pytest.fixture(scope="module")
+def encoder():
+    engine.import_runtime()
+    return engine.LookupEncoder()
+
+
+def reference(sequences, max_length):
+    encoded, lengths = engine.encode_batch(sequences, max_length=max_length)
+    return encoded, lengths, engine.generate_mask(encoded, lengths)
+
+
+@pytest.mark.parametrize("max_length", [len(MIXED_LENGTHS[0]), engine.MAX_LENGTH])
+def test_lookup_encoder_matches_encode_batch(encoder, max_length):
+    encoded, lengths, mask = encoder(MIXED_LENGTHS, max_length)
+    expected_encoded, expected_lengths, expected_mask = reference(MIXED_LENGTHS, max_length)
+
+    assert encoded.dtype == expected_encoded.dtype
+    assert torch.equal(encoded, expected_encoded)
+    assert torch.equal(lengths, expected_lengths)
+    assert torch.equal(mask, expected_mask)
+
+
+def test_lookup_encoder_matches_on_reference_sequences(encoder):
+    sequences = sorted(engine.reference_sequences(), key=len, reverse=True)
+    encoded, lengths, mask = encoder(sequences, engine.MAX_LENGTH)
+    expected_encoded, expected_lengths, expected_mask = reference(sequences, engine.MAX_LENGTH)
+
+    assert torch.equal(encoded, expected_encoded)
+    assert torch.equal(lengths, expected_lengths)
+    assert torch.equal(mask, expected_mask)
+
+
+@pytest.mark.parametrize("residue", ["X", "B", "*", "a", "Å"])
+def test_lookup_encoder_rejects_non_canonical_residues(encoder, residue):
+    batch = ["CARDYYGSSYWYFDVW", "GFTF" + residue + "SYAMSW", "QQYNSYPLT"]
+    assert encoder(batch, len(batch[0])) is None
+
+
+def test_encode_sequences_falls_back_to_encode_batch(encoder, monkeypatch):
+    # X is outside VALID_AA but known to parapred's encoding
+    batch = ["QQYNSYPLT", "CARDXYGSSYWYFDVW", "", "GFTFSSYAMSW"]
+    monkeypatch.setattr(engine, "_encoder", encoder)
+    num_sequences, indices, lengths, (encoded, mask, tensor_lengths) = engine.encode_sequences(batch)
+
+    assert num_sequences == 4
+    assert indices == [1, 3, 0]
+    assert lengths == [16, 11, 9]
+    expected_encoded, expected_lengths, expected_mask = reference([batch[i] for i in indices], 16)
+    assert torch.equal(encoded, expected_encoded)
+    assert torch.equal(tensor_lengths, expected_lengths)
+    assert torch.equal(mask, expected_mask)
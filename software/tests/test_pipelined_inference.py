@@ -0,0 +1,102 @@
+"""
+_predict_pipelined against running the batches one after another, as the batch
+loop did before: same results for every batch, yielded in batch order, whatever
+the helper threads' timing.
+"""
+
+import random
+import time
+
+import numpy as np
+import pytest
+
+import parapred_engine as engine
+
+
+@pytest.fixture
+def slow_steps(monkeypatch):
+    """Fake encode / forward / post-process steps with random delays; a batch's result is its sequences."""
+    rng = random.Random(0)
+
+    def pause():
+        time.sleep(rng.random() * 0.002)
+
+    def encode_sequences(batch):
+        pause()
+        if "fail" in batch:
+            raise ValueError("cannot encode")
+        return list(batch)
+
+    def run_model(model, prepared):
+        pause()
+        return [model(seq) for seq in prepared]
+
+    def extract_probabilities(prepared, probs):
+        pause()
+        return probs
+
+    monkeypatch.setattr(engine, "encode_sequences", encode_sequences)
+    monkeypatch.setattr(engine, "run_model", run_model)
+    monkeypatch.setattr(engine, "extract_probabilities", extract_probabilities)
+
+
+def test_pipelined_batches_come_in_order(slow_steps):
+    batches = [[f"S{i}-{j}" for j in range(i % 3 + 1)] for i in range(40)]
+    stats = engine.PipelineStats()
+    results = list(engine._predict_pipelined(str.lower, batches, stats))
+
+    assert [batch_num for batch_num, _ in results] == list(range(len(batches)))
+    assert [probs for _, probs in results] == [[seq.lower() for seq in batch] for batch in batches]
+    assert stats.batches == len(batches)
+    assert stats.encoded_depth <= engine.PIPELINE_DEPTH * len(batches)
+
+
+def test_pipelined_errors_are_raised_after_earlier_batches(slow_steps):
+    batches = [["A"], ["B"], ["fail"], ["C"]]
+    results = []
+    with pytest.raises(ValueError, match="cannot encode"):
+        for item in engine._predict_pipelined(str.lower, batches, engine.PipelineStats()):
+            results.append(item)
+    assert results == [(0, ["a"]), (1, ["b"])]
+
+
+def reference_predict_batch(model, flanked_sequences, max_length=40):
+    """predict_batch as the sequential batch loop ran it before, padded to max_length."""
+    import torch
+    from parapred.cnn import generate_mask
+    from parapred.model import clean_output
+    from parapred.preprocessing import encode_batch
+
+    valid = [(i, seq) for i, seq in enumerate(flanked_sequences) if seq and len(seq) <= max_length]
+    results = [np.array([]) for _ in flanked_sequences]
+    if not valid:
+        return results
+    valid_sorted = sorted(valid, key=lambda x: len(x[1]), reverse=True)
+    seqs_sorted = [seq for _, seq in valid_sorted]
+    encoded, lengths = encode_batch(seqs_sorted, max_length=max_length)
+    mask = generate_mask(encoded, lengths)
+    with torch.no_grad():
+        probs = model(encoded, mask, lengths)
+    for batch_idx, (orig_idx, seq) in enumerate(valid_sorted):
+        results[orig_idx] = clean_output(probs[batch_idx], len(seq)).numpy().flatten()
+    return results
+
+
+def test_pipelined_predictions_match_sequential_batches():
+    pytest.importorskip("torch")
+    pytest.importorskip("parapred")
+    engine.import_runtime()
+    model = engine.load_model()
+
+    sequences = sorted(engine.reference_sequences(), key=len, reverse=True)
+    # Mixed batches with empty and over-long sequences, as plan_batches never builds them
+    batches = [sequences[i:i + 7] for i in range(0, len(sequences), 7)]
+    batches.append(["", "CARDYYGSSYWYFDVW", "A" * (engine.MAX_LENGTH + 1), "QQYNSYPLT"])
+
+    results = dict(engine._predict_pipelined(model, batches, engine.PipelineStats()))
+    assert sorted(results) == list(range(len(batches)))
+    for batch_num, batch in enumerate(batches):
+        expected = reference_predict_batch(model, batch)
+        assert len(results[batch_num]) == len(expected)
+        for probs, expected_probs in zip(results[batch_num], expected):
+            np.testing.assert_allclose(probs, expected_probs, atol=1e-5)
@@ -0,0 +1,47 @@
+"""
+run_parapred_pipeline.py with a prediction cache that already holds every
+flanked CDR: the run must finish without importing torch / Parapred.
+"""
+
+import sys
+
+import numpy as np
+import polars as pl
+
+import parapred_engine as engine
+import run_parapred_pipeline as pipeline
+from prediction_cache import PredictionCache, hash_file
+
+ROWS = [
+    ("c1", "EVQLVESGGGLVQPGGSLRLSCAAS", "GFTFSSYA", "MSWVRQAPGKGLEWVS", "ISGSGGST",
+     "YYADSVKGRFTISRDNSKNTLYLQMNSLRAEDTAVYYC", "AKDRGYSSGWYFDY", "WGQGTLVTVSS"),
+    ("c2", "QVQLVQSGAEVKKPGASVKVSCKAS", "GYTFTSYG", "ISWVRQAPGQGLEWMG", "ISAYNGNT",
+     "NYAQKLQGRVTMTTDTSTSTAYMELRSLRSDDTAVYYC", "ARDLGYCSGGSCYSDY", "WGQGTLVTVSS"),
+    ("c3", "EVQLVESGGGLVQPGGSLRLSCAAS", "GFTFSSYA", "MSWVRQAPGKGLEWVS", "ISGSGGST",
+     "YYADSVKGRFTISRDNSKNTLYLQMNSLRAEDTAVYYC", "AKDRGYSSGWYFDY", "WGQGTLVTVSS"),
+]
+COLUMNS = ["clonotypeKey", "FR1", "CDR1", "FR2", "CDR2", "FR3", "CDR3", "FR4"]
+
+
+def test_all_cache_hits_skip_model_loading(tmp_path, monkeypatch):
+    df = pl.DataFrame(ROWS, schema=COLUMNS, orient="row")
+    df.write_csv(tmp_path / "input.tsv", separator="\t")
+
+    entries = pipeline.build_flanked_cdrs(df, pipeline.detect_chain_sets(COLUMNS))
+    sequences = [seq for seq in entries["flanked"].unique().to_list() if seq]
+    assert sequences
+    rng = np.random.default_rng(0)
+    cache = PredictionCache(str(tmp_path / "cache"), hash_file(pipeline.WEIGHTS_PATH), 1 << 20)
+    cache.put_many({seq: rng.random(len(seq), dtype=np.float32) for seq in sequences})
+    cache.close()
+
+    def fail():
+        raise AssertionError("Parapred runtime imported although every sequence is cached")
+
+    monkeypatch.setattr(engine, "import_runtime", fail)
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(sys, "argv", ["run_parapred_pipeline.py", "--cache-dir", str(tmp_path / "cache")])
+    pipeline.main()
+
+    paratopes = pl.read_csv(tmp_path / "paratope-sequences.tsv", separator="\t")
+    assert paratopes["clonotypeKey"].to_list() == ["c1", "c2", "c3"]
@@ -0,0 +1,133 @@
+"""
+process_results.py on a small hand-computed repertoire: every output table, the
+top-100 tables and the empty-input path, whose headers must match the tables
+create_empty_files.py writes when there is nothing to cluster.
+"""
+
+import os
+import subprocess
+import sys
+
+import polars as pl
+from polars.testing import assert_frame_equal
+
+from conftest import SRC
+
+CLONOTYPES = [
+    # clonotypeKey, label, sequence_0, paratope, flanked
+    ("k1", "C-1", "CARW1", "ACDEF", "xACDEFx"),
+    ("k2", "C-2", "CARW2", "ACDEY", "xACDEYx"),
+    # Shares k1's paratope, so it is not in the FASTA nor in clusters.tsv
+    ("k3", "C-3", "CARW3", "ACDEF", "xACDEFx"),
+    ("k4", "C-4", "CARW4", "GHIK", "xGHIKx"),
+    # No paratope: not clustered
+    ("k5", "C-5", "CARW5", "", ""),
+]
+ABUNDANCES = [("S1", "k1", 10), ("S1", "k2", 30), ("S1", "k4", 60),
+              ("S2", "k3", 5), ("S2", "k4", 15), ("S2", "k5", 100)]
+CLUSTERS = [("s-k1", "s-k1"), ("s-k1", "s-k2"), ("s-k4", "s-k4")]
+
+CLUSTER_TO_SEQ = {
+    "clusterId": ["k1", "k4"], "clusterLabel": ["CL-1", "CL-4"], "size": [3, 1],
+    "sequence_0": ["CARW1", "CARW4"], "paratope_sequence": ["ACDEF", "GHIK"],
+    "flanked_sequence": ["xACDEFx", "xGHIKx"],
+}
+ABUNDANCES_OUT = {
+    "sampleId": ["S1", "S1", "S2", "S2"], "clusterId": ["k1", "k4", "k1", "k4"],
+    "abundance": [40, 60, 5, 15], "abundance_normalized": [0.4, 0.6, 0.25, 0.75],
+}
+CLUSTER_RADIUS = {"clusterId": ["k1", "k4"], "clusterRadius": [0.2, 0.0]}
+
+INT_COLUMNS = ["size", "link", "abundance", "abundance_per_cluster"]
+FLOAT_COLUMNS = ["abundance_normalized", "abundance_fraction_per_cluster", "distanceToCentroid",
+                 "clusterRadius", "meanPairwiseDistance", "medianPairwiseDistance",
+                 "p90PairwiseDistance", "mostCommonParatopeFraction"]
+
+
+def inputs(clonotypes, abundances):
+    labels = {key: (label, sequence) for key, label, sequence, _, _ in clonotypes}
+    clone_table = [{"sampleId": sample, "clonotypeKey": key, "clonotypeKeyLabel": labels[key][0],
+                    "sequence_0": labels[key][1], "abundance": abundance}
+                   for sample, key, abundance in abundances]
+    paratopes = [{"clonotypeKey": key, "paratope_sequence": paratope, "flanked_sequence": flanked}
+                 for key, _, _, paratope, flanked in clonotypes]
+    return clone_table, paratopes
+
+
+def assert_table(read_table, name, expected):
+    actual = read_table(name)
+    actual = actual.with_columns(
+        [pl.col(column).cast(pl.Int64) for column in INT_COLUMNS if column in actual.columns]
+        + [pl.col(column).cast(pl.Float64) for column in FLOAT_COLUMNS if column in actual.columns]
+    )
+    expected = pl.DataFrame(expected).select(actual.columns)
+    key = [column for column in ("sampleId", "clusterId", "clonotypeKey") if column in actual.columns]
+    assert_frame_equal(actual.sort(key), expected.sort(key), check_dtypes=False)
+
+
+def test_all_tables(tmp_path, process_results):
+    read_table = process_results(tmp_path, CLUSTERS, *inputs(CLONOTYPES, ABUNDANCES))
+
+    assert_table(read_table, "cluster-to-seq.tsv", CLUSTER_TO_SEQ)
+    assert_table(read_table, "clone-to-cluster.tsv", {
+        "clusterId": ["k1", "k1", "k1", "k4"], "clonotypeKey": ["k1", "k2", "k3", "k4"],
+        "clusterLabel": ["CL-1", "CL-1", "CL-1", "CL-4"], "link": [1, 1, 1, 1],
+    })
+    assert_table(read_table, "abundances.tsv", ABUNDANCES_OUT)
+    assert_table(read_table, "abundances-per-cluster.tsv", {
+        "clusterId": ["k1", "k4"], "abundance_per_cluster": [45, 75],
+        "abundance_fraction_per_cluster": [0.375, 0.625],
+    })
+    assert_table(read_table, "paratope-sequences.tsv", {
+        "clonotypeKey": ["k1", "k2", "k3", "k4", "k5"],
+        "paratope_sequence": ["ACDEF", "ACDEY", "ACDEF", "GHIK", ""],
+        "flanked_sequence": ["xACDEFx", "xACDEYx", "xACDEFx", "xGHIKx", ""],
+    })
+    assert_table(read_table, "distance_to_centroid.tsv", {
+        "clonotypeKey": ["k1", "k2", "k3", "k4"], "clusterId": ["k1", "k1", "k1", "k4"],
+        "clonotypeKeyLabel": ["C-1", "C-2", "C-3", "C-4"], "clusterLabel": ["CL-1", "CL-1", "CL-1", "CL-4"],
+        "distanceToCentroid": [0.0, 0.2, 0.0, 0.0],
+    })
+    assert_table(read_table, "cluster-radius.tsv", CLUSTER_RADIUS)
+    # k1: member pairs (k1, k2) and (k2, k3) at 1/5, (k1, k3) at 0
+    assert_table(read_table, "cluster-diversity.tsv", {
+        "clusterId": ["k1", "k4"], "meanPairwiseDistance": [0.4 / 3, 0.0],
+        "medianPairwiseDistance": [0.2, 0.0], "p90PairwiseDistance": [0.2, 0.0],
+        "mostCommonParatope": ["ACDEF", "GHIK"], "mostCommonParatopeFraction": [2 / 3, 1.0],
+        "pairsSampled": ["false", "false"],
+    })
+    # Fewer than 100 clusters: the top tables hold all of them
+    assert_table(read_table, "abundances-top.tsv", ABUNDANCES_OUT)
+    assert_table(read_table, "cluster-to-seq-top.tsv", CLUSTER_TO_SEQ)
+    assert_table(read_table, "cluster-radius-top.tsv", CLUSTER_RADIUS)
+
+
+def test_top_tables_keep_the_100_most_abundant_clusters(tmp_path, process_results):
+    # 102 singleton clusters; k0 and k1 are the least abundant
+    clonotypes = [(f"k{i}", f"C-{i}", f"CARW{i}", f"ACDEF{i}", f"xACDEF{i}x") for i in range(102)]
+    abundances = [("S1", f"k{i}", i + 1) for i in range(102)]
+    clusters = [(f"s-k{i}", f"s-k{i}") for i in range(102)]
+    read_table = process_results(tmp_path, clusters, *inputs(clonotypes, abundances))
+
+    top = {f"k{i}" for i in range(2, 102)}
+    assert read_table("cluster-to-seq.tsv").height == 102
+    for name in ("abundances-top.tsv", "cluster-to-seq-top.tsv", "cluster-radius-top.tsv"):
+        assert set(read_table(name)["clusterId"]) == top
+
+
+def test_empty_clusters_match_the_empty_files_headers(tmp_path, process_results):
+    read_table = process_results(tmp_path / "results", [], *inputs(CLONOTYPES, ABUNDANCES))
+
+    os.makedirs(tmp_path / "empty")
+    subprocess.run([sys.executable, os.path.join(SRC, "create_empty_files.py"), "--num-sequences", "1"],
+                   cwd=tmp_path / "empty", check=True, capture_output=True)
+
+    names = sorted(os.listdir(tmp_path / "empty"))
+    assert len(names) == 11
+    for name in names:
+        empty = pl.read_csv(tmp_path / "empty" / name, separator="\t")
+        assert empty.height == 0
+        results = read_table(name)
+        assert results.columns == empty.columns, name
+        if name != "paratope-sequences.tsv":
+            assert results.height == 0, name
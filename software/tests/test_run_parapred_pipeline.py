@@ -0,0 +1,273 @@
+"""
+run_parapred_pipeline.py end to end from saved probabilities (no inference), and
+its outputs through process_results.py. The column-wise stages are checked
+against the per-row implementation they replaced, kept here as reference_*.
+"""
+
+import os
+import re
+import subprocess
+import sys
+
+import numpy as np
+import polars as pl
+import pytest
+
+from conftest import SRC
+from fasta import read_fasta
+from parapred_engine import MAX_LENGTH
+from run_parapred_pipeline import (
+    ProbabilityStore,
+    build_flanked_cdrs,
+    build_paratope_rows,
+    cdr_residue_matrix,
+    detect_chain_sets,
+    gather_cdr_probabilities,
+    read_chunks,
+)
+
+REGIONS = ["FR1", "CDR1", "FR2", "CDR2", "FR3", "CDR3", "FR4"]
+TWO_CHAINS = [f"{region}_{chain}" for chain in range(2) for region in REGIONS]
+
+_INVALID_AA_RE = re.compile(r"[^ACDEFGHIKLMNPQRSTVWY]")
+
+# FR/CDR values exercising flank slicing and sanitizing
+TWO_CHAIN_ROWS = [
+    ("k1", "EVQLV", "GFTF", "WVRQ", "ISGS", "RFTI", "CARDY", "WGQG",
+     "DIQMT", "QSIS", "WYQQ", "AAS", "GVPS", "QQSY", "FGQG"),
+    # Empty and one-residue FRs: short or no flanks
+    ("k2", "", "GFTF", "W", "ISGS", "", "CARDY", "", "D", "QSIS", "", "AAS", "G", "QQSY", "F"),
+    # Missing CDRs, and a CDR without any valid residue
+    ("k3", "EVQLV", None, "WVRQ", "ISGS", "RFTI", "", "WGQG", "DIQMT", "xx*", "WYQQ", None, "GVPS", "QQSY", "FGQG"),
+    # Gaps, stops, lower case and unknown residues are dropped
+    ("k4", "EV-QL*V", "G.FtF", "W_VRQ", "IS*GS", "RFTIx", "CA-RDY", "W GQG",
+     "DIQMT", "QS-IS", "WYQQ", "A*AS", "GVPS", "QQ SY", "FGQG"),
+    # Flanked CDR3 longer than Parapred's MAX_LENGTH
+    ("k5", "EVQLV", "GFTF", "WVRQ", "ISGS", "RFTI", "CAR" + "DY" * 25, "WGQG",
+     "DIQMT", "QSIS", "WYQQ", "AAS", "GVPS", "QQSY", "FGQG"),
+]
+
+
+def run_pipeline(directory, rows, *args):
+    """Runs the pipeline on rows (clonotypeKey, FR1, CDR1, ..., FR4) with every residue at 0.9."""
+    os.makedirs(directory, exist_ok=True)
+    df = pl.DataFrame(rows, schema=["clonotypeKey", *REGIONS], orient="row")
+    df.write_csv(os.path.join(directory, "input.tsv"), separator="\t")
+
+    entries = build_flanked_cdrs(df, detect_chain_sets(df.columns))
+    sequences = entries.filter(pl.col("flanked") != "")["flanked"].unique(maintain_order=True).to_list()
+    store = ProbabilityStore()
+    for row in store.add(sequences):
+        store.set(row, np.full(len(sequences[row]), 0.9, dtype=np.float32))
+    store.save(os.path.join(directory, "probabilities.npz"))
+
+    subprocess.run([sys.executable, os.path.join(SRC, "run_parapred_pipeline.py"),
+                    "--load-probabilities", "probabilities.npz", *args],
+                   cwd=directory, check=True, capture_output=True)
+    return os.path.join(directory, "output.fasta"), os.path.join(directory, "paratope-sequences.tsv")
+
+
+def test_clonotypes_sharing_a_paratope(tmp_path, process_results):
+    rows = [
+        ("k1", "EVQLV", "GFTF", "WVRQ", "ISGS", "RFTI", "CARDY", "WGQG"),
+        # Same CDRs as k1 with other frameworks: another flanked sequence, same paratope
+        ("k2", "QVQLQ", "GFTF", "WIRQ", "ISGS", "KATL", "CARDY", "WGKG"),
+        # Same as k1, in the next chunk
+        ("k3", "EVQLV", "GFTF", "WVRQ", "ISGS", "RFTI", "CARDY", "WGQG"),
+        ("k4", "EVQLV", "GFTF", "WVRQ", "ISGS", "RFTI", "CARDF", "WGQG"),
+        ("k5", "EVQLV", "GFTF", "WVRQ", "ISGS", "RFTI", "CAKKK", "WGQG"),
+    ]
+    fasta, paratopes_tsv = run_pipeline(tmp_path / "parapred", rows, "--chunk-size", "2")
+
+    # One record per distinct paratope, named after the first clonotype that has it
+    assert read_fasta(fasta) == {"s-k1": "GFTFISGSCARDY", "s-k4": "GFTFISGSCARDF", "s-k5": "GFTFISGSCAKKK"}
+    paratopes = pl.read_csv(paratopes_tsv, separator="\t")
+    assert paratopes["paratope_sequence"].to_list() == [
+        "GFTFISGSCARDY", "GFTFISGSCARDY", "GFTFISGSCARDY", "GFTFISGSCARDF", "GFTFISGSCAKKK"
+    ]
+
+    # MMseqs2 clusters k4's paratope with k1's
+    clusters = [("s-k1", "s-k1"), ("s-k1", "s-k4"), ("s-k5", "s-k5")]
+    abundances = [("S1", "k1", 1), ("S1", "k2", 2), ("S1", "k3", 3), ("S1", "k4", 4), ("S1", "k5", 10),
+                  ("S2", "k2", 5)]
+    clone_table = [{"sampleId": sample, "clonotypeKey": key, "clonotypeKeyLabel": f"C-{key}",
+                    "sequence_0": "CARDY", "abundance": abundance} for sample, key, abundance in abundances]
+    read_table = process_results(tmp_path / "results", clusters, clone_table, paratopes.to_dicts())
+
+    assert sorted(read_table("clone-to-cluster.tsv").select("clonotypeKey", "clusterId").iter_rows()) == [
+        ("k1", "k1"), ("k2", "k1"), ("k3", "k1"), ("k4", "k1"), ("k5", "k5")
+    ]
+    assert sorted(read_table("cluster-to-seq.tsv").select("clusterId", "size").iter_rows()) == [
+        ("k1", "4"), ("k5", "1")
+    ]
+    assert sorted(read_table("abundances.tsv").select(
+        "sampleId", "clusterId", "abundance", pl.col("abundance_normalized").cast(pl.Float64)
+    ).iter_rows()) == [("S1", "k1", "10", 0.5), ("S1", "k5", "10", 0.5), ("S2", "k1", "5", 1.0)]
+    distances = dict(read_table("distance_to_centroid.tsv").select(
+        "clonotypeKey", pl.col("distanceToCentroid").cast(pl.Float64)
+    ).iter_rows())
+    assert distances == {"k1": 0.0, "k2": 0.0, "k3": 0.0, "k4": 1 / 13, "k5": 0.0}
+
+
+def reference_build_flanked_cdrs(row, cdr_cols, fr_cols):
+    """build_flanked_cdrs of one row, as it ran per row before (row is a dict)."""
+    results = []
+    for left_fr, cdr, right_fr in zip(fr_cols[:3], cdr_cols, fr_cols[1:]):
+        left_seq = _INVALID_AA_RE.sub("", str(row.get(left_fr, "") or ""))
+        cdr_seq = _INVALID_AA_RE.sub("", str(row.get(cdr, "") or ""))
+        right_seq = _INVALID_AA_RE.sub("", str(row.get(right_fr, "") or ""))
+        if not cdr_seq:
+            results.append(("", cdr_seq, 0, 0))
+            continue
+        left_flank = left_seq[-2:] if len(left_seq) >= 2 else left_seq
+        right_flank = right_seq[:2] if len(right_seq) >= 2 else right_seq
+        flanked = left_flank + cdr_seq + right_flank
+        results.append((flanked, cdr_seq, len(left_flank), len(left_flank) + len(cdr_seq)))
+    return results
+
+
+def reference_entries(rows, chain_sets):
+    return [
+        (row_idx, *entry)
+        for row_idx, row in enumerate(rows)
+        for cdr_cols, fr_cols in chain_sets
+        for entry in reference_build_flanked_cdrs(row, cdr_cols, fr_cols)
+    ]
+
+
+@pytest.mark.parametrize("columns", [TWO_CHAINS, REGIONS])
+def test_build_flanked_cdrs_matches_per_row_reference(columns):
+    rows = [dict(zip(["clonotypeKey", *columns], row)) for row in TWO_CHAIN_ROWS]
+    df = pl.DataFrame(rows, schema={"clonotypeKey": pl.String, **{c: pl.String for c in columns}})
+    chain_sets = detect_chain_sets(df.columns)
+
+    entries = build_flanked_cdrs(df, chain_sets)
+    assert entries.select("row", "flanked", "cdr_seq", "cdr_start", "cdr_end").rows() == \
+        reference_entries(rows, chain_sets)
+
+
+def test_build_flanked_cdrs_reads_missing_columns_as_empty():
+    # No FR columns at all: CDRs without flanks
+    rows = [{"clonotypeKey": "k1", "CDR1": "GFTF", "CDR2": "", "CDR3": "CARDY"}]
+    df = pl.DataFrame(rows)
+    chain_sets = detect_chain_sets(df.columns)
+
+    entries = build_flanked_cdrs(df, chain_sets)
+    assert entries.select("row", "flanked", "cdr_seq", "cdr_start", "cdr_end").rows() == \
+        reference_entries(rows, chain_sets)
+    assert entries["flanked"].to_list() == ["GFTF", "", "CARDY"]
+
+
+def test_build_flanked_cdrs_of_read_chunks_treats_na_cells_as_empty(tmp_path):
+    pd = pytest.importorskip("pandas")
+    lines = [
+        "clonotypeKey\tFR1\tCDR1\tFR2\tCDR2\tFR3\tCDR3\tFR4",
+        "k1\tNA\tGFTF\tWVRQ\tN/A\tRFTI\tCARDY\tnan",
+        "k2\tEVQLV\t\tNULL\tISGS\t#N/A\tNaN\tWGQG",
+    ]
+    (tmp_path / "input.tsv").write_text("\n".join(lines) + "\n")
+
+    # Before: pandas read_csv with its default NA values, then fillna("")
+    rows = pd.read_csv(tmp_path / "input.tsv", sep="\t").fillna("").to_dict("records")
+    df = pl.concat(read_chunks(tmp_path / "input.tsv", 100))
+    chain_sets = detect_chain_sets(df.columns)
+
+    assert build_flanked_cdrs(df, chain_sets).select("row", "flanked", "cdr_seq", "cdr_start", "cdr_end").rows() \
+        == reference_entries(rows, chain_sets)
+
+
+def reference_extract_paratope(cdr_seq, probs, cdr_start, cdr_end, threshold):
+    """X-masked paratope of one entry, as extract_paratope ran per residue before."""
+    if not cdr_seq or len(probs) == 0:
+        return ""
+    residues = []
+    for i in range(cdr_start, min(cdr_end, len(probs))):
+        if i - cdr_start < len(cdr_seq):
+            residues.append(cdr_seq[i - cdr_start] if probs[i] >= threshold else "X")
+    return "".join(residues)
+
+
+def reference_paratope_rows(entries, probs, entries_per_row, threshold):
+    """(paratope_sequence, flanked_sequence, fallback) per row and the CDR probabilities, as before."""
+    rows, cdr_probs = [], []
+    for start in range(0, len(entries), entries_per_row):
+        parts = [(reference_extract_paratope(cdr_seq, probs[i], cdr_start, cdr_end, threshold), cdr_seq, flanked)
+                 for i, (_, flanked, cdr_seq, cdr_start, cdr_end) in
+                 enumerate(entries[start:start + entries_per_row], start)]
+        paratope = "".join(part[0] for part in parts)
+        cdr_sequence = "".join(part[1] for part in parts)
+        fallback = (not paratope or all(c == "X" for c in paratope)) and bool(cdr_sequence)
+        rows.append((cdr_sequence if fallback else paratope, "".join(part[2] for part in parts), fallback))
+    for (_, _, cdr_seq, cdr_start, cdr_end), entry_probs in zip(entries, probs):
+        if len(entry_probs) and cdr_seq:
+            cdr_probs.extend(entry_probs[i] for i in range(cdr_start, min(cdr_end, len(entry_probs)))
+                             if i - cdr_start < len(cdr_seq))
+    return rows, cdr_probs
+
+
+@pytest.mark.parametrize("threshold", [0.0, 0.3, 0.5, 0.95, 1.1])
+def test_paratopes_and_histogram_match_per_residue_reference(threshold):
+    rows = [dict(zip(["clonotypeKey", *TWO_CHAINS], row)) for row in TWO_CHAIN_ROWS]
+    df = pl.DataFrame(rows, schema={"clonotypeKey": pl.String, **{c: pl.String for c in TWO_CHAINS}})
+    entries = build_flanked_cdrs(df, detect_chain_sets(df.columns))
+
+    # Random predictions of every sequence Parapred takes; longer ones stay unpredicted
+    rng = np.random.default_rng(0)
+    sequences = entries.filter(pl.col("flanked") != "")["flanked"].unique(maintain_order=True).to_list()
+    store = ProbabilityStore()
+    predictions = {}
+    for row, seq in zip(store.add(sequences), sequences):
+        if len(seq) <= MAX_LENGTH:
+            predictions[seq] = rng.random(len(seq), dtype=np.float32)
+            store.set(row, predictions[seq])
+    entries = entries.with_columns(
+        pl.Series("uidx", [store.index.get(seq, -1) for seq in entries["flanked"]], dtype=pl.Int64)
+    )
+
+    cdr_probs, valid, predicted = gather_cdr_probabilities(entries, store.probs, store.lengths)
+    cdr_residues = cdr_residue_matrix(entries, cdr_probs.shape[1])
+    paratope_rows = build_paratope_rows(df, entries, cdr_residues, cdr_probs, valid, predicted, threshold)
+    bin_edges = np.linspace(0.0, 1.0, 11)
+
+    expected_rows, expected_probs = reference_paratope_rows(
+        entries.select("row", "flanked", "cdr_seq", "cdr_start", "cdr_end").rows(),
+        [predictions.get(seq, np.array([])) for seq in entries["flanked"]],
+        6,
+        threshold,
+    )
+    assert paratope_rows.select("paratope_sequence", "flanked_sequence", "fallback").rows() == expected_rows
+    assert np.array_equal(np.histogram(cdr_probs[valid], bins=bin_edges)[0],
+                          np.histogram(np.array(expected_probs), bins=bin_edges)[0])
+
+
+@pytest.mark.parametrize("chunk_rows", [1, 4, 7, 23, 1000])
+def test_read_chunks_splits_the_whole_input(tmp_path, chunk_rows):
+    pd = pytest.importorskip("pandas")
+    values = ["GFTF", "NA", "", "0001", "n/a", "CARDY"]
+    lines = ["clonotypeKey\tCDR1\tCDR3"] + [
+        f"k{i:04d}\t{values[i % len(values)]}\t{values[(i * 5) % len(values)]}" for i in range(23)
+    ]
+    (tmp_path / "input.tsv").write_text("\n".join(lines) + "\n")
+
+    chunks = list(read_chunks(tmp_path / "input.tsv", chunk_rows))
+    # Chunks reach chunk_rows, only the last one may be shorter
+    assert all(len(chunk) >= chunk_rows for chunk in chunks[:-1])
+    assert 0 < len(chunks[-1])
+    # Together they are the whole file, as pandas read it before: values as text, NA cells empty
+    expected = pd.read_csv(tmp_path / "input.tsv", sep="\t", dtype=str).fillna("")
+    assert pl.concat(chunks).rows() == list(expected.itertuples(index=False, name=None))
+
+
+def test_outputs_do_not_depend_on_the_chunk_size(tmp_path):
+    residues = ["GFTF", "GYTF", "ISGS", "INPS", "CARDY", "CAKKK", "CARDF"]
+    rows = [("k%d" % i, "EVQLV", residues[i % 2], "WVRQ", residues[2 + i % 3], "RFTI", residues[4 + i % 5 % 3],
+             "WGQG") for i in range(30)]
+    outputs = {}
+    for chunk_size in (1, 4, 1000):
+        directory = tmp_path / str(chunk_size)
+        run_pipeline(directory, rows, "--chunk-size", str(chunk_size))
+        outputs[chunk_size] = [(directory / name).read_text() for name in
+                               ("output.fasta", "paratope-sequences.tsv", "probability-distribution.tsv",
+                                "probability-profile.tsv", "fallbacks.tsv")]
+    assert outputs[1] == outputs[1000]
+    assert outputs[4] == outputs[1000]
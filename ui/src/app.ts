@@ -8,6 +8,13 @@ import ProbDistPage from './pages/ProbDistPage.vue';
 
 export const sdkPlugin = defineApp(model, (app) => {
   app.model.args.customBlockLabel ??= '';
+  // Blocks created before the per-CDR profile view have no state for it
+  app.model.ui.graphStateProbProfile ??= {
+    title: 'Parapred score by CDR position',
+    template: 'line',
+    currentTab: null,
+    layersSettings: {},
+  };
 
   syncDefaultBlockLabel(app.model);
 